@@ -1,7 +1,7 @@
 #!/usr/bin/python
 
 # Import standard Python modules
-import os,sys
+import os,sys,glob,time,multiprocessing
 
 # Debug info
 print('Python version: %s' % unicode(sys.version_info))
@@ -11,16 +11,13 @@ print('Python version: %s' % unicode(sys.version_info))
 oldworkingdir = os.getcwdu()
 os.chdir(os.path.abspath(os.path.dirname(sys.argv[0])))
 
-# Import MatPlotLib to configure key parameters
-import matplotlib
-matplotlib.use('Qt4Agg')
-#matplotlib.rcParams['numerix'] = 'numpy'
+# Now import our custom modules. Modules that are slow to import (matplotlib, core.report,
+# core.result with xmlplot and the NetCDF backends) are imported only when needed.
+# Reports are rendered with the pure Agg backend of matplotlib, so no display is needed.
+import xmlstore.datatypes
+import core.common, core.scenario
 
-# Now import our custom modules
-import xmlstore
-import core.common, core.scenario, core.result, core.report
-
-if len(sys.argv)==1:
+def printHelp():
     print(
 """
 =============================================================================
@@ -33,8 +30,10 @@ from an existing result.
 -----------------------------------------------------------------------------
 Syntax (arguments between square brackets are optional):
 
-batch <path> [-writeresult <resultfile> [-cdf]] [-writereport <reportdir>]
-    [-gotmoutput]
+batch <path> [<path> ...] [-writeresult <resultfile> [-cdf]]
+    [-writereport <reportdir> [-incremental]] [-j <jobs>] [-gotmoutput] [-cache]
+    [-inmemory] [-checkpoint <checkpointdir> [-checkpointinterval <seconds>]]
+    [-resume <checkpointdir>] [-profile] [-tmpfs]
 -----------------------------------------------------------------------------
 <path>
     Path to an existing GOTM-GUI scenario or result. This can be a
@@ -43,6 +42,11 @@ batch <path> [-writeresult <resultfile> [-cdf]] [-writereport <reportdir>]
     and .gotmresult are actually ZIP archives). If a scenario is specified,
     it will first be simulated; if a result is specified the existing data
     will be used.
+    Multiple paths may be specified, and each path may contain wildcards
+    (e.g., *.gotmscenario). A path preceded by @ (e.g., @scenarios.txt)
+    refers to a manifest: a text file with one path per line. Empty lines
+    and lines starting with # are ignored; relative paths are taken
+    relative to the directory of the manifest.
 
 -writeresult <resultfile>
     Specifies that a result file must be written to the path <resultfile>
@@ -56,117 +60,319 @@ batch <path> [-writeresult <resultfile> [-cdf]] [-writereport <reportdir>]
     Specifies that a report must be written to the directory <reportdir>.
     If this directory does not exist, it will be created.
 
+    If multiple paths are processed, <resultfile> and <reportdir> must be
+    naming templates that produce a different path for every input. The
+    templates may contain {name} (the name of the input file without
+    extension), {index} (the number of the input, starting at 0) and {dir}
+    (the directory of the input), e.g., -writeresult results/{name}.nc.
+    This applies to <checkpointdir> as well.
+
+-incremental
+    Specifies that figures in an existing report in <reportdir> must be
+    reused if their inputs (data, figure settings, resolution and font) are
+    unchanged. Only figures that changed are rendered again; the HTML page
+    is always rebuilt. Only used if -writereport is specified.
+
+-j <jobs>
+    Specifies the number of worker processes that simulate the specified
+    paths in parallel. The default is 1: all paths are processed one after
+    the other in the current process. Modules are loaded only once per
+    process, not once per path. If 1, the figures of reports are rendered
+    in parallel instead, by one worker process per CPU core.
+
 -gotmoutput
     Specifies that the original output of GOTM must be shown, rather than
     percentages and time remaining. Only used if a path to a scenario is
     specified as first argument.
+
+-cache
+    Specifies that scenarios converted to GOTM namelists and simulation
+    results must be kept in on-disk caches. Simulating an identical scenario
+    with the same GOTM library again then returns the stored result, and a
+    scenario that was converted before skips the conversion. Use
+    util/cachetool.py to inspect or clean the caches.
+
+-inmemory
+    Specifies that the results of the simulation must be kept in memory,
+    rather than written to NetCDF by GOTM and read back afterwards. Only
+    the main depth profiles (temperature, salinity, velocities, turbulence)
+    are available in this mode. A NetCDF file is written only if a result
+    file is requested with -writeresult.
+
+-checkpoint <checkpointdir>
+    Specifies that the state of the simulation must be saved regularly to
+    the directory <checkpointdir>, and also when the simulation is stopped
+    with a termination signal (e.g., by the walltime limit of a job
+    scheduler). The simulation can then be continued with -resume.
+
+-checkpointinterval <seconds>
+    Specifies the interval between checkpoints in seconds of wall time.
+    The default is 600. Only used if -checkpoint is specified.
+
+-resume <checkpointdir>
+    Specifies that the simulation must continue from the checkpoint in the
+    directory <checkpointdir>, rather than start from the beginning. The
+    scenario must be the one that the checkpoint was created for; this is
+    verified. This may be combined with -checkpoint <checkpointdir> to keep
+    checkpointing.
+
+-profile
+    Specifies that the time spent in the different phases of the
+    simulation (scenario conversion, namelist writing, GOTM initialization,
+    time stepping, GOTM finalization, reading output) must be recorded and
+    shown. The timings are also stored in the result file, if written.
+
+-tmpfs
+    Specifies that the namelists, data files and output of GOTM must be
+    kept in temporary directories on a memory-backed file system
+    (/dev/shm), rather than in the default temporary directory. This
+    avoids writing and reading back many small files when that directory
+    is on a slow or network file system. Alternatively, the directory to
+    use can be set with environment variable GOTMGUI_STAGINGDIR. Note that
+    the output of GOTM is then held in memory until it is written.
 =============================================================================
 """)
-    sys.exit(1)
-
-# Parse command line arguments
-cdf = core.common.getSwitchArgument('-cdf')
-gotmoutput = core.common.getSwitchArgument('-gotmoutput')
-resultpath = core.common.getNamedArgument('-writeresult')
-reportpath = core.common.getNamedArgument('-writereport')
-path = os.path.normpath(os.path.join(oldworkingdir, sys.argv[1]))
-del sys.argv[1]
-
-# Warn for remaining (i.e., unused) command line arguments.
-if len(sys.argv)>1:
-    print('\n')
-    for arg in sys.argv[1:]:
-        print('WARNING: command line argument "%s" is unknown and will be ignored.' % arg)
-    print('Run "batch" without arguments to see a list of accepted arguments.\n')
 
-container = None
+def getInputPaths(args):
+    """Returns the absolute paths of all inputs specified on the command line, expanding
+    wildcards and manifests (@<file>).
+    """
+    def expand(arg,basedir):
+        if arg.startswith('@'):
+            manifestpath = os.path.normpath(os.path.join(basedir,arg[1:]))
+            paths = []
+            with open(manifestpath,'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'): paths += expand(line,os.path.dirname(manifestpath))
+            return paths
+        path = os.path.normpath(os.path.join(basedir,arg))
+        if glob.has_magic(path):
+            matches = sorted(glob.glob(path))
+            if not matches: print('WARNING: "%s" does not match any file or directory.' % arg)
+            return matches
+        return [path]
+    paths = []
+    for arg in args: paths += expand(arg,oldworkingdir)
+    return paths
+
+def getOutputPath(template,index,path):
+    """Returns the output path for an input, based on a naming template (see -writeresult).
+    """
+    if template is None: return None
+    name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+    return os.path.normpath(os.path.join(oldworkingdir, template.format(name=name,index=index,dir=os.path.dirname(path))))
+
+def processPath(index,path,options):
+    """Simulates the scenario at the specified path (or uses the existing result), and writes
+    the result and/or report, as specified in the options dictionary. Returns a tuple with
+    the index, path, return code, error message, simulation time and total time.
+    """
+    time_start = time.time()
+    simulationtime = 0.
+    prefix = options['prefix'] and '%s: ' % os.path.basename(path) or ''
 
-try:
-    # Open specified path as data container.
-    container = xmlstore.datatypes.DataContainer.fromPath(path)
-    
     try:
-        if core.scenario.Scenario.canBeOpened(container):
-            # Try to load scenario.
-            scen = core.scenario.Scenario.fromSchemaName(core.scenario.guiscenarioversion)
-            scen.loadAll(container)
-            res = None
-        elif core.result.Result.canBeOpened(container):
-            # Try to load result.
-            res = core.result.Result()
-            res.load(container)
-            scen = res.scenario.addref()
+        # Open specified path as data container.
+        container = xmlstore.datatypes.DataContainer.fromPath(path)
+
+        try:
+            if core.scenario.Scenario.canBeOpened(container):
+                # Try to load scenario.
+                scen = core.scenario.Scenario.fromSchemaName(core.scenario.guiscenarioversion)
+                scen.loadAll(container)
+                res = None
+            elif core.common.isResultContainer(container):
+                # Try to load result.
+                import core.result
+                res = core.result.Result()
+                res.load(container)
+                scen = res.scenario.addref()
+            else:
+                raise Exception('"%s" does not contain a scenario or result.' % path)
+        finally:
+            container.release()
+
+    except Exception as e:
+        print('%sCannot open "%s". Error: %s' % (prefix,path,e))
+        return index,path,1,str(e),simulationtime,time.time()-time_start
+
+    # Callback for simulation progress notifications.
+    def printprogress(progress,remaining):
+        print('%s%5.1f %% done, %.0f seconds remaining...' % (prefix,progress*100,remaining))
+
+    # Simulate
+    if res is None:
+        if options['gotmoutput'] or not options['showprogress']:
+            progcallback = None
         else:
-            raise Exception('"%s" does not contain a scenario or result.' % path)
-    finally:
-        container.release()
-        
-except Exception as e:
-    print('Cannot open "%s". Error: %s' % (path,e))
-    sys.exit(1)
-
-# Callback for simulation progress notifications.
-def printprogress(progress,remaining):
-    print('%5.1f %% done, %.0f seconds remaining...' % (progress*100,remaining))
-
-# Simulate
-if res is None:
-    if gotmoutput:
-        progcallback = None
-    else:
-        progcallback = printprogress
-    import core.simulator
-    res = core.simulator.simulate(scen,progresscallback=progcallback,redirect=not gotmoutput)
+            progcallback = printprogress
+
+        # If checkpointing, stop at the next slab boundary when a termination signal is received,
+        # so the final checkpoint can be written.
+        checkpointpath = getOutputPath(options['checkpointpath'],index,path)
+        contcallback = None
+        if checkpointpath is not None:
+            import signal
+            terminated = []
+            def onterminate(signum,frame):
+                print('%sTermination signal received; writing checkpoint and stopping simulation.' % prefix)
+                terminated.append(signum)
+            signal.signal(signal.SIGTERM,onterminate)
+            contcallback = lambda: not terminated
+
+        import core.simulator, core.cache
+        cache,resultcache = None,None
+        if options['usecache']: cache,resultcache = core.cache.ScenarioCache(),core.cache.ResultCache()
+        time_simstart = time.time()
+        res = core.simulator.simulate(scen,progresscallback=progcallback,continuecallback=contcallback,redirect=not options['gotmoutput'],cache=cache,resultcache=resultcache,inmemory=options['inmemory'],
+                                      checkpointpath=checkpointpath,checkpointinterval=options['checkpointinterval'],resumefrom=getOutputPath(options['resumepath'],index,path),profile=options['profile'])
+        simulationtime = time.time()-time_simstart
+        if res.returncode==0:
+            print('%sSimulation completed successfully.' % prefix)
+        elif res.returncode==1:
+            print('%sSimulation failed. Error: %s.\n\nGOTM output:\n%s' % (prefix,res.errormessage,res.stderr))
+        elif res.returncode==2:
+            print('%sSimulation was cancelled by user.' % prefix)
+            if checkpointpath is not None: print('%sUse -resume "%s" to continue the simulation.' % (prefix,checkpointpath))
+        else:
+            assert False, 'GOTM simulator returned unknown code %i.' % res.returncode
+        if options['profile']: print('%sTiming profile:\n%s' % (prefix,res.getTimingReport()))
+
+    returncode,errormessage = res.returncode,res.errormessage
     if res.returncode==0:
-        print('Simulation completed successfully.')
-    elif res.returncode==1:
-        print('Simulation failed. Error: %s.\n\nGOTM output:\n%s' % (res.errormessage,res.stderr))
-    elif res.returncode==2:
-        print('Simulation was cancelled by user.')
-    else:
-        assert False, 'GOTM simulator returned unknown code %i.' % res.returncode
-
-if res.returncode==0:
-    # Write result to file, if requested.
-    if resultpath is not None:
-        resultpath = os.path.normpath(os.path.join(oldworkingdir, resultpath))
-        if cdf:
-            print('Writing NetCDF result to "%s".' % resultpath)
-            res.saveNetCDF(resultpath)
+        try:
+            # Write result to file, if requested.
+            resultpath = getOutputPath(options['resultpath'],index,path)
+            if resultpath is not None:
+                if options['cdf']:
+                    print('%sWriting NetCDF result to "%s".' % (prefix,resultpath))
+                    res.saveNetCDF(resultpath)
+                else:
+                    print('%sWriting result to "%s".' % (prefix,resultpath))
+                    res.save(resultpath)
+
+            # Generate report, if requested.
+            reportpath = getOutputPath(options['reportpath'],index,path)
+            if reportpath is not None:
+                def reportprogress(progress,description):
+                    if options['showprogress']: print('%s%5.1f %% done, %s' % (prefix,progress*100,description))
+
+                import core.report
+                reptemplates = core.report.Report.getTemplates()
+                rep = core.report.Report()
+
+                # Use report settings stored within the result (if any)
+                rep.store.root.copyFrom(res.store['ReportSettings'])
+
+                # Add all possible output variables
+                treestore = res.getVariableTree(plottableonly=True)
+                selroot = rep.store['Figures/Selection']
+                for node in treestore.root.getDescendants():
+                    if node.canHaveValue() and not node.isHidden():
+                        ch = selroot.addChild('VariablePath')
+                        ch.setValue('/'.join(node.location))
+                treestore.unlink()
+
+                print('%sCreating report in "%s".' % (prefix,reportpath))
+                rep.generate(res,reportpath,reptemplates['default'],callback=reportprogress,headless=True,processes=options['reportprocesses'],incremental=options['incremental'])
+                rep.release()
+        except Exception as e:
+            print('%sUnable to write output. Error: %s' % (prefix,e))
+            returncode,errormessage = 1,str(e)
+
+    # Clean-up
+    if scen is not None: scen.release()
+    if res is not None: res.release()
+
+    return index,path,returncode,errormessage,simulationtime,time.time()-time_start
+
+def processPathTask(task):
+    return processPath(*task)
+
+def printSummary(outcomes,elapsed,jobs):
+    statuses = {0:'ok',1:'FAILED',2:'cancelled'}
+    print('\n%-5s %-40s %-10s %10s %10s' % ('#','path','status','sim. (s)','total (s)'))
+    for index,path,returncode,errormessage,simulationtime,totaltime in outcomes:
+        name = os.path.basename(path)
+        if len(name)>40: name = '...'+name[-37:]
+        print('%-5i %-40s %-10s %10.1f %10.1f' % (index,name,statuses.get(returncode,str(returncode)),simulationtime,totaltime))
+    failed = len([outcome for outcome in outcomes if outcome[2]!=0])
+    print('%i paths processed (%i failed) in %.1f s with %i worker processes.' % (len(outcomes),failed,elapsed,jobs))
+
+def main():
+    if len(sys.argv)==1:
+        printHelp()
+        return 1
+
+    # Parse command line arguments
+    options = {}
+    options['cdf'] = core.common.getSwitchArgument('-cdf')
+    options['gotmoutput'] = core.common.getSwitchArgument('-gotmoutput')
+    options['usecache'] = core.common.getSwitchArgument('-cache')
+    options['inmemory'] = core.common.getSwitchArgument('-inmemory')
+    options['checkpointpath'] = core.common.getNamedArgument('-checkpoint')
+    options['checkpointinterval'] = core.common.getNamedArgument('-checkpointinterval',type=float,default=600.)
+    options['resumepath'] = core.common.getNamedArgument('-resume')
+    options['profile'] = core.common.getSwitchArgument('-profile')
+    if core.common.getSwitchArgument('-tmpfs'): core.common.useTmpfsStaging()
+    options['resultpath'] = core.common.getNamedArgument('-writeresult')
+    options['reportpath'] = core.common.getNamedArgument('-writereport')
+    options['incremental'] = core.common.getSwitchArgument('-incremental')
+    jobs = core.common.getNamedArgument('-j',type=int,default=1)
+
+    # Warn for remaining command line arguments that look like (unknown) switches;
+    # all others are paths.
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('-'):
+            print('WARNING: command line argument "%s" is unknown and will be ignored.' % arg)
+            print('Run "batch" without arguments to see a list of accepted arguments.\n')
         else:
-            print('Writing result to "%s".' % resultpath)
-            res.save(resultpath)
-
-    # Generate report, if requested.
-    if reportpath is not None:
-        def reportprogress(progress,description):
-            print('%5.1f %% done, %s' % (progress*100,description))
-
-        reportpath = os.path.normpath(os.path.join(oldworkingdir, reportpath))
-        reptemplates = core.report.Report.getTemplates()
-        rep = core.report.Report()
-        
-        # Use report settings stored within the result (if any)
-        rep.store.root.copyFrom(res.store['ReportSettings'])
-
-        # Add all possible output variables
-        treestore = res.getVariableTree(plottableonly=True)
-        selroot = rep.store['Figures/Selection']
-        for node in treestore.root.getDescendants():
-            if node.canHaveValue() and not node.isHidden():
-                ch = selroot.addChild('VariablePath')
-                ch.setValue('/'.join(node.location))
-        treestore.unlink()
-        
-        print('Creating report in "%s".' % reportpath)
-        rep.generate(res,reportpath,reptemplates['default'],callback=reportprogress)
-        rep.release()
-
-# Clean-up
-if scen is not None: scen.release()
-if res is not None: res.release()
-
-# Reset previous working directory
-os.chdir(os.path.dirname(oldworkingdir))
-
-sys.exit(res.returncode)
+            args.append(arg)
+
+    paths = getInputPaths(args)
+    if not paths:
+        print('No scenarios or results to process.')
+        return 1
+
+    # With multiple inputs, output paths must be templates that differ per input.
+    if len(paths)>1:
+        for name,switch in (('resultpath','-writeresult'),('reportpath','-writereport'),('checkpointpath','-checkpoint'),('resumepath','-resume')):
+            if options[name] is not None and '{' not in options[name]:
+                print('Error: multiple paths are processed, so the argument of %s must contain {name} or {index}.' % switch)
+                return 1
+
+    jobs = max(1,min(jobs,len(paths)))
+    options['prefix'] = len(paths)>1
+    options['showprogress'] = jobs==1
+
+    # Report figures are rendered by one worker process per CPU core, unless the paths
+    # themselves are processed in parallel (worker processes cannot have workers of their own).
+    options['reportprocesses'] = None if jobs==1 else 1
+
+    time_start = time.time()
+    outcomes = []
+    if jobs==1:
+        for index,path in enumerate(paths):
+            outcomes.append(processPath(index,path,options))
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            outcomes = list(pool.imap(processPathTask,[(index,path,options) for index,path in enumerate(paths)]))
+        finally:
+            pool.close()
+            pool.join()
+    elapsed = time.time()-time_start
+
+    if len(paths)>1: printSummary(outcomes,elapsed,jobs)
+
+    return max([outcome[2] for outcome in outcomes])
+
+if __name__=='__main__':
+    ret = main()
+
+    # Reset previous working directory
+    os.chdir(os.path.dirname(oldworkingdir))
+
+    sys.exit(ret)
@@ -0,0 +1,319 @@
+from __future__ import print_function
+
+# Import modules from standard Python library
+import sys, os, os.path, shutil, hashlib, io
+
+from . import common
+
+def getDefaultCacheRoot():
+    """Returns the directory that holds the on-disk caches of GOTM-GUI.
+    """
+    if sys.platform == 'win32':
+        return os.path.join(os.environ['APPDATA'],'GOTM','cache')
+    return os.path.join(os.environ.get('XDG_CACHE_HOME',os.path.expanduser('~/.cache')),'gotmgui')
+
+def getScenarioHash(scen,*extra):
+    """Returns a hash of the values in the scenario, including the contents of linked
+    data files. Additional strings that should be part of the hash (e.g., the target
+    version) may be passed as extra arguments.
+    """
+    m = hashlib.sha1()
+    for item in (scen.version,)+extra:
+        m.update(u''.__class__(item).encode('utf-8'))
+    if scen.root.valuenode is not None:
+        m.update(scen.root.valuenode.toxml('utf-8'))
+    for node in scen.root.getNodesByType('gotmdatafile'):
+        value = node.getValue()
+        if value is None: continue
+        m.update('/'.join(node.location).encode('utf-8'))
+        m.update(getDataFileFingerprint(value).encode('utf-8'))
+        value.release()
+    return m.hexdigest()
+
+def getDataFileFingerprint(value):
+    """Returns a string that changes whenever the contents of the data file behind a value
+    of type gotmdatafile change.
+    """
+    df = value.getDataFile()
+    try:
+        return getDataFileKey(df)
+    finally:
+        df.release()
+
+def getDataFileKey(df):
+    """Returns a string that changes whenever the contents of the data file (an
+    xmlstore.datatypes.DataFile object) change. For files on disk and files in zip archives
+    (e.g., a .gotmscenario file) on disk, this takes constant time; other data files are hashed.
+    """
+    path = getattr(df,'path',None)
+    if path is not None and os.path.isfile(path):
+        # Data file on disk: use its path, size and modification time as fingerprint.
+        st = os.stat(path)
+        return '%s:%i:%r' % (path,st.st_size,st.st_mtime)
+    zipcontainer = getattr(df,'zipcontainer',None)
+    if zipcontainer is not None and isinstance(zipcontainer.path,(str,u''.__class__)) and os.path.isfile(zipcontainer.path):
+        # Data file in a zip archive on disk: use the version of the archive, plus the size
+        # and checksum of the file within as recorded in the archive.
+        st = os.stat(zipcontainer.path)
+        zipcontainer.setMode('r')
+        info = zipcontainer.zfile.getinfo(df.name)
+        return '%s:%i:%r:%s:%i:%08x' % (os.path.abspath(zipcontainer.path),st.st_size,st.st_mtime,df.name,info.file_size,info.CRC)
+    m = hashlib.sha1()
+    f = df.getAsReadOnlyFile(textmode=False)
+    while True:
+        dat = f.read(1024*1024)
+        if not dat: break
+        m.update(dat)
+    f.close()
+    return m.hexdigest()
+
+def getDirectorySize(path):
+    # Symbolic links count with their own size, not with that of the file they point to.
+    size = 0
+    for dirpath,dirnames,filenames in os.walk(path):
+        for filename in filenames:
+            size += os.lstat(os.path.join(dirpath,filename)).st_size
+    return size
+
+def linkTree(source,target,strategies=None):
+    """Makes all files below the source directory available in the (existing) target
+    directory, by linking them with the specified strategies (by default, hard-linking or
+    copying; see common.linkFile). Symbolic links in the source directory (e.g., to input data
+    files, see core.scenario.LinkingDataContainer) are recreated as such, pointing to the same file.
+    """
+    for dirpath,dirnames,filenames in os.walk(source):
+        targetdir = os.path.join(target,os.path.relpath(dirpath,source))
+        if not os.path.isdir(targetdir): os.makedirs(targetdir)
+        for filename in filenames:
+            sourcepath = os.path.join(dirpath,filename)
+            if os.path.islink(sourcepath):
+                os.symlink(os.path.realpath(sourcepath),os.path.join(targetdir,filename))
+            else:
+                common.linkFile(sourcepath,os.path.join(targetdir,filename),strategies)
+
+def hasBrokenLinks(path):
+    """Returns whether any symbolic link below the directory points to a file that no longer exists.
+    """
+    for dirpath,dirnames,filenames in os.walk(path):
+        for filename in filenames:
+            if not os.path.exists(os.path.join(dirpath,filename)): return True
+    return False
+
+class DirectoryCache(object):
+    """Content-addressed cache of directories on disk. Each entry is a directory named after
+    its key (a hash). When the total size of the cache exceeds its maximum, the least recently
+    used entries are removed.
+    """
+    name = 'cache'
+    defaultmaxsize = 1024**3
+
+    def __init__(self,root=None,maxsize=None):
+        if root is None: root = os.path.join(getDefaultCacheRoot(),self.name)
+        if maxsize is None: maxsize = self.defaultmaxsize
+        self.root = root
+        self.maxsize = maxsize
+
+    def getPath(self,key):
+        """Returns the path of the entry with the specified key, or None if it is not cached.
+        """
+        path = os.path.join(self.root,key)
+        if not os.path.isdir(path): return None
+
+        # Mark the entry as used.
+        try:
+            os.utime(path,None)
+        except OSError:
+            pass
+        return path
+
+    def createEntry(self,key):
+        """Creates a private directory for a new entry, and returns its path. After it has been
+        filled, it must be added to the cache with commitEntry, so other processes never see
+        incomplete entries.
+        """
+        if not os.path.isdir(self.root): os.makedirs(self.root)
+        temppath = '%s.%i.tmp' % (os.path.join(self.root,key),os.getpid())
+        if os.path.isdir(temppath): shutil.rmtree(temppath)
+        os.mkdir(temppath)
+        return temppath
+
+    def commitEntry(self,key,temppath):
+        path = os.path.join(self.root,key)
+        try:
+            os.rename(temppath,path)
+        except OSError:
+            # Another process may have added the same entry in the meantime.
+            shutil.rmtree(temppath,ignore_errors=True)
+            if not os.path.isdir(path): raise
+        self.evict()
+        return path
+
+    def add(self,key,sourcedir):
+        """Adds the contents of the source directory to the cache under the specified key,
+        and returns the path of the new entry.
+        """
+        path = os.path.join(self.root,key)
+        if os.path.isdir(path): return path
+        temppath = self.createEntry(key)
+        try:
+            linkTree(sourcedir,temppath)
+        except:
+            shutil.rmtree(temppath,ignore_errors=True)
+            raise
+        return self.commitEntry(key,temppath)
+
+    def list(self):
+        """Returns a list of (key,size in bytes,time of last use) tuples for all entries,
+        with the most recently used entry first.
+        """
+        entries = []
+        if os.path.isdir(self.root):
+            for key in os.listdir(self.root):
+                path = os.path.join(self.root,key)
+                if key.endswith('.tmp') or not os.path.isdir(path): continue
+                entries.append((key,getDirectorySize(path),os.path.getmtime(path)))
+        entries.sort(key=lambda entry: entry[2],reverse=True)
+        return entries
+
+    def remove(self,key):
+        shutil.rmtree(os.path.join(self.root,key),ignore_errors=True)
+
+    def evict(self,maxsize=None):
+        """Removes the least recently used entries until the total size of the cache does not
+        exceed the specified size (by default, the maximum size of the cache).
+        Returns the number of entries that were removed.
+        """
+        if maxsize is None: maxsize = self.maxsize
+        entries = self.list()
+        totalsize = sum([size for key,size,lastused in entries])
+        removed = 0
+        while entries and totalsize>maxsize:
+            key,size,lastused = entries.pop()
+            if common.verbose:
+                print('Removing entry "%s" (%i bytes) from %s.' % (key,size,self.name))
+            self.remove(key)
+            totalsize -= size
+            removed += 1
+        return removed
+
+    def purge(self):
+        """Removes all entries from the cache.
+        """
+        return self.evict(0)
+
+class ScenarioCache(DirectoryCache):
+    """Cache of scenarios that have been converted to GOTM namelists. Each entry holds the
+    namelist files plus the data files, ready to be linked into a simulation directory (see
+    linkEntry). Data files may be symbolic links to the original files or to the input cache.
+    """
+    name = 'scenarios'
+
+    def getKey(self,scen,version):
+        return getScenarioHash(scen,version)
+
+    def getPath(self,key):
+        path = DirectoryCache.getPath(self,key)
+        if path is not None and hasBrokenLinks(path):
+            # A data file that the entry links to has been removed (e.g., from the input cache).
+            self.remove(key)
+            return None
+        return path
+
+    def linkEntry(self,path,target):
+        """Makes the files of the cache entry at path available in the target directory in
+        constant time per file, whatever its size. As simulation directories are often on another
+        file system (e.g., a staging directory on tmpfs), files are symbolically linked if they
+        cannot be hard-linked. Only use this for directories whose files are replaced rather
+        than modified (see core.capture.disableNetCDFOutput).
+        """
+        linkTree(path,target,common.datafilelinkstrategies)
+
+class ResultCache(DirectoryCache):
+    """Cache of completed simulations. Each entry holds the result (NetCDF) plus the text
+    output of GOTM, keyed by the hash of the scenario and the version of the GOTM library.
+    Results obtained from the cache are attached to the cached NetCDF file directly.
+    """
+    name = 'results'
+    defaultmaxsize = 4*1024**3
+
+    def getKey(self,scen,gotmversion):
+        return getScenarioHash(scen,'result',gotmversion)
+
+    def getResult(self,key,scen):
+        """Returns a Result object for the cached simulation of the scenario, or None if
+        no such simulation is cached.
+        """
+        from . import result
+        path = self.getPath(key)
+        if path is None: return None
+        res = result.Result()
+        try:
+            res.attach(os.path.join(path,'result.nc'),scen,copy=False)
+        except Exception as e:
+            # Unusable entry (e.g., removed by another process): discard it.
+            res.release()
+            self.remove(key)
+            return None
+        for name in ('stdout','stderr'):
+            textpath = os.path.join(path,name+'.txt')
+            if os.path.isfile(textpath):
+                with io.open(textpath,'r',encoding='utf-8') as f:
+                    setattr(res,name,f.read())
+
+        # The result does not yet exist outside the cache.
+        res.changed = True
+        return res
+
+    def addResult(self,key,res):
+        """Adds a successfully completed result to the cache.
+        """
+        if os.path.isdir(os.path.join(self.root,key)): return
+        temppath = self.createEntry(key)
+        try:
+            common.linkFile(res.datafile,os.path.join(temppath,'result.nc'))
+            for name in ('stdout','stderr'):
+                text = getattr(res,name)
+                if text is None: continue
+                with io.open(os.path.join(temppath,name+'.txt'),'w',encoding='utf-8') as f:
+                    f.write(u''.__class__(text))
+        except:
+            shutil.rmtree(temppath,ignore_errors=True)
+            raise
+        self.commitEntry(key,temppath)
+
+class InputCache(DirectoryCache):
+    """Shared, read-only cache of input data files that are not available as file on disk
+    (e.g., data files in a zip archive or in memory). Each entry holds a single file, which
+    simulation directories link to (see core.scenario.LinkingDataContainer) rather than
+    writing their own copy.
+    """
+    name = 'inputs'
+    filename = 'data'
+
+    def getKey(self,df):
+        return hashlib.sha1(getDataFileKey(df).encode('utf-8')).hexdigest()
+
+    def getFile(self,df):
+        """Returns the path of a read-only file with the contents of the data file,
+        adding it to the cache first if needed.
+        """
+        key = self.getKey(df)
+        path = self.getPath(key)
+        if path is None:
+            temppath = self.createEntry(key)
+            try:
+                df.saveToFile(os.path.join(temppath,self.filename))
+                if sys.platform!='win32': os.chmod(os.path.join(temppath,self.filename),0o444)
+            except:
+                shutil.rmtree(temppath,ignore_errors=True)
+                raise
+            path = self.commitEntry(key,temppath)
+        return os.path.join(path,self.filename)
+
+inputcache = None
+def getInputCache():
+    """Returns the input cache shared by all simulations in this process.
+    """
+    global inputcache
+    if inputcache is None: inputcache = InputCache()
+    return inputcache
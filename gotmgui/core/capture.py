@@ -0,0 +1,224 @@
+from __future__ import print_function
+
+# Import modules from standard Python library
+import os, re, datetime, threading
+
+import numpy
+
+import xmlplot.common
+
+from . import namelist
+
+# Profile variables that are captured from the GOTM library for in-memory results:
+# name in result, GOTM module, GOTM variable, long name, unit, defined at interfaces (True) or layer centres (False).
+profilevariables = (
+    ('temp','meanflow',  't',  'temperature',                        'Celsius',False),
+    ('salt','meanflow',  's',  'salinity',                           'psu',    False),
+    ('u',   'meanflow',  'u',  'x-velocity',                         'm/s',    False),
+    ('v',   'meanflow',  'v',  'y-velocity',                         'm/s',    False),
+    ('NN',  'meanflow',  'nn', 'buoyancy frequency squared',         '1/s2',   True),
+    ('SS',  'meanflow',  'ss', 'shear frequency squared',            '1/s2',   True),
+    ('tke', 'turbulence','tke','turbulent kinetic energy',           'm2/s2',  True),
+    ('eps', 'turbulence','eps','dissipation rate',                   'W/kg',   True),
+    ('num', 'turbulence','num','turbulent diffusivity of momentum',  'm2/s',   True),
+    ('nuh', 'turbulence','nuh','turbulent diffusivity of heat',      'm2/s',   True),
+)
+
+# Output interval used for GOTM's own (NetCDF) output when results are captured in memory.
+# It exceeds the length of any simulation, which effectively disables that output.
+disabledoutputinterval = 999999999
+
+def readRunSettings(simulationdir):
+    """Reads the settings needed for in-memory results (output interval, time step,
+    start time, water depth) from gotmrun.nml in the simulation directory.
+    """
+    values = {}
+    nmlfile = namelist.NamelistFile(os.path.join(simulationdir,'gotmrun.nml'))
+    try:
+        for nml in nmlfile:
+            for varname,slic,vardata in nml:
+                if slic is None and isinstance(vardata,(str,u''.__class__)):
+                    values['%s/%s' % (nml.name.lower(),varname.lower())] = vardata.strip('\'"')
+    finally:
+        nmlfile.close()
+    return {'nsave':int(values['output/nsave']),
+            'dt':float(values['model_setup/dt']),
+            'start':datetime.datetime.strptime(values['time/start'],'%Y-%m-%d %H:%M:%S'),
+            'depth':float(values['station/depth'])}
+
+def disableNetCDFOutput(simulationdir):
+    """Rewrites gotmrun.nml in the simulation directory so that GOTM effectively writes no output.
+    The file is replaced rather than modified, because it may be linked to a cached copy.
+    """
+    path = os.path.join(simulationdir,'gotmrun.nml')
+    with open(path,'r') as f:
+        data = f.read()
+    data = re.sub(r'(?i)(\bnsave\s*=\s*)\d+','\\g<1>%i' % disabledoutputinterval,data)
+    os.remove(path)
+    with open(path,'w') as f:
+        f.write(data)
+
+class ProfileCapture(object):
+    """Buffer for GOTM profiles that are copied from the GOTM library at every output time
+    (i.e., every nsave time steps). All arrays are allocated up front for the complete run.
+    Samples may be read from another thread while the simulation is still running (e.g., for
+    a live preview of the result); readers only see complete samples.
+    """
+    def __init__(self,gotm,settings,start,stop):
+        self.gotm = gotm
+        self.nsave = settings['nsave']
+        self.dt = settings['dt']
+        self.starttime = settings['start']
+        self.depth = settings['depth']
+        self.start = start
+
+        # Find the variables that the GOTM library exposes.
+        self.sources = []
+        for name,module,gotmname,longname,unit,atinterfaces in profilevariables:
+            data = getattr(getattr(gotm,module,None),gotmname,None)
+            if data is not None: self.sources.append((name,data,atinterfaces))
+        self.h = getattr(getattr(gotm,'meanflow',None),'h',None)
+        if self.h is None or not self.sources:
+            raise Exception('The GOTM library does not provide access to its profiles; results cannot be kept in memory.')
+        nlev = self.h.shape[0]-1
+
+        # Preallocate arrays for all output times.
+        outputcount = (stop//self.nsave)-((start-1)//self.nsave)
+        self.time = numpy.empty((outputcount,),dtype=float)
+        self.layerthickness = numpy.empty((outputcount,nlev),dtype=float)
+        self.data = {}
+        for name,data,atinterfaces in self.sources:
+            self.data[name] = numpy.empty((outputcount,nlev+int(atinterfaces)),dtype=float)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def getNextOutputStep(self,step):
+        """Returns the first time step at or after the specified step at which output is due.
+        """
+        return ((step+self.nsave-1)//self.nsave)*self.nsave
+
+    def sample(self,step):
+        """Copies the current GOTM profiles, valid at the end of the specified time step.
+        """
+        i = self.count
+        self.time[i] = (step-self.start+1)*self.dt
+        self.layerthickness[i,:] = self.h[1:]
+        for name,data,atinterfaces in self.sources:
+            if atinterfaces:
+                self.data[name][i,:] = data
+            else:
+                self.data[name][i,:] = data[1:]
+
+        # Only now make the new sample visible to readers.
+        with self.lock:
+            self.count = i+1
+
+    def getCount(self):
+        with self.lock:
+            return self.count
+
+    def getState(self):
+        """Returns a copy of all samples taken so far (e.g., to be saved in a checkpoint).
+        """
+        n = self.getCount()
+        return {'time':self.time[:n].copy(),
+                'layerthickness':self.layerthickness[:n,:].copy(),
+                'data':dict([(name,data[:n,:].copy()) for name,data in self.data.items()])}
+
+    def setState(self,state):
+        """Restores samples obtained from getState.
+        """
+        n = state['time'].shape[0]
+        self.time[:n] = state['time']
+        self.layerthickness[:n,:] = state['layerthickness']
+        for name,data in state['data'].items():
+            if name in self.data: self.data[name][:n,:] = data
+        with self.lock:
+            self.count = n
+
+    def getVariableInfo(self):
+        """Returns (name, long name, unit, defined at interfaces) for all captured variables.
+        """
+        names = set([name for name,data,atinterfaces in self.sources])
+        return [(name,longname,unit,atinterfaces) for name,module,gotmname,longname,unit,atinterfaces in profilevariables if name in names]
+
+    def getCoordinates(self):
+        """Returns time (in seconds since the start), and depth of layer centres and interfaces
+        (time x depth, in m relative to the surface) for all samples taken so far.
+        """
+        n = self.getCount()
+        h = self.layerthickness[:n,:]
+        zi = numpy.empty((n,h.shape[1]+1),dtype=float)
+        zi[:,0] = -self.depth
+        zi[:,1:] = -self.depth+h.cumsum(axis=1)
+        z = zi[:,:-1]+h/2
+        return self.time[:n],z,zi
+
+    def getData(self,name,count=None):
+        if count is None: count = self.getCount()
+        return self.data[name][:count,:]
+
+    def saveNetCDF(self,path):
+        """Writes the captured profiles to a NetCDF file that follows the conventions of GOTM output.
+        """
+        try:
+            import netCDF4
+        except ImportError as e:
+            raise Exception('Unable to save in-memory result to NetCDF, because the netCDF4 module is not available. Error: %s' % e)
+        time,z,zi = self.getCoordinates()
+        nc = netCDF4.Dataset(path,'w')
+        try:
+            nc.createDimension('time',None)
+            nc.createDimension('z',z.shape[1])
+            nc.createDimension('zi',zi.shape[1])
+            nc.createDimension('lat',1)
+            nc.createDimension('lon',1)
+            var = nc.createVariable('time',float,('time',))
+            var.units = 'seconds since %s' % self.starttime.strftime('%Y-%m-%d %H:%M:%S')
+            var[:] = time
+            for name,data,longname,unit in (('z',z,'depth','m'),('zi',zi,'depth','m')):
+                var = nc.createVariable(name,float,('time',name,'lat','lon'))
+                var.long_name,var.units = longname,unit
+                var[:,:,0,0] = data
+            for name,longname,unit,atinterfaces in self.getVariableInfo():
+                var = nc.createVariable(name,float,('time',('z','zi')[atinterfaces],'lat','lon'))
+                var.long_name,var.units = longname,unit
+                var[:,:,0,0] = self.getData(name)
+        finally:
+            nc.close()
+
+class MemoryStore(xmlplot.common.VariableStore):
+    """Store that exposes profiles captured from GOTM through the xmlplot variable store
+    interface, in the same layout as a GOTM NetCDF file (dimensions time and z/zi).
+    """
+    def __init__(self,capture):
+        xmlplot.common.VariableStore.__init__(self)
+        self.capture = capture
+
+    def getVariableNames_raw(self):
+        return [name for name,longname,unit,atinterfaces in self.capture.getVariableInfo()]
+
+    def getVariableLongNames_raw(self):
+        return dict([(name,longname) for name,longname,unit,atinterfaces in self.capture.getVariableInfo()])
+
+    def getDimensionInfo_raw(self,dimname):
+        if dimname=='time':
+            return {'label':'time','datatype':'datetime','reversed':False,'preferredaxis':'x'}
+        return {'label':'depth','unit':'m','datatype':'float','reversed':False,'preferredaxis':'y'}
+
+    def getVariable_raw(self,varname):
+        for name,longname,unit,atinterfaces in self.capture.getVariableInfo():
+            if name==varname: break
+        else:
+            return None
+        # Samples taken after this point are ignored; a copy of the data is taken, because
+        # the capture may be filled further while the variable is in use.
+        time,z,zi = self.capture.getCoordinates()
+        depthdim = ('z','zi')[atinterfaces]
+        starttime = xmlplot.common.date2num(self.capture.starttime)
+        varslice = xmlplot.common.Variable.Slice(('time',depthdim))
+        varslice.coords = [starttime+time/86400.,(z,zi)[atinterfaces]]
+        varslice.data = self.capture.getData(name,time.shape[0]).copy()
+        varslice.generateStaggered()
+        diminfo = dict([(d,self.getDimensionInfo_raw(d)) for d in varslice.dimensions])
+        return xmlplot.common.CustomVariable(varslice,name=name,longname=longname,unit=unit,dimensioninfo=diminfo)
@@ -0,0 +1,192 @@
+from __future__ import print_function
+
+# Import modules from standard Python library
+import os, os.path, shutil, pickle
+
+import numpy
+
+# GOTM keeps its state in FORTRAN modules, which pygotm exposes as attributes of the module
+# objects listed here. A checkpoint holds a copy of all floating point variables in these
+# modules. Integer, logical and character variables (array sizes, switches, file units) are
+# configuration that is set up again when GOTM is initialized, and are therefore not restored.
+statemodules = ('meanflow','turbulence','airsea','bio_var')
+
+# Modules and variables that every GOTM library must expose for a checkpoint to be usable.
+# Without these, a restored simulation would silently continue from its initial conditions.
+requiredmodules = ('meanflow','turbulence')
+requiredvariables = (('meanflow','h'),)
+
+# Version of the checkpoint format.
+version = 1
+
+def getState(gotm):
+    """Returns a dictionary that maps (module name, variable name) to a copy of the value of
+    all floating point variables in the GOTM modules that hold model state. Raises an exception
+    if the GOTM library does not provide access to the required modules and variables.
+    """
+    for modulename in requiredmodules:
+        if getattr(gotm,modulename,None) is None:
+            raise Exception('The GOTM library does not provide access to module "%s"; its state cannot be saved.' % modulename)
+    state = {}
+    for modulename in statemodules:
+        module = getattr(gotm,modulename,None)
+        if module is None: continue
+        for name in dir(module):
+            if name.startswith('_'): continue
+            try:
+                value = getattr(module,name)
+            except Exception:
+                continue
+            if isinstance(value,numpy.ndarray) and value.dtype.kind=='f':
+                state[(modulename,name)] = value.copy()
+    validateState(state)
+    return state
+
+def validateState(state):
+    """Raises an exception if the state (see getState) lacks required variables, or if it
+    contains no profiles (arrays with at least one dimension), which are the only part that
+    is restored for a warm start. Returns the number of profiles in the state.
+    """
+    for modulename,name in requiredvariables:
+        if (modulename,name) not in state:
+            raise Exception('The GOTM state lacks variable %s/%s.' % (modulename,name))
+    profilecount = len([value for value in state.values() if value.ndim>0])
+    if profilecount==0:
+        raise Exception('The GOTM state does not contain any profiles.')
+    return profilecount
+
+def setState(gotm,state,profilesonly=False):
+    """Restores the GOTM state obtained from getState. If profilesonly is set, scalars are
+    not restored. These include model parameters, which may then differ from those of the
+    simulation that the state was taken from (see core.ensemble, warm start).
+    Returns the number of profiles that were restored.
+    """
+    profilecount = validateState(state)
+    for (modulename,name),value in state.items():
+        if profilesonly and value.ndim==0: continue
+        module = getattr(gotm,modulename,None)
+        if module is None:
+            raise Exception('The GOTM library does not contain module "%s" present in the checkpoint.' % modulename)
+        current = getattr(module,name,None)
+        if current is None or current.shape!=value.shape:
+            raise Exception('Variable %s/%s in the checkpoint does not match the current GOTM configuration.' % (modulename,name))
+        if value.ndim==0:
+            setattr(module,name,value)
+        else:
+            current[...] = value
+    return profilecount
+
+def mergeResults(previouspath,path):
+    """Prepends the output records in the NetCDF file at previouspath (written before a
+    checkpoint) to the NetCDF file at path (written after resuming from that checkpoint).
+    Records of the previous file at or beyond the first time in the current file are skipped.
+    """
+    try:
+        import netCDF4
+    except ImportError as e:
+        raise Exception('Unable to merge results from before and after the checkpoint, because the netCDF4 module is not available. Error: %s' % e)
+
+    previous = netCDF4.Dataset(previouspath)
+    current = netCDF4.Dataset(path)
+    temppath = path+'.merged'
+    try:
+        times = current.variables['time'][:]
+        previoustimes = previous.variables['time'][:]
+        if len(times)>0:
+            n = int((previoustimes<times[0]).sum())
+        else:
+            n = len(previoustimes)
+        if n==0: return
+
+        merged = netCDF4.Dataset(temppath,'w',format=current.file_format)
+        try:
+            merged.setncatts(dict([(name,current.getncattr(name)) for name in current.ncattrs()]))
+            for name,dim in current.dimensions.items():
+                merged.createDimension(name,None if dim.isunlimited() else len(dim))
+            for name,var in current.variables.items():
+                attnames = var.ncattrs()
+                fill_value = None
+                if '_FillValue' in attnames: fill_value = var.getncattr('_FillValue')
+                mergedvar = merged.createVariable(name,var.dtype,var.dimensions,fill_value=fill_value)
+                mergedvar.setncatts(dict([(attname,var.getncattr(attname)) for attname in attnames if attname!='_FillValue']))
+                if var.dimensions and var.dimensions[0]=='time':
+                    mergedvar[:n,...] = previous.variables[name][:n,...]
+                    mergedvar[n:,...] = var[:]
+                else:
+                    mergedvar[...] = var[...]
+        finally:
+            merged.close()
+    finally:
+        previous.close()
+        current.close()
+
+    os.remove(path)
+    os.rename(temppath,path)
+
+class Checkpoint(object):
+    """State of a GOTM simulation at a slab boundary (see core.simulator.Simulator.run), from
+    which the simulation can be resumed with core.simulator.Simulator.resume. The hash of the
+    simulated scenario (see core.cache.getScenarioHash) identifies the scenario it belongs to. On disk, a checkpoint
+    is a directory with the GOTM state (state.pickle) and the output written up to the
+    checkpoint (result.nc), if any.
+    """
+    def __init__(self,gotmversion,start,stop,currentpos,state,capturestate=None,scenariohash=None):
+        self.gotmversion = gotmversion
+        self.scenariohash = scenariohash
+        self.start = start
+        self.stop = stop
+        self.currentpos = currentpos
+        self.state = state
+        self.capturestate = capturestate
+        self.resultpath = None
+
+    def save(self,path,resultpath=None,previousresultpath=None):
+        """Saves the checkpoint to a directory. If resultpath is specified, the NetCDF
+        output written so far is included, preceded by the records in previousresultpath
+        (if the simulation was itself resumed from an earlier checkpoint). The directory is
+        replaced only once the new checkpoint is complete, so a crash while saving leaves
+        the previous checkpoint intact.
+        """
+        temppath = path+'.tmp'
+        if os.path.isdir(temppath): shutil.rmtree(temppath)
+        os.makedirs(temppath)
+        with open(os.path.join(temppath,'state.pickle'),'wb') as f:
+            pickle.dump({'version':version,
+                         'gotmversion':self.gotmversion,
+                         'start':self.start,
+                         'stop':self.stop,
+                         'currentpos':self.currentpos,
+                         'state':self.state,
+                         'capturestate':self.capturestate,
+                         'scenariohash':self.scenariohash},f,2)
+        if resultpath is not None:
+            shutil.copyfile(resultpath,os.path.join(temppath,'result.nc'))
+            if previousresultpath is not None:
+                mergeResults(previousresultpath,os.path.join(temppath,'result.nc'))
+
+        if os.path.isdir(path):
+            oldpath = path+'.old'
+            if os.path.isdir(oldpath): shutil.rmtree(oldpath)
+            os.rename(path,oldpath)
+            os.rename(temppath,path)
+            shutil.rmtree(oldpath)
+        else:
+            os.rename(temppath,path)
+
+    @classmethod
+    def load(cls,path):
+        statepath = os.path.join(path,'state.pickle')
+        if not os.path.isfile(statepath):
+            raise Exception('"%s" does not contain a checkpoint.' % path)
+        with open(statepath,'rb') as f:
+            data = pickle.load(f)
+        if data['version']!=version:
+            raise Exception('Checkpoint "%s" has format version %s; only version %i is supported.' % (path,data['version'],version))
+        try:
+            validateState(data['state'])
+        except Exception as e:
+            raise Exception('Checkpoint "%s" is not usable. %s' % (path,e))
+        checkpoint = cls(data['gotmversion'],data['start'],data['stop'],data['currentpos'],data['state'],data['capturestate'],data.get('scenariohash'))
+        resultpath = os.path.join(path,'result.nc')
+        if os.path.isfile(resultpath): checkpoint.resultpath = resultpath
+        return checkpoint
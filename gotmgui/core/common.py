@@ -17,13 +17,51 @@ def getDataRoot():
             dataroot = os.path.realpath(os.path.join(os.path.dirname(__file__),'..'))
     return dataroot
 
+# Environment variable with the directory in which simulation directories are staged (see getStagingDir).
+stagingvariable = 'GOTMGUI_STAGINGDIR'
+
+# Environment variable that disables the result cache of the GUI if set to 0 (see gotmgui.py --nocache).
+resultcachevariable = 'GOTMGUI_RESULTCACHE'
+
+def useResultCache():
+    """Returns whether the GUI returns results of identical scenarios that were simulated
+    before from the on-disk result cache (core.cache.ResultCache).
+    """
+    return os.environ.get(resultcachevariable,'1')!='0'
+
+# Memory-backed file systems (tmpfs) that are used for staging if the staging directory is "tmpfs".
+tmpfsdirs = ('/dev/shm','/run/shm')
+
+def getStagingDir():
+    """Returns the directory in which temporary simulation directories (with namelists, data
+    files and GOTM output) are created, or None to use the default temporary directory. This is
+    set with environment variable GOTMGUI_STAGINGDIR, which may be a directory, or "tmpfs" for a
+    memory-backed file system. GOTM then reads its setup from memory, and nothing is written to
+    disk (or a network file system) unless results are saved. As environment variable, the
+    setting is inherited by worker processes (see core.ensemble).
+    """
+    path = os.environ.get(stagingvariable)
+    if not path: return None
+    if path=='tmpfs':
+        for path in tmpfsdirs:
+            if os.path.isdir(path) and os.access(path,os.W_OK): return path
+        return None
+    return path
+
+def useTmpfsStaging():
+    """Stages simulation directories on a memory-backed file system, unless a staging directory
+    has been configured already (see getStagingDir).
+    """
+    os.environ.setdefault(stagingvariable,'tmpfs')
+
 class TempDirManager(object):
     tempdirs = None
 
     @staticmethod
-    def create(prefix=''):
+    def create(prefix='',staging=False):
+        # If staging is set, the directory is created in the staging directory (see getStagingDir).
         import tempfile
-        path = tempfile.mkdtemp('',prefix)
+        path = tempfile.mkdtemp('',prefix,getStagingDir() if staging else None)
         if TempDirManager.tempdirs is None:
             TempDirManager.tempdirs = []
             atexit.register(TempDirManager.cleanup)
@@ -48,6 +86,71 @@ class TempDirManager(object):
         for path in TempDirManager.tempdirs:
             TempDirManager.delete(path,unregister=False)
 
+# Ioctl that clones a file (copy-on-write) on Linux file systems that support it, e.g., Btrfs and XFS.
+FICLONE = 0x40049409
+
+def reflinkFile(source,target):
+    """Creates the target as copy-on-write clone of the source file. Both then share their
+    data on disk until either is modified. Raises an exception (OSError or IOError) if the
+    file system or platform does not support this.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError('Reflinks are not supported on this platform.')
+    fsource = open(source,'rb')
+    try:
+        ftarget = open(target,'wb')
+        try:
+            fcntl.ioctl(ftarget.fileno(),FICLONE,fsource.fileno())
+        except:
+            ftarget.close()
+            os.remove(target)
+            raise
+        ftarget.close()
+    finally:
+        fsource.close()
+
+def symlinkFile(source,target):
+    os.symlink(os.path.abspath(source),target)
+
+# Methods to make a file available at another location, by name (see linkFile).
+linkmethods = {'reflink':reflinkFile,
+               'hardlink':os.link,
+               'symlink':symlinkFile,
+               'copy':shutil.copyfile}
+
+# Default strategies of linkFile: hard link, or copy if that fails.
+linkstrategies = ('hardlink','copy')
+
+# Strategies for input data files of simulations (see core.scenario.LinkingDataContainer), which
+# are never modified after writing. All but copying take constant time, whatever the file size.
+datafilelinkstrategies = ('reflink','hardlink','symlink','copy')
+
+def linkFile(source,target,strategies=None):
+    """Makes the file at source available at target, by trying the specified strategies
+    (keys of linkmethods) in order, by default a hard link and then a copy (e.g., if the
+    target is on another file system). Returns the strategy that succeeded.
+    Only use this for files that will not be modified afterwards.
+    """
+    if strategies is None: strategies = linkstrategies
+    for strategy in strategies[:-1]:
+        try:
+            linkmethods[strategy](source,target)
+            return strategy
+        except (AttributeError,NotImplementedError,IOError,OSError):
+            pass
+    linkmethods[strategies[-1]](source,target)
+    return strategies[-1]
+
+def isResultContainer(container):
+    """Returns whether the data container holds a GOTM-GUI result. This is the test used
+    by core.result.Result.canBeOpened, available without importing core.result (which loads
+    xmlplot and the NetCDF backends).
+    """
+    filelist = container.listFiles()
+    return 'result.nc' in filelist and 'scenario.gotmscenario' in filelist
+
 # ------------------------------------------------------------------------------------------
 # Command line argument utility functions
 # ------------------------------------------------------------------------------------------
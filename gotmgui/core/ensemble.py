@@ -0,0 +1,354 @@
+from __future__ import print_function
+
+# Import modules from standard Python library
+import os, time, shutil, itertools, multiprocessing
+
+from . import common, scenario
+
+# GOTM is a FORTRAN library with module-global state, and core.simulator changes the working
+# directory of the process while a simulation runs. Therefore only one simulation can run per
+# Python process. Ensembles are spread over a pool of worker processes instead, each of which
+# imports (and thereby owns) its own copy of the GOTM library.
+
+clock = getattr(time, 'perf_counter', None)
+if clock is None:
+    clock = time.clock
+
+class Member(object):
+    """Specification of a single ensemble member: the path to a scenario
+    (.gotmscenario file or directory), plus optional overrides of scenario values.
+    Overrides map node paths in the scenario (e.g., "/station/depth") to new values;
+    values may also be given as strings, which are then parsed as in the XML scenario file.
+    """
+    def __init__(self,path,overrides=None,name=None):
+        self.path = path
+        self.overrides = overrides or {}
+        self.name = name
+
+class MemberResult(object):
+    """Outcome of the simulation of a single ensemble member. Because the member
+    was simulated in a different process, this does not hold the result itself,
+    but the path of the result file that was written.
+    """
+    def __init__(self,index,name):
+        self.index = index
+        self.name = name
+        self.returncode = 0
+        self.errormessage = None
+        self.path = None
+        self.stepcount = 0
+        self.elapsed = 0.
+
+    def getResult(self):
+        """Returns a Result object attached to the result file of this member.
+        """
+        from . import result
+        assert self.returncode==0, 'Ensemble member %s did not complete successfully.' % self.name
+        res = result.Result()
+        if self.path.endswith('.gotmresult'):
+            res.load(self.path)
+        else:
+            res.attach(self.path,copy=False)
+        return res
+
+def fromOverrides(path,overrides,names=None):
+    """Creates ensemble members from a single base scenario and a list of
+    dictionaries with overrides (one per member).
+    """
+    members = []
+    for i,curoverrides in enumerate(overrides):
+        name = None
+        if names is not None: name = names[i]
+        members.append(Member(path,curoverrides,name))
+    return members
+
+def gridOverrides(axes):
+    """Returns the list of override dictionaries that spans the full grid defined by
+    the supplied axes. These must be provided as a list of (node path, list of values)
+    tuples.
+    """
+    paths = [path for path,values in axes]
+    return [dict(zip(paths,combination)) for combination in itertools.product(*[values for path,values in axes])]
+
+def loadScenario(path):
+    """Loads the scenario at the specified path (.gotmscenario file or directory),
+    converting it to the version used by the GUI.
+    """
+    import xmlstore.datatypes
+    container = xmlstore.datatypes.DataContainer.fromPath(path)
+    try:
+        if not scenario.Scenario.canBeOpened(container):
+            raise Exception('"%s" does not contain a scenario.' % path)
+        scen = scenario.Scenario.fromSchemaName(scenario.guiscenarioversion)
+        scen.loadAll(container)
+    finally:
+        container.release()
+    return scen
+
+# Scenario most recently loaded by the current worker process, as (path, scenario). Consecutive
+# members that share a base scenario only pay for loading it once per worker, while a worker
+# that processes many different scenarios keeps only one in memory.
+loadedscenario = None
+
+def getLoadedScenario(path):
+    """Returns the scenario at the specified path, loading it if it differs from the scenario
+    that was loaded last; the latter is then released. The returned scenario is owned by this
+    module; callers must add a reference if they keep it.
+    """
+    global loadedscenario
+    if loadedscenario is not None and loadedscenario[0]==path: return loadedscenario[1]
+    if loadedscenario is not None:
+        loadedscenario[1].release()
+        loadedscenario = None
+    scen = loadScenario(path)
+    loadedscenario = (path,scen)
+    return scen
+
+def getMemberName(index,name=None):
+    if name is None: name = 'member%04i' % index
+    return name
+
+def simulateMember(memberresult,sim,outputdir,cdf=True):
+    """Runs an initialized simulator to completion, and writes the result to the output
+    directory. The outcome is stored in the supplied MemberResult object.
+    """
+    res = sim.result
+    if res.returncode==0:
+        memberresult.stepcount = sim.stop-sim.currentpos+1
+        sim.run()
+    sim.finalize()
+
+    memberresult.returncode = res.returncode
+    memberresult.errormessage = res.errormessage
+    if res.returncode==0:
+        if cdf:
+            memberresult.path = os.path.join(outputdir,memberresult.name+'.nc')
+            res.saveNetCDF(memberresult.path)
+        else:
+            memberresult.path = os.path.join(outputdir,memberresult.name+'.gotmresult')
+            res.save(memberresult.path)
+    res.release()
+
+def createSimulator(scen,redirect=True,simulationdir=None,checkpointpath=None):
+    """Creates a simulator for an ensemble member. If a checkpoint path is specified, the
+    simulation branches off from the checkpoint (see runSpinUp).
+    """
+    from . import simulator, checkpoint
+    sim = simulator.Simulator(scen,redirect=redirect,simulationdir=simulationdir)
+    if checkpointpath is not None and sim.result.returncode==0:
+        try:
+            sim.resume(checkpoint.Checkpoint.load(checkpointpath),branch=True)
+        except:
+            sim.result.returncode = 1
+            sim.finalize().release()
+            raise
+    return sim
+
+def runMember(index,member,outputdir,cdf=True,redirect=True,checkpointpath=None):
+    """Simulates a single ensemble member and writes its result to the output directory.
+    This is called from the worker processes, but can also be called directly.
+    """
+
+    memberresult = MemberResult(index,getMemberName(index,member.name))
+    time_start = clock()
+    try:
+        scen = getLoadedScenario(member.path)
+        # The member is an overlay of the shared scenario, which records only its overrides.
+        overlay = scenario.ScenarioOverlay(scen,member.overrides)
+        try:
+            simulateMember(memberresult,createSimulator(overlay,redirect,checkpointpath=checkpointpath),outputdir,cdf)
+        finally:
+            overlay.release()
+    except Exception as e:
+        memberresult.returncode = 1
+        memberresult.errormessage = str(e)
+    memberresult.elapsed = clock()-time_start
+
+    return memberresult
+
+def runMemberTask(task):
+    return runMember(*task)
+
+# Parameter sweep owned by the current worker process (see runSweep).
+workersweep = None
+
+def initSweepWorker(path,members):
+    global workersweep
+    from . import sweep
+    scen = loadScenario(path)
+    workersweep = sweep.Sweep(scen,members)
+    scen.release()
+
+def runSweepMember(index,name,outputdir,cdf=True,redirect=True,checkpointpath=None):
+    """Simulates a single member of the parameter sweep owned by the current worker process
+    (see initSweepWorker) and writes its result to the output directory.
+    """
+    memberresult = MemberResult(index,name)
+    time_start = clock()
+    try:
+        simulationdir = common.TempDirManager.create('gotm-',staging=True)
+        try:
+            workersweep.materialize(index,simulationdir)
+        except:
+            common.TempDirManager.delete(simulationdir)
+            raise
+        # The member is passed as overlay of the sweep's base scenario, so that its result
+        # includes the scenario like that of any other simulation.
+        overlay = workersweep.getMember(index)
+        try:
+            simulateMember(memberresult,createSimulator(overlay,redirect,simulationdir,checkpointpath),outputdir,cdf)
+        finally:
+            overlay.release()
+    except Exception as e:
+        memberresult.returncode = 1
+        memberresult.errormessage = str(e)
+    memberresult.elapsed = clock()-time_start
+
+    return memberresult
+
+def runSweepMemberTask(task):
+    return runSweepMember(*task)
+
+def runSpinUp(path,branchtime,checkpointpath,redirect=True):
+    """Simulates the scenario at the specified path up to the branch time (a datetime object),
+    and saves a checkpoint there (see core.checkpoint). Ensemble members that only differ from
+    this scenario after the branch time can then start from the checkpoint ("warm start"),
+    rather than each simulating the shared spin-up period. Returns the number of time steps
+    simulated.
+    """
+    from . import simulator
+    scen = loadScenario(path)
+    try:
+        sim = simulator.Simulator(scen,redirect=redirect)
+        res = sim.result
+        try:
+            try:
+                if res.returncode==0:
+                    branchpos = sim.getStep(branchtime)
+                    if branchpos<=sim.start or branchpos>sim.stop:
+                        raise Exception('Branch time %s does not lie within the simulated period.' % branchtime)
+                    sim.runUntil(branchpos)
+                    if res.returncode==0:
+                        sim.saveCheckpoint(checkpointpath)
+
+                        # Members must not branch off from a state without profiles: they would
+                        # start cold while reported as warm (Checkpoint.load validates the state).
+                        from . import checkpoint
+                        checkpoint.Checkpoint.load(checkpointpath)
+            finally:
+                sim.finalize()
+            if res.returncode!=0:
+                raise Exception('Spin-up simulation failed. %s' % res.errormessage)
+            stepcount = sim.currentpos-sim.start
+        finally:
+            # The result owns the simulation directory (and open output), also if the spin-up failed.
+            res.release()
+    finally:
+        scen.release()
+    return stepcount
+
+class Ensemble(object):
+    """Result of an ensemble run: the outcome of all members (in the order in which
+    they were specified) plus aggregate timing information.
+    """
+    def __init__(self,members,elapsed,processes):
+        self.members = members
+        self.elapsed = elapsed
+        self.processes = processes
+        self.spinupsteps = 0
+
+    def getFailed(self):
+        return [m for m in self.members if m.returncode!=0]
+
+    def getThroughput(self):
+        """Returns the number of members and the number of GOTM time steps simulated per second
+        of wall time.
+        """
+        if self.elapsed==0: return 0.,0.
+        stepcount = self.spinupsteps+sum([m.stepcount for m in self.members if m.returncode==0])
+        return len(self.members)/self.elapsed,stepcount/self.elapsed
+
+    def getSummary(self):
+        memberrate,steprate = self.getThroughput()
+        return '%i members (%i failed) simulated in %.1f s with %i worker processes: %.2f members/s, %.0f time steps/s.' % (len(self.members),len(self.getFailed()),self.elapsed,self.processes,memberrate,steprate)
+
+def runTasks(function,tasks,processes,callback=None,initializer=None,initargs=(),maxtasksperchild=None):
+    """Calls the function for all tasks in a pool of worker processes, and returns an Ensemble
+    object with the (ordered) results.
+    """
+    processes = max(1,min(processes,len(tasks)))
+    results = []
+    time_start = clock()
+    if processes==1:
+        # Single worker: simulate in the current process.
+        if initializer is not None: initializer(*initargs)
+        for task in tasks:
+            memberresult = function(task)
+            if callback is not None: callback(memberresult)
+            results.append(memberresult)
+    else:
+        pool = multiprocessing.Pool(processes,initializer=initializer,initargs=initargs,maxtasksperchild=maxtasksperchild)
+        try:
+            for memberresult in pool.imap(function,tasks):
+                if callback is not None: callback(memberresult)
+                results.append(memberresult)
+        finally:
+            pool.close()
+            pool.join()
+
+    return Ensemble(results,clock()-time_start,processes)
+
+def runWithSpinUp(path,branchtime,outputdir,function,tasks,processes,**kwargs):
+    """Runs the spin-up of the scenario at the specified path up to the branch time (if not None),
+    and then calls the function for all tasks (see runTasks), with the path of the spin-up
+    checkpoint appended to each task.
+    """
+    if branchtime is None:
+        return runTasks(function,tasks,processes,**kwargs)
+
+    time_start = clock()
+    checkpointpath = os.path.join(outputdir,'spinup.checkpoint')
+    try:
+        spinupsteps = runSpinUp(path,branchtime,checkpointpath)
+        ensemble = runTasks(function,[task+(True,checkpointpath) for task in tasks],processes,**kwargs)
+    finally:
+        shutil.rmtree(checkpointpath,ignore_errors=True)
+    ensemble.spinupsteps = spinupsteps
+    ensemble.elapsed = clock()-time_start
+    return ensemble
+
+def run(members,outputdir,processes=None,cdf=True,callback=None,maxtasksperchild=None,branchtime=None):
+    """Simulates the specified ensemble members in a pool of worker processes, and writes
+    their results to the output directory (NetCDF if cdf is True, .gotmresult otherwise).
+    The optional callback is called with each MemberResult as the members complete.
+    If a branch time (datetime) is specified, all members must share the same scenario path,
+    and their overrides may only affect the simulation after the branch time. The period
+    before the branch time is then simulated only once (see runSpinUp), and all members start
+    from its final state. Overrides of scalar parameters take effect from the branch time;
+    overrides that change profiles (e.g., initial conditions) or the simulated period are not
+    supported in this mode.
+    """
+    if processes is None: processes = multiprocessing.cpu_count()
+    if not os.path.isdir(outputdir): os.makedirs(outputdir)
+
+    path = None
+    if branchtime is not None:
+        paths = set([member.path for member in members])
+        if len(paths)!=1: raise Exception('All ensemble members must share the same scenario if a branch time is specified.')
+        path = paths.pop()
+
+    tasks = [(i,member,outputdir,cdf) for i,member in enumerate(members)]
+    return runWithSpinUp(path,branchtime,outputdir,runMemberTask,tasks,processes,callback=callback,maxtasksperchild=maxtasksperchild)
+
+def runSweep(path,members,outputdir,processes=None,cdf=True,callback=None,names=None,branchtime=None):
+    """Simulates a parameter sweep (see core.sweep) over the scenario at the specified path in a
+    pool of worker processes. The members are dictionaries that map node paths in the GOTM namelist
+    version of the scenario to values. Each worker process converts and writes the base scenario
+    only once. Arguments are as for run.
+    """
+    if processes is None: processes = multiprocessing.cpu_count()
+    if not os.path.isdir(outputdir): os.makedirs(outputdir)
+
+    if names is None: names = [None]*len(members)
+    tasks = [(i,getMemberName(i,name),outputdir,cdf) for i,name in enumerate(names)]
+    return runWithSpinUp(path,branchtime,outputdir,runSweepMemberTask,tasks,processes,callback=callback,initializer=initSweepWorker,initargs=(path,members))
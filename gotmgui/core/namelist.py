@@ -1,6 +1,6 @@
 from __future__ import print_function
 
-import re
+import re, collections, threading
 
 # ------------------------------------------------------------------------------------------
 # Namelist parsing utilities
@@ -25,6 +25,10 @@ class NamelistParseException(Exception):
 class NamelistSubstitutions(object):
     subs_re = None
 
+    # Minimum number of substitutions for which they are compiled (see compile). For fewer
+    # substitutions, making them one after the other is faster.
+    mincompiledcount = 32
+
     def __init__(self,valuesfile):
         self.subs = []
         
@@ -55,7 +59,82 @@ class NamelistSubstitutions(object):
         if ownfile:
             valuesfile.close()
 
+        # The substitutions are compiled on first use (see compile).
+        self.compiled = None
+
+    def compile(self):
+        """Compiles all substitutions into a single regular expression (an alternation of all
+        keys), so that they can be made in a single pass over the text. This gives the same
+        result as making the substitutions one after the other, provided that (1) no key
+        contains another key, (2) no value overlaps the key of a later substitution, as that
+        key could then match (part of) the value, and (3) occurrences of keys in the text do not
+        overlap. If (1) or (2) does not hold, substitutions are always made one after the other.
+        If keys can overlap (e.g., "_A_" and "_B_" in "_A_B_"), (3) is checked for every text.
+        """
+        self.compiled,self.overlapping = False,None
+        if not self.subs or len(self.subs)<self.mincompiledcount: return
+
+        # For all substrings, proper prefixes and proper suffixes of keys: the index of the last
+        # substitution with a key that contains it, and the number of keys that contain it.
+        substrings,prefixes,suffixes,counts = {},{},{},{}
+        for i,(old,new) in enumerate(self.subs):
+            n = len(old)
+            for start in range(n):
+                for stop in range(start+1,n+1):
+                    substring = old[start:stop]
+                    if substrings.get(substring)!=i: counts[substring] = counts.get(substring,0)+1
+                    substrings[substring] = i
+            for k in range(1,n):
+                prefixes[old[:k]] = i
+                suffixes[old[-k:]] = i
+        maxlength = max([len(old) for old,new in self.subs])
+
+        # (1) No key may contain another key.
+        for old,new in self.subs:
+            if counts[old]>1: return
+
+        pattern = '|'.join([re.escape(old) for old,new in self.subs])
+        overlapping = re.compile('(?=(%s))' % pattern)
+        indices = dict([(old,i) for i,(old,new) in enumerate(self.subs)])
+
+        # (2) No value may overlap the key of a later substitution.
+        for i,(old,new) in enumerate(self.subs):
+            if substrings.get(new,-1)>i: return
+            for match in overlapping.finditer(new):
+                if indices[match.group(1)]>i: return
+            for k in range(1,min(len(new),maxlength)):
+                if prefixes.get(new[-k:],-1)>i or suffixes.get(new[:k],-1)>i: return
+
+        # Occurrences of keys can only overlap if a proper suffix of a key is a prefix of a key.
+        keysoverlap = False
+        for old,new in self.subs:
+            for k in range(1,len(old)):
+                if old[-k:] in prefixes: keysoverlap = True
+        if keysoverlap:
+            self.overlapping = overlapping
+        self.compiled = re.compile(pattern)
+        self.values = dict(self.subs)
+
     def substitute(self,text):
+        if self.compiled is None: self.compile()
+        if not self.compiled: return self.substituteSequentially(text)
+        values = self.values
+        if self.overlapping is None:
+            return self.compiled.sub(lambda match: values[match.group(0)],text)
+
+        # Find all occurrences of keys, including overlapping ones. If any overlap (see compile),
+        # make the substitutions one after the other instead.
+        parts,end = [],0
+        for match in self.overlapping.finditer(text):
+            start = match.start()
+            if start<end: return self.substituteSequentially(text)
+            parts.append(text[end:start])
+            parts.append(values[match.group(1)])
+            end = match.end(1)
+        parts.append(text[end:])
+        return ''.join(parts)
+
+    def substituteSequentially(self,text):
         for (old,new) in self.subs:
             #text = old.sub(new,text)
             text = text.replace(old,new)
@@ -63,70 +142,66 @@ class NamelistSubstitutions(object):
 
 class Namelist(object):
 
-    varassign_re   = None
-    varstopchar_re = None
+    # Regular expression that matches one token in the body of a namelist, preceded by optional
+    # whitespace. Groups: (1) quoted string or parenthesized slice/list, (2) operator,
+    # (3) identifier or non-quoted value, (4) end of namelist, (5) any other character.
+    token_re = re.compile(r'''\s*(?:("[^"]*"|'[^']*'|\([^)]*\))|([*=,])|([\w.+-]+)|(/)|(\S))''')
 
     def __init__(self,name,data,filepath=None):
         self.name = name
         self.data = data
         self.filepath = filepath
         
-        # Identify the different items in the namelist
-        ipos = 0
+        # Identify the different items in the namelist, in a single pass over the data.
         items = []
-        while ipos<len(self.data):
-            ch = self.data[ipos]
-            if ch.isspace():
-                # Skip whitespace
-                ipos += 1
-            elif ch in '"\'(':
-                # Character-delimited string or list
-                closech = {'(':')'}.get(ch,ch)
-                iend = self.data.find(closech,ipos+1)
-                if iend==-1: raise Exception('Opening %s is not matched by closing %s.' % (ch,closech))
-                items.append(self.data[ipos:iend+1])
-                ipos = iend+1
-            elif ch in '*=,':
-                # Operator
-                items.append(ch)
-                ipos += 1
-            elif ch.isalnum() or ch in '._-+':
-                # Identifier or non-quoted value
-                iend = ipos+1
-                while iend<len(self.data) and (self.data[iend].isalnum() or self.data[iend] in '._-+'): iend+=1
-                items.append(self.data[ipos:iend])
-                ipos = iend
-            elif ch=='/':
+        for match in self.token_re.finditer(self.data):
+            item = match.group(1) or match.group(2) or match.group(3)
+            if item is not None:
+                items.append(item)
+            elif match.group(4) is not None:
                 break
             else:
+                ch = match.group(5)
+                if ch in '"\'(':
+                    closech = {'(':')'}.get(ch,ch)
+                    raise Exception('Opening %s is not matched by closing %s.' % (ch,closech))
                 print(self.data)
                 raise Exception('Unknown character %s found in namelist.' % ch)
-                ipos += 1
-                
-        i = 0
-        self.assignments = []
-        while items:
-            varname = items.pop(0)
-            equals = items.pop(0)
-            if equals.startswith('(') and equals.endswith(')'):
+
+        # Interpret the items as assignments. Items are consumed by advancing an index, rather
+        # than by removing them from the list, which would take time proportional to the
+        # number of remaining items (e.g., for long arrays).
+        def isslice(item):
+            return item[:1]=='(' and item[-1:]==')'
+        i,n = 0,len(items)
+        self.assignments = collections.deque()
+        while i<n:
+            varname = items[i]
+            if i+1>=n: raise Exception('Equals sign (=) excepted after variable name %s.' % varname)
+            equals = items[i+1]
+            i += 2
+            if isslice(equals):
                 slic = equals[1:-1]
-                equals = items.pop(0)
+                if i>=n: raise Exception('Equals sign (=) excepted after variable name %s.' % varname)
+                equals = items[i]
+                i += 1
             else:
                 slic = None
             if equals!='=': raise Exception('Equals sign (=) excepted after variable name %s.' % varname)
             values,valuerequired = [],True
-            while items and not (len(items)>1 and items[1]=='=') and not (len(items)>2 and items[1][:1]=='(' and items[1][-1:]==')' and items[2]=='='):
-                value = items.pop(0)
+            while i<n and not (i+1<n and items[i+1]=='=') and not (i+2<n and items[i+2]=='=' and isslice(items[i+1])):
+                value = items[i]
+                i += 1
                 if value==',':
                     # Field separator - ignore if a value preceded it, otherwise interpret it as null value.
                     if valuerequired:
                         values.append(None)
                     else:
                         valuerequired = True
-                elif value.isdigit() and len(items)>=2 and items[0]=='*':
+                elif value.isdigit() and n-i>=2 and items[i]=='*':
                     # Multiplication: n*value
-                    items.pop(0)
-                    values += [items.pop(0)]*int(value)
+                    values += [items[i+1]]*int(value)
+                    i += 2
                     valuerequired = False
                 else:
                     # Normal value
@@ -146,12 +221,33 @@ class Namelist(object):
 
     def getNextVariable(self):
         if not self.assignments: return None
-        return self.assignments.pop(0)
+        return self.assignments.popleft()
 
     def isEmpty(self):
         return not self.assignments
 
+    @classmethod
+    def fromAssignments(cls,name,assignments,filepath=None):
+        """Creates a namelist from a list of previously parsed (variable name, slice, value) tuples.
+        """
+        nml = cls.__new__(cls)
+        nml.name = name
+        nml.data = None
+        nml.filepath = filepath
+        nml.assignments = collections.deque(assignments)
+        return nml
+
 class NamelistFile(object):
+    """Reader for a file with namelists. The file is read incrementally: parseNextNamelist
+    reads lines only until the end of the next namelist is found, and text of namelists that
+    have been parsed is not kept. Memory use is therefore bounded by the size of the largest
+    namelist, rather than by the size of the file. Iterating over the object yields all
+    remaining namelists.
+
+    If a file-like object is supplied, it must stay open until all namelists have been read.
+    If a path is supplied, the file is opened here, and closed once it has been read
+    completely, or when close is called.
+    """
     commentchar_re  = None
     namelistname_re = None
     stopchar_re     = None
@@ -166,76 +262,201 @@ class NamelistFile(object):
             NamelistFile.namelistname_re = re.compile('\s*&\s*(\w+)\s*')
             NamelistFile.stopchar_re     = re.compile('[/"\']')
     
-        ownfile = False
+        self.ownfile = False
         if isinstance(nmlfile, (str, u''.__class__)):
-            ownfile = True
+            self.ownfile = True
             
-            # Attempt to open namelist file and read all data
+            # Attempt to open namelist file
+            self.path = nmlfile
             try:
                 nmlfile = open(nmlfile,'rU')
             except Exception as e:
-                raise NamelistParseException('Cannot open namelist file. Error: %s' % (str(e),),path)
-            self.path = nmlfile
+                raise NamelistParseException('Cannot open namelist file. Error: %s' % (str(e),),self.path)
         else:
             self.path = ''
 
+        self.file = nmlfile
+        self.subs = subs
+        self.iline = 0
+
+        # Text read after the end of the last parsed namelist, and the quote character that
+        # is still open at the end of that text (if any).
+        self.pending = ''
+        self.openquote = None
+
+    def __iter__(self):
+        while True:
+            nml = self.parseNextNamelist(eof=False)
+            if nml is None: break
+            yield nml
+
+    def close(self):
+        if self.file is not None and self.ownfile: self.file.close()
+        self.file = None
+
+    def readLine(self):
+        """Returns the next line of the file, with comments removed and substitutions applied,
+        or None if the end of the file has been reached.
+        """
+        if self.file is None: return None
+        line = self.file.readline()
+        if line=='':
+            self.close()
+            return None
+        self.iline += 1
+
+        # Strip comments, i.e. remove everything after (and including) the first exclamation
+        # mark; ignore text between single and double quotes.
+        ipos = 0
+        match = self.commentchar_re.search(line,pos=ipos)
+        while match is not None:
+            ch = match.group(0)
+            if ch=='\'' or ch=='"':
+                ipos = match.end(0)
+                inextquote = line.find(ch,ipos)
+                if inextquote==-1:
+                    raise NamelistParseException('Line %i: opening quote %s was not matched by end quote.' % (self.iline,ch),self.path)
+                ipos = inextquote+1
+            else:
+                # Found start of comment; only keep everything preceding the start position.
+                line = line[:match.start(0)]+'\n'
+                break
+            match = self.commentchar_re.search(line,pos=ipos)
+
+        # Make substitutions (if any). Substitution keys and values cannot span multiple lines,
+        # so substituting line by line is equivalent to substituting in the complete file.
+        for sub in self.subs:
+            line = sub.substitute(line)
+        return line
+
+    def readNextNamelist(self):
+        """Reads lines until the end of the next namelist (slash that is not quoted) is found,
+        and returns all text up to and including that slash. If the end of the file is reached
+        first, all remaining text is returned.
+        """
+        line = self.pending
+        self.pending = ''
+        text = []
+        while line is not None:
+            ipos = 0
+            if self.openquote is not None:
+                # Continuation of a quoted string that started on a previous line.
+                inextquote = line.find(self.openquote)
+                if inextquote==-1:
+                    text.append(line)
+                    line = self.readLine()
+                    continue
+                ipos = inextquote+1
+                self.openquote = None
+            while True:
+                match = self.stopchar_re.search(line,pos=ipos)
+                if match is None: break
+                ch = match.group(0)
+                ipos = match.end(0)
+                if ch=='/':
+                    text.append(line[:ipos])
+                    self.pending = line[ipos:]
+                    return ''.join(text)
+                inextquote = line.find(ch,ipos)
+                if inextquote==-1:
+                    self.openquote = ch
+                    break
+                ipos = inextquote+1
+            text.append(line)
+            line = self.readLine()
+        return ''.join(text)
+
+    def parseNextNamelist(self,expectedlist=None,eof=True):
+        """Parses the next namelist and returns it as Namelist object. If no namelist is found,
+        NamelistParseException is raised; if eof is False, None is returned instead if the
+        file contains nothing but whitespace and comments after the last namelist.
+        """
+        data = self.readNextNamelist()
+        match = self.namelistname_re.match(data)
+        if match is None:
+            if not eof and not data.strip(): return None
+            raise NamelistParseException('No namelist found; expected ampersand followed by namelist name.',self.path)
+        name = match.group(1)
+        if expectedlist is not None and name!=expectedlist:
+            raise NamelistParseException('Expected namelist "%s", but found "%s".' % (expectedlist,name),self.path,expectedlist)
+        if not data.endswith('/'):
+            if self.openquote is not None:
+                raise NamelistParseException('Opening quote %s was not matched by end quote.' % (self.openquote,),self.path,name)
+            raise NamelistParseException('End of namelist (slash) not found.',self.path,name)
+        return Namelist(name,data[match.end(0):-1],filepath=self.path)
+
+class ParsedNamelistFile(object):
+    """All namelists in a file, parsed in advance. This provides the same interface as
+    NamelistFile (parseNextNamelist, iteration). If the file could not be parsed completely, the namelists before the
+    problem are available, and the exception is raised again when the next namelist is requested.
+    """
+    def __init__(self,namelists,path='',exception=None):
+        self.namelists = namelists
+        self.path = path
+        self.exception = exception
+        self.index = 0
+
+    @classmethod
+    def fromFile(cls,nmlfile,subs=[]):
+        """Parses all namelists in the specified file (path or file-like object).
+        """
+        namelists,exception = [],None
+        reader = NamelistFile(nmlfile,subs)
         try:
-            
-            self.data = ''
-            line = nmlfile.readline()
-            iline = 1
-            while line!='':
-
-                # Strip comments, i.e. on every line, remove everything after (and including) the first exclamation
-                # mark; ignore text between single and double quotes.
-                ipos = 0
-                match = self.commentchar_re.search(line,pos=ipos)
-                while match is not None:
-                    ch = match.group(0)
-                    if ch=='\'' or ch=='"':
-                        ipos = match.end(0)
-                        inextquote = line.find(ch,ipos)
-                        if inextquote==-1:
-                            raise NamelistParseException('Line %i: opening quote %s was not matched by end quote.' % (iline,ch),path)
-                        ipos = inextquote+1
-                    else:
-                        # Found start of comment; only keep everything preceding the start position.
-                        line = line[:match.start(0)]+'\n'
-                        break
-                    match = self.commentchar_re.search(line,pos=ipos)
-
-                self.data += line
-                line = nmlfile.readline()
-                iline += 1
+            while True:
+                nml = reader.parseNextNamelist(eof=False)
+                if nml is None: break
+                namelists.append((nml.name,list(nml)))
+        except Exception as e:
+            exception = e
         finally:
-            if ownfile: nmlfile.close()
+            reader.close()
+        return cls(namelists,reader.path,exception)
 
-        # Make substitutions (if any).
-        for sub in subs:
-            self.data = sub.substitute(self.data)
+    def __iter__(self):
+        while self.index<len(self.namelists):
+            yield self.parseNextNamelist()
+        if self.exception is not None: raise self.exception
 
     def parseNextNamelist(self,expectedlist=None):
-        match = self.namelistname_re.match(self.data)
-        if match is None:
+        if self.index>=len(self.namelists):
+            if self.exception is not None: raise self.exception
             raise NamelistParseException('No namelist found; expected ampersand followed by namelist name.',self.path)
-        name = match.group(1)
+        name,assignments = self.namelists[self.index]
         if expectedlist is not None and name!=expectedlist:
             raise NamelistParseException('Expected namelist "%s", but found "%s".' % (expectedlist,name),self.path,expectedlist)
-        istart = match.end(0)
-        ipos = istart
-        while True:
-            match = self.stopchar_re.search(self.data,pos=ipos)
-            if match is None:
-                raise NamelistParseException('End of namelist (slash) not found.',self.path,name)
-            ch = match.group(0)
-            ipos = match.end(0)
-            if ch=='/':
-                break
-            else:
-                inextquote = self.data.find(ch,ipos)
-                if inextquote==-1:
-                    raise NamelistParseException('Opening quote %s was not matched by end quote.' % (ch,),self.path,name)
-                ipos = inextquote+1
-        namelistdata = self.data[istart:ipos-1]
-        self.data = self.data[ipos:]
-        return Namelist(name,namelistdata,filepath=self.path)
+        self.index += 1
+        return Namelist.fromAssignments(name,assignments,filepath=self.path)
+
+class NamelistCache(object):
+    """Cache of ParsedNamelistFile objects. Keys must identify the file and its version (e.g., its
+    path, size and modification time), and any substitutions applied. The least recently used
+    files are dropped if the cache holds more than maxsize files.
+    """
+    def __init__(self,maxsize=64):
+        self.maxsize = maxsize
+        self.files = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self,key):
+        """Returns the parsed namelist file for the key, positioned at the first namelist,
+        or None if the key is not in the cache.
+        """
+        with self.lock:
+            nmlfile = self.files.pop(key,None)
+            if nmlfile is None: return None
+            self.files[key] = nmlfile
+        return ParsedNamelistFile(nmlfile.namelists,nmlfile.path,nmlfile.exception)
+
+    def add(self,key,nmlfile):
+        with self.lock:
+            self.files.pop(key,None)
+            self.files[key] = nmlfile
+            while len(self.files)>self.maxsize: self.files.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+
+# Parsed namelist files that are shared by all scenarios (see core.scenario.NamelistStore.loadFromNamelists)
+cache = NamelistCache()
@@ -1,10 +1,121 @@
 # Import modules from standard Python library
-import os, xml.dom.minidom, shutil, io
+import sys, os, xml.dom.minidom, shutil, io, multiprocessing, hashlib, json
 
 # Import own custom modules
 import xmlstore.util, xmlstore.xmlstore
 
-from . import common
+from . import common, cache
+from . import scenario as core_scenario
+
+# Name of the file in the report directory that describes the inputs of all figures, so that
+# figures with unchanged inputs can be reused when the report is regenerated.
+manifestname = 'manifest.json'
+
+def configureHeadless():
+    """Selects the pure Agg backend of matplotlib, so figures can be rendered without a display
+    and without loading Qt. This only has effect if matplotlib.pyplot has not been imported yet
+    (directly or through xmlplot); returns whether the Agg backend is in use.
+    """
+    os.environ['MPLBACKEND'] = 'agg'
+    import matplotlib
+    if 'matplotlib.pyplot' not in sys.modules: matplotlib.use('agg')
+    return matplotlib.get_backend().lower()=='agg'
+
+def renderResultFigure(fig,result,varpath,fontscaling,outputfile,dpi):
+    """Renders the figure of a result variable to file, using the figure settings stored in
+    the result, if any. The result must have been added to the figure as data source "result".
+    """
+    varid = varpath.split('/')[-1]
+    fig.setUpdating(False)
+    if not result.getFigure('result/'+varpath,fig.properties):
+        fig.clearProperties()
+        fig.addVariable('result[\'%s\']' % varid)
+    fig['FontScaling'].setValue(fontscaling)
+    fig.setUpdating(True)
+    fig.exportToFile(outputfile,dpi=dpi)
+
+# Result and figure owned by the current worker process (see Report.generate).
+workerresult,workerfigure = None,None
+
+def initFigureWorker(resultpath,storexml,saveinterval,fontname,headless):
+    global workerresult,workerfigure
+    if headless: configureHeadless()
+    from . import result
+    import xmlplot.plot
+    workerresult = result.Result()
+    workerresult.attach(resultpath,copy=False)
+
+    # The worker has no scenario: take the output interval from that of the main process,
+    # so that time axes are identical to those of figures rendered in the main process.
+    workerresult.saveinterval = saveinterval
+    workerresult.store.setStore(xml.dom.minidom.parseString(storexml))
+    workerfigure = xmlplot.plot.Figure(defaultfont=fontname)
+    workerfigure.addDataSource('result',workerresult)
+
+def renderResultFigureTask(task):
+    varpath,fontscaling,outputfile,dpi = task
+    renderResultFigure(workerfigure,workerresult,varpath,fontscaling,outputfile,dpi)
+
+def getFigureKey(*items):
+    """Returns a hash of all inputs of a figure.
+    """
+    m = hashlib.sha1()
+    for item in items:
+        if not isinstance(item,bytes): item = u''.__class__(item).encode('utf-8')
+        m.update(item)
+        m.update(b'\0')
+    return m.hexdigest()
+
+# Fingerprints of result files, indexed by (path, size, modification time), so that each file
+# is hashed only once per process.
+resultfingerprints = {}
+
+def getResultFingerprint(result):
+    """Returns a string that changes whenever the data of the result change, or None if the
+    result is not backed by a file (figures are then always rendered). This is a hash of the
+    contents of the result file, because the file itself is extracted anew into a temporary
+    directory whenever a .gotmresult file is loaded.
+    """
+    if result.isInMemory() or result.datafile is None or not os.path.isfile(result.datafile): return None
+    st = os.stat(result.datafile)
+    stamp = (result.datafile,st.st_size,st.st_mtime)
+    fingerprint = resultfingerprints.get(stamp)
+    if fingerprint is None:
+        m = hashlib.sha1()
+        with open(result.datafile,'rb') as f:
+            while True:
+                dat = f.read(1024*1024)
+                if not dat: break
+                m.update(dat)
+        fingerprint = m.hexdigest()
+        resultfingerprints[stamp] = fingerprint
+    return fingerprint
+
+def readManifest(outputpath):
+    try:
+        with io.open(os.path.join(outputpath,manifestname),'r',encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError,OSError,ValueError):
+        return {}
+
+def writeManifest(outputpath,manifest):
+    with io.open(os.path.join(outputpath,manifestname),'w',encoding='utf-8') as f:
+        f.write(u''.__class__(json.dumps(manifest,indent=1,sort_keys=True)))
+
+def isCopyUpToDate(source,target):
+    """Returns whether the target is an up-to-date copy of the source file.
+    """
+    if not os.path.isfile(target): return False
+    return os.path.getsize(target)==os.path.getsize(source) and os.path.getmtime(target)>=os.path.getmtime(source)
+
+def createimagecell(xmldocument,filename,longname,width):
+    img = xmldocument.createElement('img')
+    img.setAttribute('src',filename)
+    img.setAttribute('alt',longname)
+    img.setAttribute('style','width:%.2fcm' % width)
+    td = xmldocument.createElement('td')
+    td.appendChild(img)
+    return td
 
 def createtable(xmldocument,tds,columncount):
     table = xmldocument.createElement('table')
@@ -68,9 +179,22 @@ class Report(xmlstore.util.referencedobject):
         self.store.release()
         self.store = None
         
-    def generate(self,result,outputpath,templatepath,columncount=2,callback=None):
+    def generate(self,result,outputpath,templatepath,columncount=2,callback=None,headless=False,processes=1,incremental=False):
+        # If incremental is set, template files and figures that are unchanged since the previous
+        # report in the output directory are reused (see manifestname). The HTML is always rebuilt.
+        # If headless is set, figures are rendered with the pure Agg backend of matplotlib
+        # (see configureHeadless), so no display is needed.
+        # Figures of result variables are rendered by the specified number of worker processes
+        # (None: one per CPU core). Figures of input data are always rendered in this process.
+        # If the scenario of the result is a core.scenario.ScenarioOverlay, its changes are
+        # applied to the base scenario while the report is generated.
+        with core_scenario.appliedScenario(result.scenario) as scenario:
+            self.generateForScenario(result,scenario,outputpath,templatepath,columncount,callback,headless,processes,incremental)
+
+    def generateForScenario(self,result,scenario,outputpath,templatepath,columncount,callback,headless,processes,incremental):
+        if headless: configureHeadless()
+
         xmldocument = xml.dom.minidom.parse(os.path.join(templatepath,'index.xml'))
-        scenario = result.scenario
         
         # Get report settings
         figuresize  = (self.store['Figures/Width'     ].getValue(usedefault=True),self.store['Figures/Height'].getValue(usedefault=True))
@@ -97,11 +221,19 @@ class Report(xmlstore.util.referencedobject):
         # Create output directory if it does not exist yet.
         if not os.path.isdir(outputpath): os.mkdir(outputpath)
 
+        # Manifest with the inputs of the figures in the previous report (if incremental),
+        # and the manifest for the figures in the new report.
+        oldmanifest = {}
+        if incremental: oldmanifest = readManifest(outputpath)
+        manifest = {}
+
         # Copy auxilliary files such as CSS, JS (everything but index.xml)
         for f in os.listdir(templatepath):
             fullpath = os.path.join(templatepath,f)
             if f.lower()!='index.xml' and os.path.isfile(fullpath):
-                shutil.copy(fullpath,os.path.join(outputpath,f))
+                targetpath = os.path.join(outputpath,f)
+                if incremental and isCopyUpToDate(fullpath,targetpath): continue
+                shutil.copy(fullpath,targetpath)
 
         # --------------------------------------------------------------
         # Replace "gotm:scenarioproperty" tags in index.xml by the
@@ -172,44 +304,49 @@ class Report(xmlstore.util.referencedobject):
             nodePreceding = scentable.nextSibling
             mintime,maxtime = scenario['/time/start'].getValue(usedefault=True),scenario['/time/stop'].getValue(usedefault=True)
             for node,store in inputdata:
-                if callback is not None:
-                    store.getData(callback=lambda progress,msg: callback((istep+progress)/steps,'Parsing %s...' % (node.getText(1),)))
+                # Figures of this dataset can be reused if the data and figure settings are unchanged.
+                location = '/'.join(node.location)
+                key = getFigureKey('input',location,cache.getDataFileFingerprint(store),mintime,maxtime,figuresize,dpi,fontscaling,fontname)
+                entry = oldmanifest.get('input:'+location)
+                if entry is not None and entry['key']==key and all([os.path.isfile(os.path.join(outputpath,filename)) for filename,longname in entry['figures']]):
+                    if callback is not None: callback(istep/steps,'Reusing figures for %s...' % (node.getText(1),))
+                    figures = entry['figures']
+                    istep += 1+len(figures)
                 else:
-                    store.getData()
-                istep += 1
-                tds = []
-                fig.addDataSource('input',store)
-                vardict = store.getVariableLongNames()
-                for varid in store.keys():
-                    longname = vardict[varid]
-                    if callback is not None: callback(istep/steps,'Creating figure for %s...' % longname)
-
-                    fig.setUpdating(False)
-                    fig.clearProperties()
-                    fig.addVariable(varid)
-                    fig['FontScaling'].setValue(fontscaling)
-                    fig.setUpdating(True)
-                    
-                    fig.setUpdating(False)
-                    for axisnode in fig['Axes'].getLocationMultiple(['Axis']):
-                        if axisnode['IsTimeAxis'].getValue(usedefault=True):
-                            axisnode['MinimumTime'].setValue(mintime)
-                            axisnode['MaximumTime'].setValue(maxtime)
-                    fig.setUpdating(True)
-                    
-                    filename = 'in_'+varid+'.png'
-                    outputfile = os.path.join(outputpath,filename)
-                    fig.exportToFile(outputfile,dpi=dpi)
-
-                    img = xmldocument.createElement('img')
-                    img.setAttribute('src',filename)
-                    img.setAttribute('alt',longname)
-                    img.setAttribute('style','width:%.2fcm' % figuresize[0])
-                    td = xmldocument.createElement('td')
-                    td.appendChild(img)
-                    tds.append(td)
-
+                    if callback is not None:
+                        store.getData(callback=lambda progress,msg: callback((istep+progress)/steps,'Parsing %s...' % (node.getText(1),)))
+                    else:
+                        store.getData()
                     istep += 1
+                    figures = []
+                    fig.addDataSource('input',store)
+                    vardict = store.getVariableLongNames()
+                    for varid in store.keys():
+                        longname = vardict[varid]
+                        if callback is not None: callback(istep/steps,'Creating figure for %s...' % longname)
+
+                        fig.setUpdating(False)
+                        fig.clearProperties()
+                        fig.addVariable(varid)
+                        fig['FontScaling'].setValue(fontscaling)
+                        fig.setUpdating(True)
+
+                        fig.setUpdating(False)
+                        for axisnode in fig['Axes'].getLocationMultiple(['Axis']):
+                            if axisnode['IsTimeAxis'].getValue(usedefault=True):
+                                axisnode['MinimumTime'].setValue(mintime)
+                                axisnode['MaximumTime'].setValue(maxtime)
+                        fig.setUpdating(True)
+
+                        filename = 'in_'+varid+'.png'
+                        outputfile = os.path.join(outputpath,filename)
+                        fig.exportToFile(outputfile,dpi=dpi)
+                        figures.append((filename,longname))
+
+                        istep += 1
+                manifest['input:'+location] = {'key':key,'figures':figures}
+
+                tds = [createimagecell(xmldocument,filename,longname,figuresize[0]) for filename,longname in figures]
                 header = xmldocument.createElement('h3')
                 header.appendChild(xmldocument.createTextNode(node.getText(1)))
                 figurestable = createtable(xmldocument,tds,columncount)
@@ -230,34 +367,65 @@ class Report(xmlstore.util.referencedobject):
         else:
             figuresnode = None
         if len(plotvariables)>0 and figuresnode is not None:
-            fig.clearSources()
-            fig.addDataSource('result',result)
-            tds = []
+            # Determine the names and file names of all figures first. Figures may then be rendered
+            # in parallel, while the table of figures keeps the order of the selection.
+            # Figures whose inputs (data, figure settings stored in the result, and report settings)
+            # are unchanged since the previous report are reused, if incremental.
+            resultfingerprint = getResultFingerprint(result)
+            figures,tasks = [],[]
+            if resultfingerprint is not None: fig.setUpdating(False)
             for varpath in plotvariables:
                 varid = varpath.split('/')[-1]
-                
-                longname = result.getVariable(varid).getLongName()
-                if callback is not None: callback(istep/steps,'Creating figure for %s...' % longname)
-                
-                fig.setUpdating(False)
-                if not result.getFigure('result/'+varpath,fig.properties):
-                    fig.clearProperties()
-                    fig.addVariable('result[\'%s\']' % varid)
-                fig['FontScaling'].setValue(fontscaling)
-                fig.setUpdating(True)
                 filename = 'out_'+varid+'.png'
-                outputfile = os.path.join(outputpath,filename)
-                fig.exportToFile(outputfile,dpi=dpi)
-
-                img = xmldocument.createElement('img')
-                img.setAttribute('src',filename)
-                img.setAttribute('alt',longname)
-                img.setAttribute('style','width:%.2fcm' % figuresize[0])
-                td = xmldocument.createElement('td')
-                td.appendChild(img)
-                tds.append(td)
-
-                istep += 1
+                figures.append((varpath,result.getVariable(varid).getLongName(),filename))
+                key = None
+                if resultfingerprint is not None:
+                    figuresettings = ''
+                    if result.getFigure('result/'+varpath,fig.properties): figuresettings = fig.properties.root.valuenode.toxml('utf-8')
+                    key = getFigureKey('result',varpath,resultfingerprint,figuresettings,figuresize,dpi,fontscaling,fontname)
+                    manifest[filename] = {'key':key}
+                entry = oldmanifest.get(filename)
+                if key is None or entry is None or entry['key']!=key or not os.path.isfile(os.path.join(outputpath,filename)):
+                    tasks.append((varpath,fontscaling,os.path.join(outputpath,filename),dpi))
+            if resultfingerprint is not None: fig.setUpdating(True)
+            tasksfiles = set([task[2] for task in tasks])
+
+            # Render in a pool of worker processes, if possible. Each worker opens the result file
+            # itself, and receives the result properties (with stored figure settings) as XML.
+            if processes is None: processes = multiprocessing.cpu_count()
+            processes = min(processes,len(tasks))
+            if result.isInMemory() or result.datafile is None or result.store.root.valuenode is None: processes = 1
+            pool = None
+            if processes>1:
+                storexml = result.store.root.valuenode.toxml('utf-8')
+                pool = multiprocessing.Pool(processes,initializer=initFigureWorker,initargs=(result.datafile,storexml,result.getSaveInterval(),fontname,headless))
+                rendered = pool.imap(renderResultFigureTask,tasks)
+            else:
+                fig.clearSources()
+                fig.addDataSource('result',result)
+                rendered = (renderResultFigure(fig,result,*task) for task in tasks)
+
+            try:
+                tds = []
+                for varpath,longname,filename in figures:
+                    if os.path.join(outputpath,filename) in tasksfiles:
+                        if callback is not None: callback(istep/steps,'Creating figure for %s...' % longname)
+
+                        # Wait for the figure to be rendered (in order).
+                        next(rendered)
+                    elif callback is not None:
+                        callback(istep/steps,'Reusing figure for %s...' % longname)
+
+                    tds.append(createimagecell(xmldocument,filename,longname,figuresize[0]))
+
+                    istep += 1
+            except:
+                if pool is not None: pool.terminate()
+                raise
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
             figurestable = createtable(xmldocument,tds,columncount)
             figuresnode.parentNode.replaceChild(figurestable,figuresnode)
         elif figuresnode is not None:
@@ -271,6 +439,7 @@ class Report(xmlstore.util.referencedobject):
         if outputpath != '':
             with io.open(os.path.join(outputpath, 'index.html'), 'w', encoding='utf-8') as f:
                 xmldocument.writexml(f,encoding='utf-8')
+            writeManifest(outputpath,manifest)
         else:
             print(xmldocument.toxml('utf-8'))
         istep += 1
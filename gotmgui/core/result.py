@@ -49,6 +49,19 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
 
         self.path = None
 
+        # Interval between outputs in seconds, for results without scenario (see getSaveInterval).
+        self.saveinterval = None
+
+        # Store with results that are held in memory rather than in a NetCDF file (see attachMemory)
+        self.memorystore = None
+
+        # Timings of the slabs in which the simulation was run: (first time step, number of time steps, seconds)
+        self.slabtimings = []
+
+        # Timing table with the wall time spent in the phases of the simulation: (phase, seconds).
+        # Only filled if the simulation was profiled (see core.simulator.Simulator).
+        self.timings = []
+
     def hasChanged(self):
         return self.changed or self.store.changed
 
@@ -60,11 +73,48 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
             self.tempdir = common.TempDirManager.create(prefix='gotm-')
         return self.tempdir
 
+    def getSlabStatistics(self):
+        """Returns a dictionary with the number of slabs, the total time spent in slabs (s),
+        and the minimum, mean and maximum duration of a slab (s) and cost per time step (s).
+        """
+        if not self.slabtimings: return None
+        durations = [elapsed for firststep,stepcount,elapsed in self.slabtimings]
+        stepcosts = [elapsed/stepcount for firststep,stepcount,elapsed in self.slabtimings]
+        return {'count':len(durations),'total':sum(durations),
+                'minduration':min(durations),'meanduration':sum(durations)/len(durations),'maxduration':max(durations),
+                'minstepcost':min(stepcosts),'meanstepcost':sum(durations)/sum([stepcount for firststep,stepcount,elapsed in self.slabtimings]),'maxstepcost':max(stepcosts)}
+
+    def getTimingReport(self):
+        """Returns the timing table (plus slab statistics) as formatted text.
+        """
+        if not self.timings: return 'No timings available (the simulation was not profiled).'
+        total = sum([seconds for phase,seconds in self.timings])
+        lines = ['%-40s %10s %6s' % ('phase','time (s)','%')]
+        for phase,seconds in self.timings:
+            lines.append('%-40s %10.3f %6.1f' % (phase,seconds,100.*seconds/max(total,1e-12)))
+        lines.append('%-40s %10.3f %6.1f' % ('total',total,100.))
+        stats = self.getSlabStatistics()
+        if stats is not None:
+            lines.append('slabs: %i, duration %.3f-%.3f s (mean %.3f s), cost per time step %.3g-%.3g s (mean %.3g s)' % (stats['count'],stats['minduration'],stats['maxduration'],stats['meanduration'],stats['minstepcost'],stats['maxstepcost'],stats['meanstepcost']))
+        return '\n'.join(lines)
+
+    def isInMemory(self):
+        return self.memorystore is not None
+
     def saveNetCDF(self,path):
-        xmlplot.data.NetCDFStore_GOTM.save(self,path)
+        if self.memorystore is not None:
+            self.memorystore.capture.saveNetCDF(path)
+        else:
+            xmlplot.data.NetCDFStore_GOTM.save(self,path)
 
     def save(self,path,addfiguresettings=True,callback=None):
-        assert self.datafile is not None, 'The result object was not yet attached to a result file (NetCDF).'
+        if self.memorystore is not None:
+            # Results are held in memory; write them to a NetCDF file that can be added to the archive.
+            datafile = os.path.join(self.getTempDir(),'result.nc')
+            self.memorystore.capture.saveNetCDF(datafile)
+        else:
+            datafile = self.datafile
+        assert datafile is not None, 'The result object was not yet attached to a result file (NetCDF).'
 
         progslicer = xmlstore.util.ProgressSlicer(callback,2)
 
@@ -93,9 +143,19 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
             added.release()
             df.release()
 
+        # Add the timing table and slab timings, if available.
+        if self.timings:
+            timingdata = ''.join(['%s\t%r\n' % (phase,seconds) for phase,seconds in self.timings])
+            slabdata = ''.join(['%i\t%i\t%r\n' % slabtiming for slabtiming in self.slabtimings])
+            for data,name in ((timingdata,'timings.txt'),(slabdata,'slabs.txt')):
+                df = xmlstore.datatypes.DataFileMemory(data.encode('utf-8'),name)
+                added = container.addItem(df)
+                added.release()
+                df.release()
+
         # Add the result data (NetCDF)
         progslicer.nextStep('saving result data')
-        container.addFile(self.datafile,'result.nc')
+        container.addFile(datafile,'result.nc')
 
         # Make changes to container persistent (this closes the ZIP file), and release it.
         container.persistChanges()
@@ -110,8 +170,7 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
     @classmethod
     def canBeOpened(cls, container):
         assert isinstance(container,xmlstore.datatypes.DataContainer), 'Argument must be data container object.'
-        filelist = container.listFiles()
-        return ('result.nc' in filelist and 'scenario.gotmscenario' in filelist)
+        return common.isResultContainer(container)
 
     def load(self,path):
         if isinstance(path, (str, u''.__class__)):
@@ -146,6 +205,19 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
             f.close()
             df.release()
 
+        # Read the timing table and slab timings, if present.
+        def readtable(name):
+            df = container.getItem(name)
+            if df is None: return []
+            f = df.getAsReadOnlyFile()
+            data = f.read()
+            f.close()
+            df.release()
+            if not isinstance(data,u''.__class__): data = data.decode('utf-8')
+            return [line.split('\t') for line in data.splitlines() if line]
+        self.timings = [(phase,float(seconds)) for phase,seconds in readtable('timings.txt')]
+        self.slabtimings = [(int(firststep),int(stepcount),float(seconds)) for firststep,stepcount,seconds in readtable('slabs.txt')]
+
         # Store path from where the result was loaded
         self.path = container.path
 
@@ -177,6 +249,7 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
         # First unlink NetCDf store, because that releases the .nc file,
         # allowing us to delete the temporary directory.
         xmlplot.data.NetCDFStore_GOTM.unlink(self)
+        self.memorystore = None
 
         if self.tempdir is not None:
             # Delete temporary directory.
@@ -187,10 +260,7 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
         self.store.release()
 
     def attach(self,srcpath,scenario=None,copy=True):
-        if scenario is not None:
-            self.scenario = scenario.convert(self.wantedscenarioversion)
-        else:
-            self.scenario = None
+        self.setScenario(scenario)
 
         if copy:
             # Create a copy of the result file.
@@ -205,12 +275,45 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
         # Attached to an existing result: we consider it unchanged.
         self.changed = False
 
+    def attachMemory(self,memorystore,scenario=None):
+        """Attaches to results held in memory (a core.capture.MemoryStore object).
+        A NetCDF file is only created when the result is saved.
+        """
+        self.setScenario(scenario)
+        self.memorystore = memorystore
+        self.changed = True
+
+    def setScenario(self,scenario):
+        if scenario is not None:
+            self.scenario = scenario.convert(self.wantedscenarioversion)
+        else:
+            self.scenario = None
+
         if self.scenario is not None and self.scenario.path is not None and self.scenario.path.endswith('.gotmscenario'):
             self.path = self.scenario.path[:-12]+'gotmresult'
         else:
             self.path = None
 
+    def getVariableNames_raw(self):
+        if self.memorystore is not None: return self.memorystore.getVariableNames_raw()
+        return xmlplot.data.NetCDFStore_GOTM.getVariableNames_raw(self)
+
+    def getVariableLongNames_raw(self):
+        if self.memorystore is not None: return self.memorystore.getVariableLongNames_raw()
+        return xmlplot.data.NetCDFStore_GOTM.getVariableLongNames_raw(self)
+
+    def getVariable_raw(self,varname):
+        if self.memorystore is not None: return self.memorystore.getVariable_raw(varname)
+        return xmlplot.data.NetCDFStore_GOTM.getVariable_raw(self,varname)
+
+    def getDimensionInfo_raw(self,dimname):
+        if self.memorystore is not None: return self.memorystore.getDimensionInfo_raw(dimname)
+        return xmlplot.data.NetCDFStore_GOTM.getDimensionInfo_raw(self,dimname)
+
     def getPlottableVariableNames_raw(self):
+        # All variables held in memory are depth profiles.
+        if self.memorystore is not None: return self.memorystore.getVariableNames_raw()
+
         names = self.getVariableNames_raw()
         for i in range(len(names)-1,-1,-1):
             dimnames = self.nc.variables[names[i]].dimensions
@@ -228,12 +331,31 @@ class Result(xmlplot.data.NetCDFStore_GOTM):
 
     def getVariableTree(self, plottableonly=True):
         otherstores = {}
+        if isinstance(self.scenario,scenario.ScenarioOverlay):
+            # Variables of the scenario are exposed through its nodes, which requires a complete scenario.
+            overlay = self.scenario
+            self.scenario = overlay.materialize()
+            overlay.release()
         if self.scenario is not None:
             otherstores['scenario'] = self.scenario
         return xmlplot.common.VariableStore.getVariableTree(self, otherstores=otherstores, plottableonly=plottableonly)
 
     def getDefaultCoordinateDelta(self,dimname,coord):
-        if self.scenario is not None and self.isTimeDimension(dimname):
-            delta = self.scenario['output/dtsave'].getValue(usedefault=True)
-            if delta is not None: return delta.getAsSeconds()/86400.
+        if self.memorystore is not None:
+            if dimname=='time': return self.memorystore.capture.nsave*self.memorystore.capture.dt/86400.
+            return xmlplot.common.VariableStore.getDefaultCoordinateDelta(self,dimname,coord)
+        if self.isTimeDimension(dimname):
+            interval = self.getSaveInterval()
+            if interval is not None: return interval/86400.
         return xmlplot.data.NetCDFStore_GOTM.getDefaultCoordinateDelta(self,dimname,coord)
+
+    def getSaveInterval(self):
+        """Returns the interval between outputs in seconds as set in the scenario, or, if the result
+        has no scenario, the value of the saveinterval attribute (e.g., set by report worker processes).
+        Returns None if the interval is unknown.
+        """
+        if self.scenario is not None:
+            delta = self.scenario['output/dtsave'].getValue(usedefault=True)
+            if delta is not None: return delta.getAsSeconds()
+            return None
+        return self.saveinterval
@@ -7,7 +7,7 @@ guiscenarioversion = 'gotmgui-0.5.0'
 savedscenarioversion = 'gotm-4.0.0'
 
 # Import modules from standard Python library
-import os, shutil, re, datetime, sys
+import os, shutil, re, datetime, sys, zipfile, tarfile, contextlib
 
 # Import our own custom modules
 import xmlstore.xmlstore, xmlstore.util, xmlstore.datatypes
@@ -25,6 +25,195 @@ if os.path.isdir(srcdir): xmlstore.xmlstore.Schema.knownpaths['gotmsrc'] = srcdi
 
 schemadir = None
 
+def getNamelistFileStamp(containerpath,name=None):
+    """Returns a tuple that identifies a version of a namelist file: its path, size and
+    modification time. The file is either a single file (name is None), or a file in a
+    directory, zip or tar.gz archive (name is the path within). For archives, the version of
+    the archive is used. Returns None if the file does not exist.
+    """
+    path = containerpath
+    if os.path.isdir(containerpath): path = os.path.join(containerpath,name)
+    if not os.path.isfile(path): return None
+    st = os.stat(path)
+    return (os.path.abspath(path),name,st.st_size,st.st_mtime)
+
+def getParsedNamelistFile(key,openfile,subs=[]):
+    """Returns the parsed namelist file for the specified key from the shared cache
+    (core.namelist.cache). If it is not present, the file is opened with the supplied function
+    (returning a file-like object and a reference to release, or None), parsed and cached.
+    """
+    nmlfile = None
+    if key[0] is not None: nmlfile = namelist.cache.get(key)
+    if nmlfile is None:
+        f,ref = openfile()
+        try:
+            nmlfile = namelist.ParsedNamelistFile.fromFile(f,subs)
+        finally:
+            f.close()
+            if ref is not None: ref.release()
+        if key[0] is not None: namelist.cache.add(key,nmlfile)
+    return nmlfile
+
+class NamelistFingerprint(object):
+    """Names of the namelists and variables in a set of namelist files (a directory, zip or
+    tar.gz archive, or a single file). Files are parsed on first request only, and values are
+    not interpreted. Parsed files are shared with NamelistStore.loadFromNamelists through the
+    namelist cache, so they are not read again when loading. This is used to pick the schema
+    that best matches the namelists, before loading them with the (much more expensive)
+    NamelistStore.loadFromNamelists.
+    """
+    def __init__(self,path,prototypepath=None):
+        self.path = path
+        self.containerpath = path
+        self.container = None
+        if prototypepath is not None:
+            # The namelist structure is described by the prototype files.
+            self.container = xmlstore.datatypes.DataContainerDirectory(prototypepath)
+            self.containerpath = prototypepath
+        elif not os.path.isfile(path) or zipfile.is_zipfile(path) or tarfile.is_tarfile(path):
+            try:
+                self.container = xmlstore.datatypes.DataContainer.fromPath(path)
+            except Exception as e:
+                raise Exception('Unable to load specified path. %s' % (e,))
+        self.filelist = None
+        if self.container is not None: self.filelist = self.container.listFiles()
+        self.namelists = {}
+
+    def release(self):
+        if self.container is not None: self.container.release()
+        self.container = None
+
+    def getNamelists(self,filename=None):
+        """Returns a list with the name and set of variable names (all lower case) of all
+        namelists in the specified file, or None if the file is not present. If the path
+        refers to a single namelist file, filename must be None.
+        """
+        if filename is None:
+            if self.container is not None: return None
+        elif self.container is None:
+            return None
+        else:
+            # Like loadFromNamelists, also accept the file deeper in the container tree.
+            for fn in self.filelist:
+                if fn==filename or fn.endswith('/'+filename):
+                    filename = fn
+                    break
+            else:
+                return None
+        if filename not in self.namelists:
+            def openfile():
+                if filename is None: return open(self.path,'r'),None
+                df = self.container.getItem(filename)
+                return df.getAsReadOnlyFile(),df
+            nmlfile = getParsedNamelistFile((getNamelistFileStamp(self.containerpath,filename),None,()),openfile)
+
+            # Namelists that follow a parse error are ignored.
+            self.namelists[filename] = [(name.lower(),set([varname.lower() for varname,slic,vardata in assignments])) for name,assignments in nmlfile.namelists]
+        return self.namelists[filename]
+
+def toNamelistAscii(value):
+    """Returns the string with characters that cannot be represented in ASCII replaced (see
+    xmlstore.util, error handler xmlstore_descrepl). Most strings are ASCII already, and are
+    returned as is.
+    """
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeError:
+        return value.encode('ascii','xmlstore_descrepl').decode()
+
+class LinkingDataContainer(xmlstore.datatypes.DataContainerDirectory):
+    """Directory to which data files are added by linking rather than copying them (see
+    common.linkFile and common.datafilelinkstrategies), so that adding a file takes constant
+    time, whatever its size. Data files that are not available on disk (e.g., because they
+    are stored in a zip archive) are first written to the shared input cache (cache.InputCache),
+    once, and linked from there. Only use this for files that will not be modified afterwards.
+    """
+    def __init__(self,path,inputcache=None,strategies=None):
+        xmlstore.datatypes.DataContainerDirectory.__init__(self,path)
+        if strategies is None: strategies = common.datafilelinkstrategies
+        self.inputcache = inputcache
+        self.strategies = strategies
+
+    def addItem(self,datafile,newname=None):
+        assert datafile.isValid()
+        if newname is None: newname = datafile.name
+        targetpath = os.path.join(self.path,newname)
+
+        # Never write through an existing (possibly linked) file.
+        if os.path.lexists(targetpath): os.remove(targetpath)
+
+        sourcepath = getattr(datafile,'path',None)
+        if sourcepath is None or not os.path.isfile(sourcepath):
+            sourcepath = None
+            if self.inputcache is not None: sourcepath = self.inputcache.getFile(datafile)
+        if sourcepath is None:
+            datafile.saveToFile(targetpath)
+        else:
+            common.linkFile(sourcepath,targetpath,self.strategies)
+        return self.DataFileFile(targetpath)
+
+class NamelistRoles(object):
+    """Roles of the nodes of a NamelistStore in the namelist representation: directory (0), file (1),
+    namelist (2) or namelist variable (3), plus the ordered children of each node as seen through an
+    interface with namelist-specific instructions (omitgroupers=True, interfacetype='nml'). Nodes are
+    identified by their location, so that a single object can be shared by all stores with the same
+    schema (see NamelistStore.getNamelistRoles). Nodes are retrieved with node[...] syntax for roles,
+    and getChildren for children.
+    """
+    def __init__(self,node2nmltype,interface):
+        self.roles = {}
+        self.children = {}
+        self.layouts = {}
+        for node,tp in node2nmltype.items():
+            self.roles[node.location] = tp
+
+            # For every child, store the path of indices in the children lists from the node to the child
+            # (there may be grouper nodes in between), which allows for fast retrieval.
+            children = []
+            for child in interface.getChildren(node):
+                indices,current = [],child
+                while current is not node:
+                    indices.insert(0,current.parent.children.index(current))
+                    current = current.parent
+                children.append((tuple(indices),child.location))
+            self.children[node.location] = children
+
+    def __getitem__(self,node):
+        return self.roles[node.location]
+
+    def getNamelistLayout(self,node):
+        """Returns the text that starts the namelist represented by the node, and for each of its
+        variables the name and format strings for an assignment to the entire variable, and for an
+        assignment to a slice of the variable (see NamelistStore.writeAsNamelists).
+        """
+        layout = self.layouts.get(node.location)
+        if layout is None:
+            variables = []
+            for child in self.getChildren(node):
+                if child.hasChildren():
+                    raise Exception('Found a folder ("%s") below namelist %s, where only variables are expected.' % (child.getId(),'/'.join(node.location)))
+                varname = child.getId()
+                variables.append((varname,'   %s = %%s,\n' % varname,'   %s(%%s) = %%s,\n' % varname))
+            layout = ('&%s\n' % node.getId(),variables)
+            self.layouts[node.location] = layout
+        return layout
+
+    def getChildren(self,node):
+        result = []
+        for indices,location in self.children[node.location]:
+            child = node
+            try:
+                for index in indices: child = child.children[index]
+            except IndexError:
+                child = None
+            if child is None or child.location!=location:
+                # The store has a different structure than the one used to determine the roles
+                # (e.g., because of optional nodes). Find the child by its location instead.
+                child = node.getLocation(location[len(node.location):])
+            result.append(child)
+        return result
+
 class NamelistStore(xmlstore.xmlstore.TypedStore):
 
     def __init__(self,*args,**kwargs):
@@ -42,42 +231,69 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
         # Rank the source versions according to correspondence with target version and version number (higher is better).
         sourceids = cls.rankSources(sourceids,targetversion,requireplatform=requireplatform)
         
-        # Try the available schemas one by one, and see if they match the namelists.
-        scenario,missingcount = None,None
-        failures = ''
+        # Score the schemas by the names of namelists and variables they have in common with the
+        # namelists, which are parsed only once for this purpose. Only the best scoring schemas
+        # (more than one if scores tie) are then used to load the namelists. The others are tried
+        # only if none of these match.
         if common.verbose:
             print('Detecting suitable schema for namelists in "%s"...' % path)
-        for sourceid in sourceids:
-            if common.verbose:
-                print('Trying schema "%s"...' % sourceid,)
-            curscenario = cls.fromSchemaName(sourceid)
-            try:
-                curscenario.loadFromNamelists(path,strict=strict,prototypepath=prototypepath,root=root)
-            except namelist.NamelistParseException as e:
-                failures += 'Path "%s" does not match template "%s".\nReason: %s\n' % (path,sourceid,e)
+        fingerprint = NamelistFingerprint(path,prototypepath)
+        try:
+            scores = {}
+            for sourceid in sourceids:
+                curscenario = cls.fromSchemaName(sourceid)
+                try:
+                    scores[sourceid] = curscenario.getNamelistMatchScore(fingerprint,prototypepath is not None,root)
+                finally:
+                    curscenario.release()
+        finally:
+            fingerprint.release()
+        candidates = [sourceid for sourceid in sourceids if scores[sourceid] is not None]
+        if candidates:
+            bestscore = max([scores[sourceid] for sourceid in candidates])
+            candidates = [sourceid for sourceid in candidates if scores[sourceid]==bestscore]
+        if common.verbose:
+            print('Best matching schemas: %s.' % ', '.join(candidates))
+
+        # Try the candidate schemas one by one, and see if they match the namelists.
+        scenario,missingcount = None,None
+        failures = ''
+        def trySchemas(sourceids,scenario,missingcount,failures):
+            for sourceid in sourceids:
                 if common.verbose:
-                    print('no match, %s.' % (e,))
-                curscenario.release()
-                continue
-            curmissing = ['/'.join(n.location) for n in curscenario.root.getEmptyNodes()]
-            curmissingcount = len(curmissing)
-            
-            if common.verbose:
-                if curmissingcount>0:
-                    print('match, %i missing values:' % (curmissingcount,))
-                    for nodepath in curmissing:
-                        print('  %s' % nodepath)
-                else:
-                    print('complete match')
-                
-            if scenario is not None:
-                # A schema with higher priority matched - determine if this is a better match, based on the number of missing values.
-                if missingcount<=curmissingcount:
-                    # Earlier schema was a better match - clean up the current one and move on.
+                    print('Trying schema "%s"...' % sourceid,)
+                curscenario = cls.fromSchemaName(sourceid)
+                try:
+                    curscenario.loadFromNamelists(path,strict=strict,prototypepath=prototypepath,root=root)
+                except namelist.NamelistParseException as e:
+                    failures += 'Path "%s" does not match template "%s".\nReason: %s\n' % (path,sourceid,e)
+                    if common.verbose:
+                        print('no match, %s.' % (e,))
                     curscenario.release()
                     continue
-                scenario.release()
-            scenario,missingcount = curscenario,curmissingcount
+                curmissing = ['/'.join(n.location) for n in curscenario.root.getEmptyNodes()]
+                curmissingcount = len(curmissing)
+                
+                if common.verbose:
+                    if curmissingcount>0:
+                        print('match, %i missing values:' % (curmissingcount,))
+                        for nodepath in curmissing:
+                            print('  %s' % nodepath)
+                    else:
+                        print('complete match')
+                    
+                if scenario is not None:
+                    # A schema with higher priority matched - determine if this is a better match, based on the number of missing values.
+                    if missingcount<=curmissingcount:
+                        # Earlier schema was a better match - clean up the current one and move on.
+                        curscenario.release()
+                        continue
+                    scenario.release()
+                scenario,missingcount = curscenario,curmissingcount
+            return scenario,missingcount,failures
+        scenario,missingcount,failures = trySchemas(candidates,scenario,missingcount,failures)
+        if scenario is None:
+            scenario,missingcount,failures = trySchemas([sourceid for sourceid in sourceids if sourceid not in candidates],scenario,missingcount,failures)
                 
         # Check if we found a schema that matches the namelists.
         if scenario is None:
@@ -122,18 +338,94 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
         detectNodeRoleInNml(self.root)
         return node2nmltype
 
+    def getNamelistRoles(self):
+        """Returns a NamelistRoles object with the roles of all nodes in the namelist representation
+        (see detectNodeRolesInNamelist) and their children. These depend on the schema only, and are
+        therefore determined once per schema, and stored on the schema object. If the schema cannot
+        map to a namelist representation, NoNamelistRepresentationException is raised.
+        """
+        roles = getattr(self.schema,'namelistroles',None)
+        if roles is None:
+            interface = self.getInterface(omitgroupers=True,interfacetype='nml')
+            try:
+                roles = NamelistRoles(self.detectNodeRolesInNamelist(interface),interface)
+            except self.NoNamelistRepresentationException as e:
+                roles = e
+            finally:
+                self.disconnectInterface(interface)
+            self.schema.namelistroles = roles
+        if isinstance(roles,Exception): raise roles
+        return roles
+
+    def getNamelistMatchScore(self,fingerprint,prototype=False,root=None):
+        """Returns a score for the correspondence between the schema and the namelists described
+        by a NamelistFingerprint object (higher is better): the number of namelist variables
+        present in both, minus the number of namelists and variables that are present in only
+        one of them. Returns None if the schema has no namelist representation.
+        """
+        try:
+            roles = self.getNamelistRoles()
+        except self.NoNamelistRepresentationException:
+            return None
+        if root is None:
+            root = self.root
+        elif isinstance(root, (str, u''.__class__)):
+            root = self.root[root]
+            if root is None: return None
+
+        score = [0]
+        def processFile(node,filename):
+            namelists = fingerprint.getNamelists(filename)
+            if namelists is None:
+                # File not present - all its namelists are missing (this is fine for optional files).
+                if node.templatenode.getAttribute('optional')!='True': score[0] -= len(roles.getChildren(node))
+                return
+            namelists = list(namelists)
+            for listnode in roles.getChildren(node):
+                # Namelists must appear in the order prescribed by the schema.
+                listname = listnode.getId().lower()
+                while namelists and namelists[0][0]!=listname:
+                    score[0] -= 1
+                    namelists.pop(0)
+                if not namelists:
+                    score[0] -= 1
+                    continue
+                varnames = namelists.pop(0)[1]
+                schemavarnames = set([varnode.getId().lower() for varnode in roles.getChildren(listnode)])
+                score[0] += len(varnames & schemavarnames)-len(varnames ^ schemavarnames)
+            score[0] -= len(namelists)
+        def processDirectory(node,prefix=''):
+            for child in roles.getChildren(node):
+                childpath = prefix+child.getId()
+                if roles[child]==0:
+                    processDirectory(child,childpath+'/')
+                elif prototype:
+                    processFile(child,childpath+'.proto')
+                else:
+                    ext = self.namelistextension
+                    if child.templatenode.hasAttribute('namelistextension'):
+                        ext = child.templatenode.getAttribute('namelistextension')
+                    processFile(child,childpath+ext)
+        if roles[root]==0:
+            processDirectory(root)
+        elif roles[root]==1:
+            processFile(root,None)
+        else:
+            return None
+        return score[0]
+
     def loadFromNamelists(self, srcpath, strict=False, prototypepath=None, root=None):
 
         def processDirectory(node,prefix=''):
-            assert node2nmltype[node]==0,'processDirectory should only be called on nodes representing a directory in the namelist representation.'
-            for child in interface.getChildren(node):
+            assert roles[node]==0,'processDirectory should only be called on nodes representing a directory in the namelist representation.'
+            for child in roles.getChildren(node):
                 childpath = prefix+child.getId()
-                if node2nmltype[child]==0:
+                if roles[child]==0:
                     # Child node represents another directory.
                     processDirectory(child,childpath+'/')
                 else:
                     # Child node represents a file with namelists.
-                    cursubs = globalsubs
+                    valuesstamp = None
                     if prototypepath is None:
                         # Normal namelist file
                         ext = self.namelistextension
@@ -144,13 +436,9 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                         # Prototype namelist in which values will be substituted.
                         fullnmlfilename = childpath+'.proto'
 
-                        # Load the relevant value substitutions (if any).
-                        df = container.getItem(nmlfilename+'.values')
-                        if df is not None:
-                            df_file = df.getAsReadOnlyFile()
-                            cursubs = [namelist.NamelistSubstitutions(df_file)]
-                            df_file.close()
-                            df.release()
+                        # Identify the version of the relevant value substitutions (if any).
+                        if childpath+'.values' in valuesfilelist:
+                            valuesstamp = getNamelistFileStamp(srcpath,childpath+'.values')
 
                     # Find and parse the namelist file.
                     for fn in nmlfilelist:
@@ -172,19 +460,31 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                         else:
                             raise namelist.NamelistParseException('Namelist file "%s" is not present.' % fullnmlfilename,None,None,None)
                             
-                    # Obtain the namelist file, open it, parse it, and close it.
-                    df = nmlcontainer.getItem(fullnmlfilename)
-                    df_file = df.getAsReadOnlyFile()
-                    nmlfile = namelist.NamelistFile(df_file,cursubs)
-                    df_file.close()
-                    df.release()
+                    # Obtain the parsed namelist file. It is only opened and parsed if it is not cached yet
+                    # (or has been modified since); otherwise the cached namelists are used.
+                    def openfile():
+                        df = nmlcontainer.getItem(fullnmlfilename)
+                        return df.getAsReadOnlyFile(),df
+                    key = (getNamelistFileStamp(prototypepath or srcpath,fullnmlfilename),valuesstamp,globalsubskey)
+                    if valuesstamp is None:
+                        nmlfile = getParsedNamelistFile(key,openfile,globalsubs)
+                    else:
+                        nmlfile = namelist.cache.get(key)
+                        if nmlfile is None:
+                            # Load the relevant value substitutions.
+                            df = container.getItem(childpath+'.values')
+                            df_file = df.getAsReadOnlyFile()
+                            cursubs = [namelist.NamelistSubstitutions(df_file)]
+                            df_file.close()
+                            df.release()
+                            nmlfile = getParsedNamelistFile(key,openfile,cursubs)
             
                     # Child node represents a file containing namelists.
                     processFile(child,nmlfile,fullnmlfilename)
         
         def processFile(node,nmlfile,fullnmlfilename):
             # Loop over all nodes below the node representing the namelst file (each node represents a namelist)
-            for filechild in interface.getChildren(node):
+            for filechild in roles.getChildren(node):
                 processNamelist(filechild,nmlfile,fullnmlfilename)
         
         def processNamelist(node,nmlfile,fullnmlfilename):
@@ -192,7 +492,7 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
             listname = node.getId()
             
             # Get a list with all child nodes (i.e., namelist variables)
-            listchildren = interface.getChildren(node)
+            listchildren = roles.getChildren(node)
 
             assert not node.canHaveValue(), 'Found non-folder node with id %s below branch %s, where only folders are expected.' % (listname,nmlfilename)
 
@@ -254,17 +554,14 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
         # Start with empty scenario
         self.setStore(None)
 
-        # Retrieve an interface to the store.
-        # (by accessing it through the interface, namelist-specific instructions in the schema
-        # will be respected)
-        interface = self.getInterface(omitgroupers=True,interfacetype='nml')
-        
         # Determine for each node in the store what structure it corresponds to in the namelist representation.
         # Structures can be directories (type 0), files (type 1), namelists (type 2) and namelist variables (type 3).
         # An exception will be thrown if the schema cannot map to a valid namelist representation, i.e.,
         # when a node would contain a mixture of files, namelists and/or namelist variables.
+        # The roles and the children of nodes (as seen through an interface that respects namelist-specific
+        # instructions in the schema) are determined once per schema.
         try:
-            node2nmltype = self.detectNodeRolesInNamelist(interface)
+            roles = self.getNamelistRoles()
         except self.NoNamelistRepresentationException:
             raise namelist.NamelistParseException('This schema cannot be used for namelists.')
 
@@ -277,7 +574,7 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                 raise namelist.NamelistParseException('Specified root node "%s" does not exist in schema.' % strroot)
 
         datafilecontext = {}
-        roottype = node2nmltype[root]
+        roottype = roles[root]
         assert roottype in (0,1),'Root of data store should represent either a directory (0) or file (1) in namelists, but its type equals %i.' % roottype
         try:
             if roottype==0:
@@ -312,6 +609,11 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
 
                 # Build a list of files in the namelist directory
                 nmlfilelist = nmlcontainer.listFiles()
+                valuesfilelist = ()
+                if prototypepath is not None: valuesfilelist = set(container.listFiles())
+
+                # Substitutions from the main .values file, as part of the key for cached namelist files.
+                globalsubskey = tuple([tuple(sub.subs) for sub in globalsubs])
 
                 # Define the context for reading store values. This includes a reference to the source container,
                 # as values may be stored in separate files containing binary or textual data.
@@ -330,25 +632,28 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                 # as values may be stored in separate files containing binary or textual data.
                 datafilecontext['container'] = xmlstore.datatypes.DataContainerDirectory(os.path.split(srcpath)[0])
 
-                # Open the namelist file, parse it, and close it.
-                df_file = open(srcpath,'rU')
-                nmlfile = namelist.NamelistFile(df_file)
-                df_file.close()
+                # Obtain the parsed namelist file (from cache, if not modified since it was last parsed).
+                nmlfile = getParsedNamelistFile((getNamelistFileStamp(srcpath),None,()),lambda: (open(srcpath,'rU'),None))
 
                 # Child node represents a file containing namelists.
                 processFile(root,nmlfile,srcpath)
         finally:
-            self.disconnectInterface(interface)
             if 'linkedobjects' in datafilecontext:
                 for v in datafilecontext['linkedobjects'].values():
                     v.release()
             if 'container' in datafilecontext:
                 datafilecontext['container'].release()
 
-    def writeAsNamelists(self, targetpath, copydatafiles=True, addcomments=False, allowmissingvalues=False, callback=None, root=None):
+    def writeAsNamelists(self, targetpath, copydatafiles=True, addcomments=False, allowmissingvalues=False, callback=None, root=None, linkdatafiles=False):
+        """Writes the store as namelist files (plus data files, if copydatafiles is set) to the
+        target directory, or, if a root node that maps to a single namelist file is specified,
+        to the target file. If linkdatafiles is set, data files are linked rather than copied
+        (see LinkingDataContainer); use this only if they will not be modified afterwards.
+        """
+
 
         def processDirectory(node,prefix=''):
-            children = interface.getChildren(node)
+            children = roles.getChildren(node)
             progslicer = xmlstore.util.ProgressSlicer(callback,len(children))
             for child in children:
                 childpath = os.path.join(prefix,child.getId())
@@ -356,7 +661,7 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
 
                 if child.isHidden(): continue
 
-                if node2nmltype[child]==0:
+                if roles[child]==0:
                     # Child node maps to a directory in namelist representation.
                     if not os.path.isdir(childpath): os.mkdir(childpath)
                     processDirectory(child,childpath)
@@ -375,15 +680,18 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                         nmlfile.close()
 
         def processFile(node,nmlfile):
-            for child in interface.getChildren(node):
+            # The contents of the file are collected in a list of strings, and written at once.
+            out = []
+            for child in roles.getChildren(node):
                 listname = child.getId()
-                listchildren = interface.getChildren(child)
+                listchildren = roles.getChildren(child)
+                header,variables = roles.getNamelistLayout(child)
 
                 if addcomments:
-                    nmlfile.write('!'+(linelength-1)*'-'+'\n')
+                    out.append('!'+(linelength-1)*'-'+'\n')
                     title = child.getText(detail=2).encode('ascii','xmlstore_descrepl').decode()
-                    nmlfile.write(textwrap.fill(title,linelength-2,initial_indent='! ',subsequent_indent='! '))
-                    nmlfile.write('\n!'+(linelength-1)*'-'+'\n')
+                    out.append(textwrap.fill(title,linelength-2,initial_indent='! ',subsequent_indent='! '))
+                    out.append('\n!'+(linelength-1)*'-'+'\n')
 
                     comments = []
                     varnamelength = 0
@@ -399,18 +707,15 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                             line = line.encode('ascii','xmlstore_descrepl').decode()
                             wrappedlines += wrapper.wrap(line)
                         firstline = wrappedlines.pop(0)
-                        nmlfile.write('! %-*s %s\n' % (varnamelength,varid,firstline))
+                        out.append('! %-*s %s\n' % (varnamelength,varid,firstline))
                         for line in wrappedlines:
-                            nmlfile.write('! '+varnamelength*' '+'   '+line+'\n')
+                            out.append('! '+varnamelength*' '+'   '+line+'\n')
                     if len(comments)>0:
-                        nmlfile.write('!'+(linelength-1)*'-'+'\n')
-                    nmlfile.write('\n')
+                        out.append('!'+(linelength-1)*'-'+'\n')
+                    out.append('\n')
 
-                nmlfile.write('&'+listname+'\n')
-                for listchild in listchildren:
-                    if listchild.hasChildren():
-                        raise Exception('Found a folder ("%s") below branch %s/%s, where only variables are expected.' % (listchild.getId(),nmlfilename,listname))
-                    varname = listchild.getId()
+                out.append(header)
+                for listchild,(varname,assignment,sliceassignment) in zip(listchildren,variables):
                     varval = listchild.getValue(usedefault=True)
                     if varval is None:
                         # If the variable value is not set while its node is hidden,
@@ -420,22 +725,20 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                     varstring = varval.toNamelistString(context,listchild.templatenode)
                     if isinstance(varstring,(list,tuple)):
                         for ind,value in varstring:
-                            nmlfile.write('   %s(%s) = %s,\n' % (varname,ind,value.encode('ascii','xmlstore_descrepl').decode()))
+                            out.append(sliceassignment % (ind,toNamelistAscii(value)))
                     else:
-                        nmlfile.write('   %s = %s,\n' % (varname,varstring.encode('ascii','xmlstore_descrepl').decode()))
+                        out.append(assignment % toNamelistAscii(varstring))
                     if isinstance(varval,xmlstore.util.referencedobject): varval.release()
-                nmlfile.write('/\n\n')
+                out.append('/\n\n')
+            nmlfile.write(''.join(out))
 
-        # Retrieve an interface to the store.
-        # (by accessing it through the interface, namelist-specific instructions in the schema
-        # will be respected)
-        interface = self.getInterface(omitgroupers=True,interfacetype='nml')
-        
         # Determine for each node in the store what structure it corresponds to in the namelist representation.
         # Structures can be directories (type 0), files (type 1), namelists (type 2) and namelist variables (type 3).
         # An exception will be thrown if the schema cannot map to a valid namelist representation, i.e.,
         # when a node would contain a mixture of files, namelists and/or namelist variables.
-        node2nmltype = self.detectNodeRolesInNamelist(interface)
+        # The roles and the children of nodes (as seen through an interface that respects namelist-specific
+        # instructions in the schema) are determined once per schema.
+        roles = self.getNamelistRoles()
 
         if common.verbose:
             print('Exporting scenario to namelist files...')
@@ -446,6 +749,11 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
             linelength = 80
             wrapper = textwrap.TextWrapper(subsequent_indent='  ')
 
+        def createTargetContainer(path):
+            if not linkdatafiles: return xmlstore.datatypes.DataContainerDirectory(path)
+            from . import cache
+            return LinkingDataContainer(path,inputcache=cache.getInputCache())
+
         # Define the context used for writing data files.
         context = {}
 
@@ -455,7 +763,7 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
         elif isinstance(root, (str, u''.__class__)):
             root = self.root[root]
 
-        roottype = node2nmltype[root]
+        roottype = roles[root]
         assert roottype in (0,1),'Root of data store should represent either a directory (0) or file (1) in namelists, but its type equals %i.' % roottype
         try:
             if roottype==0:
@@ -473,7 +781,7 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                 # Set the context for writing of node values.
                 # The "targetcontainer" variable will serve as the location to write auxilliary data files to.
                 if copydatafiles:
-                    context['targetcontainer'] = xmlstore.datatypes.DataContainerDirectory(targetpath)
+                    context['targetcontainer'] = createTargetContainer(targetpath)
 
                 # Write the namelist tree, and make sure the created directory is deleted if any error occurs.
                 try:
@@ -484,7 +792,7 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
             else:
                 # Root node maps to a file in namelist representation
                 if copydatafiles:
-                    context['targetcontainer'] = xmlstore.datatypes.DataContainerDirectory(os.path.split(os.path.normpath(targetpath))[0])
+                    context['targetcontainer'] = createTargetContainer(os.path.split(os.path.normpath(targetpath))[0])
 
                 # Open the target namelist file
                 nmlfile = open(targetpath,'w')
@@ -493,7 +801,6 @@ class NamelistStore(xmlstore.xmlstore.TypedStore):
                 finally:
                     nmlfile.close()
         finally:
-            self.disconnectInterface(interface)
             if 'targetcontainer' in context: context['targetcontainer'].release()
 
     @staticmethod
@@ -616,3 +923,150 @@ class Scenario(NamelistStore):
         kwargs['fillmissing'] = True
 
         super(Scenario,self).saveAll(path,targetversion=targetversion,*args,**kwargs)
+
+def parseOverride(node,value):
+    """Returns the value to set in the node; strings are parsed as in the XML scenario file,
+    unless the node itself takes a string.
+    """
+    if isinstance(value,(str,u''.__class__)):
+        valuetype = node.getValueType(returnclass=True)
+        if not issubclass(valuetype,(str,u''.__class__)):
+            value = valuetype.fromXmlString(value,{},node.templatenode)
+    return value
+
+def applyOverrides(store,overrides):
+    """Sets the values in the overrides dictionary (node path to value) in the store, and returns a
+    dictionary with the original values, which must be passed to restoreOverrides to undo the
+    changes. Values may also be given as strings, which are then parsed as in the XML scenario file.
+    """
+    oldvalues = {}
+    for path,value in overrides.items():
+        node = store[path]
+        if node is None:
+            raise Exception('Node "%s" does not exist in the scenario.' % path)
+        oldvalues[path] = node.getValue()
+        node.setValue(parseOverride(node,value))
+    return oldvalues
+
+def restoreOverrides(store,oldvalues):
+    """Restores the original values returned by applyOverrides. These values, and the overriding
+    values they displace, are released.
+    """
+    for path,value in oldvalues.items():
+        node = store[path]
+        displaced = node.getValue()
+        node.setValue(value)
+        for v in (value,displaced):
+            if isinstance(v,xmlstore.util.referencedobject): v.release()
+
+class ScenarioOverlayNode(object):
+    """Node of a ScenarioOverlay, as returned by ScenarioOverlay.__getitem__. Only its value
+    can be obtained and set; values that are set are recorded in the overlay.
+    """
+    def __init__(self,overlay,path,node):
+        self.overlay = overlay
+        self.path = path
+        self.node = node
+
+    def getValue(self,usedefault=False):
+        if self.path in self.overlay.changes:
+            value = self.overlay.changes[self.path]
+            if isinstance(value,xmlstore.util.referencedobject): value.addref()
+            return value
+        return self.node.getValue(usedefault=usedefault)
+
+    def getValueAsString(self,*args,**kwargs):
+        with self.overlay.applied():
+            return self.node.getValueAsString(*args,**kwargs)
+
+    def setValue(self,value):
+        self.overlay.setValue(self.path,value)
+
+class ScenarioOverlay(xmlstore.util.referencedobject):
+    """Variant of a base scenario (or any other NamelistStore) that records only the values that
+    differ from it, as a dictionary that maps node paths to values. Any number of overlays can share
+    a single base scenario, so that a large ensemble or sweep does not need a complete scenario per
+    member. Operations that need the full scenario (conversion, writing namelists, saving) apply
+    the changes to the base temporarily, and undo them afterwards. Therefore the base must not be
+    used otherwise (e.g., by another thread) while an overlay is in use.
+    """
+    path = None
+
+    def __init__(self,base,changes=None):
+        xmlstore.util.referencedobject.__init__(self)
+        self.base = base.addref()
+        self.changes = {}
+        if changes:
+            for path,value in changes.items(): self.setValue(path,value)
+
+    def unlink(self):
+        for value in self.changes.values():
+            if isinstance(value,xmlstore.util.referencedobject): value.release()
+        self.changes = {}
+        self.base.release()
+        self.base = None
+
+    @property
+    def version(self):
+        return self.base.version
+
+    def __getitem__(self,path):
+        node = self.base[path]
+        if node is None: return None
+        return ScenarioOverlayNode(self,path,node)
+
+    def setValue(self,path,value):
+        node = self.base[path]
+        if node is None:
+            raise Exception('Node "%s" does not exist in the scenario.' % path)
+        newvalue = parseOverride(node,value)
+        if newvalue is value and isinstance(value,xmlstore.util.referencedobject): value.addref()
+        oldvalue = self.changes.get(path)
+        if isinstance(oldvalue,xmlstore.util.referencedobject): oldvalue.release()
+        self.changes[path] = newvalue
+
+    @contextlib.contextmanager
+    def applied(self):
+        """Context manager that applies the changes to the base scenario, and yields the latter.
+        """
+        oldvalues = applyOverrides(self.base,self.changes)
+        try:
+            yield self.base
+        finally:
+            restoreOverrides(self.base,oldvalues)
+
+    def convert(self,target,callback=None):
+        """Returns the overlay itself if the target version equals that of the base scenario.
+        Otherwise, a new, complete scenario with the target version is returned.
+        """
+        if isinstance(target,(str,u''.__class__)) and target==self.version: return self.addref()
+        with self.applied() as base:
+            return base.convert(target,callback=callback)
+
+    def materialize(self):
+        """Returns a new, complete scenario with the values of the overlay.
+        """
+        store = self.base.fromSchemaName(self.version)
+        with self.applied() as base:
+            store.root.copyFrom(base.root)
+        return store
+
+    def writeAsNamelists(self,*args,**kwargs):
+        with self.applied() as base:
+            base.writeAsNamelists(*args,**kwargs)
+
+    def saveAll(self,*args,**kwargs):
+        with self.applied() as base:
+            base.saveAll(*args,**kwargs)
+
+@contextlib.contextmanager
+def appliedScenario(scen):
+    """Context manager that yields the scenario itself, or, for a ScenarioOverlay, its base
+    scenario with the changes of the overlay applied. Use this where the complete scenario
+    is needed (e.g., to walk its nodes).
+    """
+    if isinstance(scen,ScenarioOverlay):
+        with scen.applied() as base:
+            yield base
+    else:
+        yield scen
@@ -0,0 +1,70 @@
+from __future__ import print_function
+
+# Schedulers determine how many GOTM time steps core.simulator.Simulator.run simulates per slab.
+# Between slabs, the simulator reports progress, checks for cancellation and saves checkpoints.
+# Short slabs make the GUI responsive, but each slab adds overhead. A scheduler provides
+# getSlabSize, which is called before every slab, and update, which is called after every
+# slab with the number of time steps simulated and the time this took.
+
+class Scheduler(object):
+    def getSlabSize(self,remaining):
+        """Returns the number of time steps in the next slab, given the number of time steps
+        that remain to be simulated.
+        """
+        return remaining
+
+    def update(self,stepcount,elapsed):
+        pass
+
+class WholeRunScheduler(Scheduler):
+    """Simulates all remaining time steps in a single slab. This has no overhead, and is used
+    when progress notifications, cancellation and checkpoints are not needed (e.g., headless runs).
+    """
+    pass
+
+class FixedScheduler(Scheduler):
+    """Uses slabs with a fixed number of time steps.
+    """
+    def __init__(self,slabsize):
+        assert slabsize>0, 'Slab size must be positive, but is %i.' % slabsize
+        self.slabsize = slabsize
+
+    def getSlabSize(self,remaining):
+        return min(self.slabsize,remaining)
+
+class AdaptiveScheduler(Scheduler):
+    """Chooses slab sizes so that each slab takes approximately the target latency (in seconds).
+    The cost per time step is estimated from an exponentially weighted moving average over the
+    previous slabs, which prevents the slab size from oscillating when the cost per time step
+    varies. The slab size is limited to the range [minslabsize, maxfraction * total number of
+    time steps].
+    """
+    def __init__(self,targetlatency=0.4,initialslabsize=100,minslabsize=2,maxfraction=0.05,smoothing=0.3):
+        self.targetlatency = targetlatency
+        self.initialslabsize = initialslabsize
+        self.minslabsize = minslabsize
+        self.maxfraction = maxfraction
+        self.smoothing = smoothing
+        self.maxslabsize = None
+        self.stepcost = None
+
+    def getSlabSize(self,remaining):
+        if self.maxslabsize is None:
+            # First slab: the total number of remaining time steps determines the maximum slab size.
+            self.maxslabsize = max(self.minslabsize,int(round(remaining*self.maxfraction)))
+        if self.stepcost is None:
+            slabsize = self.initialslabsize
+        elif self.stepcost==0:
+            slabsize = self.maxslabsize
+        else:
+            slabsize = int(round(self.targetlatency/self.stepcost))
+        slabsize = max(self.minslabsize,min(self.maxslabsize,slabsize))
+        return min(slabsize,remaining)
+
+    def update(self,stepcount,elapsed):
+        if stepcount<=0: return
+        stepcost = elapsed/stepcount
+        if self.stepcost is None:
+            self.stepcost = stepcost
+        else:
+            self.stepcost += self.smoothing*(stepcost-self.stepcost)
@@ -1,6 +1,8 @@
-import tempfile,os,time
+import tempfile,os,time,shutil,math
 
-from . import common, result
+from . import common, result, cache, capture, checkpoint
+from . import scheduler as core_scheduler
+from . import scenario as core_scenario
 import pygotm
 
 gotmversion = pygotm.get_version()
@@ -16,10 +18,42 @@ clock = getattr(time, 'perf_counter', None)
 if clock is None:
     clock = time.clock
 
+def configureOutput(namelistscenario):
+    """Configures the output settings of a scenario in GOTM namelist version, so that GOTM
+    writes its results to "result.nc" in the simulation directory.
+    """
+    namelistscenario['gotmrun/output/out_fmt'].setValue(2)
+    namelistscenario['gotmrun/output/out_dir'].setValue('.')
+    namelistscenario['gotmrun/output/out_fn' ].setValue('result')
+
 class Simulator(object):
-    def __init__(self,scenario,redirect=True):
+    def __init__(self,scenario,redirect=True,simulationdir=None,cache=None,inmemory=False,live=False,profile=False):
+        # If a simulation directory is provided, it must have been registered with
+        # common.TempDirManager, and must already contain namelists (configured with
+        # configureOutput) and data files. The directory will be owned by the result.
+        # Otherwise, the scenario is converted to namelists, unless an identical scenario
+        # is present in the optional cache (a core.cache.ScenarioCache object). The simulation
+        # directory is then created in the staging directory, if one is configured (e.g., on a
+        # memory-backed file system, see common.getStagingDir).
+        # If inmemory is set, GOTM does not write NetCDF output; profiles are copied from
+        # the GOTM library at every output time instead, and kept in memory.
+        # If live is set, profiles are also copied in memory while GOTM writes NetCDF output
+        # as usual, so the partial result can be inspected while the simulation runs
+        # (see simulate, argument livecallback).
+        # The scenario may also be a core.scenario.ScenarioOverlay, e.g., an ensemble member
+        # that only records its differences from a shared base scenario.
+        # If profile is set, the wall time spent in the different phases of the simulation
+        # is recorded in the timing table of the result (see core.result.Result.timings).
         self.scenario = scenario
         self.redirect = redirect
+        self.simulationdir = simulationdir
+        self.cache = cache
+        self.inmemory = inmemory
+        self.live = live
+        self.profile = profile
+        self.capture = None
+        self.previousresultpath = None
+        self.scenariohash = None
         self.outfile = None
         self.errfile = None
         self.olddir = None
@@ -36,20 +70,58 @@ class Simulator(object):
             self.result.errormessage = str(e)
             self.result.returncode = 1
     
+    def addTiming(self,phase,time_start):
+        # Records the time elapsed since time_start for the specified phase, if profiling.
+        if self.profile: self.result.timings.append((phase,clock()-time_start))
+
     def initialize(self):
         if verbose:
             print('initializing simulation')
         
-        namelistscenario = self.scenario.convert(gotmscenarioversion)
-        if verbose:
-            print('scenario converted')
-        self.simulationdir = common.TempDirManager.create('gotm-')
-        namelistscenario['gotmrun/output/out_fmt'].setValue(2)
-        namelistscenario['gotmrun/output/out_dir'].setValue('.')
-        namelistscenario['gotmrun/output/out_fn' ].setValue('result')
-        namelistscenario.writeAsNamelists(self.simulationdir)
-        namelistscenario.release()
-                    
+        if self.simulationdir is None:
+            self.simulationdir = common.TempDirManager.create('gotm-',staging=True)
+
+            cachedpath = None
+            if self.cache is not None:
+                with core_scenario.appliedScenario(self.scenario) as scen:
+                    cachekey = self.cache.getKey(scen,gotmscenarioversion)
+                cachedpath = self.cache.getPath(cachekey)
+
+            if cachedpath is not None:
+                # Use namelists and data files from the cache.
+                if verbose:
+                    print('using converted scenario from cache')
+                time_start = clock()
+                self.cache.linkEntry(cachedpath,self.simulationdir)
+                self.addTiming('linking cached namelists',time_start)
+            else:
+                time_start = clock()
+                namelistscenario = self.scenario.convert(gotmscenarioversion)
+                if verbose:
+                    print('scenario converted')
+                configureOutput(namelistscenario)
+                self.addTiming('scenario conversion',time_start)
+                time_start = clock()
+                namelistscenario.writeAsNamelists(self.simulationdir,linkdatafiles=True)
+                namelistscenario.release()
+                self.addTiming('namelist writing',time_start)
+                if self.cache is not None:
+                    time_start = clock()
+                    self.cache.add(cachekey,self.simulationdir)
+                    self.addTiming('adding namelists to cache',time_start)
+
+        runsettings = None
+        if self.inmemory:
+            runsettings = capture.readRunSettings(self.simulationdir)
+        elif self.live:
+            # The live preview is best effort: if it cannot be set up, the simulation runs without it.
+            try:
+                runsettings = capture.readRunSettings(self.simulationdir)
+            except Exception as e:
+                self.disableLive(e)
+        if self.inmemory:
+            capture.disableNetCDFOutput(self.simulationdir)
+
         # Save old working directory
         self.olddir = getattr(os, 'getcwdu', os.getcwd)()
 
@@ -66,9 +138,9 @@ class Simulator(object):
 
         # Redirect FORTRAN output to (temporary) files.
         if self.redirect:
-            (h,self.outfile) = tempfile.mkstemp('.txt','gotm')
+            (h,self.outfile) = tempfile.mkstemp('.txt','gotm',common.getStagingDir())
             os.close(h)
-            (h,self.errfile) = tempfile.mkstemp('.txt','gotm')
+            (h,self.errfile) = tempfile.mkstemp('.txt','gotm',common.getStagingDir())
             os.close(h)
             pygotm.redirect_output(self.outfile,self.errfile)
 
@@ -76,11 +148,13 @@ class Simulator(object):
             print('initializing gotm module')
 
         # Initialize GOTM
+        time_start = clock()
         try:
             pygotm.initialize()
         except Exception as e:
             os.chdir(self.olddir)
             raise Exception('Exception thrown while initializing GOTM: %s' % str(e))
+        self.addTiming('GOTM initialization',time_start)
 
         # Get # of first step, last step, number of steps for whole GOTM run.
         self.start,self.stop = pygotm.get_time_bounds()
@@ -88,13 +162,36 @@ class Simulator(object):
         
         self.currentpos = self.start
 
+        if self.inmemory:
+            try:
+                self.capture = capture.ProfileCapture(pygotm,runsettings,self.start,self.stop)
+            except Exception as e:
+                os.chdir(self.olddir)
+                raise Exception('Unable to keep GOTM results in memory: %s' % str(e))
+        elif self.live:
+            try:
+                self.capture = capture.ProfileCapture(pygotm,runsettings,self.start,self.stop)
+            except Exception as e:
+                self.disableLive(e)
+
+    def disableLive(self,error):
+        # Continues without live preview after it failed to set up (see initialize).
+        print('Unable to show a live preview of the simulation; continuing without it. %s' % error)
+        self.live = False
+        self.capture = None
+
     def finalize(self):
+        if self.profile and self.result.slabtimings:
+            self.result.timings.append(('time stepping (%i slabs)' % len(self.result.slabtimings),sum([elapsed for firststep,stepcount,elapsed in self.result.slabtimings])))
+
         # GOTM clean-up
+        time_start = clock()
         try:
             pygotm.finalize()
         except Exception as e:
             self.result.errormessage = 'Error during GOTM clean-up: %s' % e
             if self.result.returncode==0: self.result.returncode = 1
+        self.addTiming('GOTM finalization',time_start)
             
         if self.redirect:
             # Reset FORTRAN output
@@ -108,18 +205,35 @@ class Simulator(object):
                 return data
                 
             # Read GOTM output from temporary files, then delete these files.
+            time_start = clock()
             if self.errfile is not None: self.result.stderr = readoutput(self.errfile)
             if self.outfile is not None: self.result.stdout = readoutput(self.outfile)
+            self.addTiming('reading GOTM output',time_start)
 
         # Return to previous working directory.
         if self.olddir is not None: os.chdir(self.olddir)
 
+        if self.result.returncode==0 and self.previousresultpath is not None and not self.inmemory:
+            # Resumed from a checkpoint: add the output from before the checkpoint.
+            time_start = clock()
+            try:
+                checkpoint.mergeResults(self.previousresultpath,os.path.join(self.simulationdir,'result.nc'))
+            except Exception as e:
+                self.result.errormessage = 'Unable to merge output from before the checkpoint: %s' % e
+                self.result.returncode = 1
+            self.addTiming('merging output from checkpoint',time_start)
+
         if self.result.returncode==0:    
             # Succeeded: get the result. Note: the result "inherits" the temporary directory,
             # so we do not have to delete it here.
-            respath = os.path.join(self.simulationdir,'result.nc')
             self.result.tempdir = self.simulationdir
-            self.result.attach(respath,self.scenario,copy=False)
+            time_start = clock()
+            if self.inmemory:
+                self.result.attachMemory(capture.MemoryStore(self.capture),self.scenario)
+            else:
+                respath = os.path.join(self.simulationdir,'result.nc')
+                self.result.attach(respath,self.scenario,copy=False)
+            self.addTiming('attaching result',time_start)
             self.result.changed = True
         else:
             # Failed: delete temporary simulation directory
@@ -130,54 +244,118 @@ class Simulator(object):
                 
         return self.result
     
-    def run(self,progresscallback=None,continuecallback=None):
+    def getScenarioHash(self):
+        # Returns the hash of the simulated scenario, with the changes of an overlay applied
+        # (see core.cache.getScenarioHash), or None if the simulator has no scenario.
+        if self.scenario is None: return None
+        if self.scenariohash is None:
+            with core_scenario.appliedScenario(self.scenario) as scen:
+                self.scenariohash = cache.getScenarioHash(scen)
+        return self.scenariohash
+
+    def saveCheckpoint(self,path):
+        # Saves the state of GOTM at the current position, which must be a slab boundary,
+        # together with the output written so far.
+        resultpath = None
+        if not self.inmemory: resultpath = os.path.join(self.simulationdir,'result.nc')
+        capturestate = None
+        if self.capture is not None: capturestate = self.capture.getState()
+        cp = checkpoint.Checkpoint(pygotm.get_version(),self.start,self.stop,self.currentpos,checkpoint.getState(pygotm),capturestate,self.getScenarioHash())
+        cp.save(path,resultpath,self.previousresultpath)
+        if verbose:
+            print('checkpoint saved at time step %i' % self.currentpos)
+
+    def resume(self,cp,branch=False):
+        # Continues the simulation from a checkpoint (a core.checkpoint.Checkpoint object),
+        # instead of from the start. Must be called after initialization, before run.
+        # If branch is set, the checkpoint may come from a simulation of a scenario with
+        # different parameters (e.g., a shared spin-up); only profiles are then restored, so
+        # that scalar parameters of the current scenario remain in effect.
         assert self.result.returncode==0, 'Run did not initialize successfully. %s' % self.result.errormessage
-        
-        # Calculate the size of time batches (small enough to respond rapidly to requests
-        # for cancellation, and to show sufficiently detailed progress - e.g. in % -
-        # but not so small that GUI slows down due to the avalanche of progress notifications)
-        visualres = 0.01
-
-        minslicesize = 2
-        maxslicesize = int(round(self.stepcount/20.))    # Maximum slice: 5 % of complete simulation
-        if maxslicesize<minslicesize: maxslicesize = minslicesize
-        
-        # if no progress notifications are desired and the simulation cannot be cancelled,
-        # simply run the complete simulation at once (slice size = entire simulation)
-        islicesize = 100
-        if progresscallback is None and continuecallback is None: islicesize = self.stepcount
+        assert self.currentpos==self.start, 'Simulation has already started'
+        if cp.gotmversion!=pygotm.get_version():
+            raise Exception('Checkpoint was created with GOTM %s, but the current GOTM library is version %s.' % (cp.gotmversion,pygotm.get_version()))
+        if (cp.start,cp.stop)!=(self.start,self.stop):
+            raise Exception('Checkpoint covers time steps %i-%i, but the scenario covers time steps %i-%i.' % (cp.start,cp.stop,self.start,self.stop))
+        if not branch:
+            scenariohash = self.getScenarioHash()
+            if cp.scenariohash is not None and scenariohash is not None and cp.scenariohash!=scenariohash:
+                raise Exception('Checkpoint was created for a different scenario.')
+        checkpoint.setState(pygotm,cp.state,profilesonly=branch)
+        if self.capture is not None and cp.capturestate is not None:
+            self.capture.setState(cp.capturestate)
+        if cp.resultpath is not None and not self.inmemory:
+            # Keep a private copy of the output from before the checkpoint, because the
+            # checkpoint itself may be replaced by a new one during this run.
+            self.previousresultpath = os.path.join(self.simulationdir,'checkpoint.nc')
+            shutil.copyfile(cp.resultpath,self.previousresultpath)
+        self.currentpos = cp.currentpos
 
-        hasmore = True
+    def run(self,progresscallback=None,continuecallback=None,checkpointpath=None,checkpointinterval=600.,scheduler=None):
+        # If a checkpoint path is provided, the state of the simulation is saved there (see
+        # saveCheckpoint) every checkpointinterval seconds, and when the run is cancelled.
+        # The scheduler (see core.scheduler) determines the size of time batches ("slabs").
+        # By default, they are small enough to respond rapidly to requests for cancellation,
+        # and to show sufficiently detailed progress - e.g. in % - but not so small that
+        # the GUI slows down due to the avalanche of progress notifications. If no progress
+        # notifications are desired, the simulation cannot be cancelled, and no checkpoints
+        # are needed, the complete simulation is run at once.
+        assert self.result.returncode==0, 'Run did not initialize successfully. %s' % self.result.errormessage
+
+        if scheduler is None:
+            if progresscallback is None and continuecallback is None and checkpointpath is None:
+                scheduler = core_scheduler.WholeRunScheduler()
+            else:
+                scheduler = core_scheduler.AdaptiveScheduler()
+
+        hasmore = self.currentpos<=self.stop
         
         time_runstart = clock()
+        time_checkpoint = time_runstart
+        pos_runstart = self.currentpos
         while hasmore:
-            time_slicestart = clock()
-            
             # Check if we have to cancel
             if continuecallback is not None and not continuecallback():
                 print('GOTM run was cancelled; stopping simulation.')
+                if checkpointpath is not None: self.saveCheckpoint(checkpointpath)
                 self.result.returncode = 2
                 break
 
-            hasmore = self.runSlab(slicesize=islicesize)
+            hasmore = self.runSlab(slicesize=scheduler.getSlabSize(self.stop-self.currentpos+1))
+            if self.result.returncode!=0: break
+
+            # Inform the scheduler of the cost of the slab.
+            firststep,stepcount,elapsed = self.result.slabtimings[-1]
+            scheduler.update(stepcount,elapsed)
 
             time_slicestop = clock()
 
+            if hasmore and checkpointpath is not None and time_slicestop-time_checkpoint>=checkpointinterval:
+                self.saveCheckpoint(checkpointpath)
+                time_checkpoint = clock()
+
             if progresscallback is not None:
-                # Send 'progress' event
+                # Send 'progress' event (remaining time is based on the steps simulated in this run)
                 prog = self.getProgress()
-                remaining = (1-prog)*(time_slicestop-time_runstart)/prog
+                runprog = (self.currentpos-pos_runstart)/float(self.stop-pos_runstart+1)
+                remaining = 0.
+                if runprog>0: remaining = (1-runprog)*(time_slicestop-time_runstart)/runprog
                 progresscallback(prog,remaining)
 
-            # Adjust slice size, aiming for slices that take 0.4 seconds to simulate.
-            elapsed = time_slicestop-time_slicestart
-            if elapsed==0:
-                islicesize = maxslicesize
-            else:
-                islicesize = int(round(islicesize * 0.4/elapsed))
-                if islicesize<minslicesize: islicesize = minslicesize
-                if islicesize>maxslicesize: islicesize = maxslicesize
-          
+    def runUntil(self,pos):
+        # Simulates up to (but not including) the specified time step, e.g., to save a
+        # checkpoint there.
+        assert pos<=self.stop+1, 'Time step %i lies beyond the end of the simulation (%i).' % (pos,self.stop)
+        while self.currentpos<pos and self.result.returncode==0:
+            self.runSlab(slicesize=pos-self.currentpos)
+
+    def getStep(self,time):
+        # Returns the number of the first time step that starts at or after the specified time (datetime).
+        settings = capture.readRunSettings(self.simulationdir)
+        delta = time-settings['start']
+        seconds = delta.days*86400+delta.seconds+delta.microseconds/1e6
+        return self.start+int(math.ceil(seconds/settings['dt']-1e-6))
+
     def getProgress(self):
         return (self.currentpos-self.start+1)/float(self.stepcount)
 
@@ -188,16 +366,29 @@ class Simulator(object):
         # Configure GOTM for new slice.
         islicestop = self.currentpos + slicesize - 1
         if islicestop>self.stop: islicestop = self.stop
-        pygotm.set_time_bounds(self.currentpos,islicestop)
         
         # Process time batch
+        time_slabstart = clock()
         try:
-            pygotm.run()
+            if self.capture is None:
+                pygotm.set_time_bounds(self.currentpos,islicestop)
+                pygotm.run()
+            else:
+                # Run up to every output time within the slice, and copy the profiles there.
+                pos = self.currentpos
+                while pos<=islicestop:
+                    outputstep = self.capture.getNextOutputStep(pos)
+                    substop = min(outputstep,islicestop)
+                    pygotm.set_time_bounds(pos,substop)
+                    pygotm.run()
+                    if substop==outputstep: self.capture.sample(substop)
+                    pos = substop+1
         except Exception as e:
             self.result.errormessage = 'Exception thrown in GOTM time loop: %s' % e
             self.result.returncode = 1
             return
 
+        self.result.slabtimings.append((self.currentpos,islicestop-self.currentpos+1,clock()-time_slabstart))
         self.currentpos = islicestop + 1
 
         return self.currentpos<=self.stop
@@ -229,10 +420,39 @@ class Simulator(object):
         relchange.shape = -1,1
         gotm.bio_var.cc *= relchange
 
-def simulate(scenario,progresscallback=None,continuecallback=None,redirect=True):
-    simulator = Simulator(scenario,redirect=redirect)
+def simulate(scenario,progresscallback=None,continuecallback=None,redirect=True,simulationdir=None,cache=None,resultcache=None,inmemory=False,livecallback=None,checkpointpath=None,checkpointinterval=600.,resumefrom=None,scheduler=None,profile=False):
+    # If profile is set, the result contains a timing table (see Simulator).
+    # The optional scheduler (see core.scheduler) determines the size of slabs (see Simulator.run).
+    # If a checkpoint path is provided, checkpoints are saved there during the run (see Simulator.run).
+    # If resumefrom is the path of a checkpoint, the simulation continues from there.
+    # If a livecallback is provided, it is called with the core.capture.ProfileCapture object
+    # that receives the profiles while the simulation runs (see Simulator, argument live).
+    # It is not called if the result is taken from the result cache.
+    # If a previous simulation of an identical scenario with the same GOTM library is present
+    # in the optional result cache (a core.cache.ResultCache object), return its result instead.
+    if resultcache is not None:
+        with core_scenario.appliedScenario(scenario) as scen:
+            resultkey = resultcache.getKey(scen,pygotm.get_version())
+        result = resultcache.getResult(resultkey,scenario)
+        if result is not None:
+            if verbose:
+                print('using result from cache')
+            if progresscallback is not None: progresscallback(1.,0.)
+            return result
+
+    simulator = Simulator(scenario,redirect=redirect,simulationdir=simulationdir,cache=cache,inmemory=inmemory,live=livecallback is not None,profile=profile)
     result = simulator.result
     if result.returncode==0:
-        simulator.run(progresscallback=progresscallback,continuecallback=continuecallback)
+        if livecallback is not None: livecallback(simulator.capture)
+        if resumefrom is not None:
+            try:
+                simulator.resume(checkpoint.Checkpoint.load(resumefrom))
+            except Exception as e:
+                result.errormessage = 'Unable to resume from checkpoint: %s' % e
+                result.returncode = 1
+    if result.returncode==0:
+        simulator.run(progresscallback=progresscallback,continuecallback=continuecallback,checkpointpath=checkpointpath,checkpointinterval=checkpointinterval,scheduler=scheduler)
     simulator.finalize()
+    if resultcache is not None and result.returncode==0 and not result.isInMemory():
+        resultcache.addResult(resultkey,result)
     return result
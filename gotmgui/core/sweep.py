@@ -0,0 +1,145 @@
+from __future__ import print_function
+
+# Import modules from standard Python library
+import os
+
+# Import own custom modules
+import xmlstore.util
+
+from . import common, ensemble, scenario
+
+class Sweep(xmlstore.util.referencedobject):
+    """Parameter sweep over a base scenario. The members of the sweep are dictionaries
+    that map node paths in the GOTM namelist version of the scenario (e.g.,
+    "gotmturb/turbulence/turb_method" or "gotmmean/meanflow/h0b") to values.
+
+    The base scenario is converted to the namelist version and written to namelist files
+    only once. The run directory of a member then receives freshly written copies of only
+    those namelist files that are affected by its overrides; all other files are linked
+    to the base namelists. Members are never stored as separate scenarios, but as overlays
+    of the single converted base scenario (see getMember), whose overrides are applied to
+    the base temporarily.
+    """
+
+    def __init__(self,scen,members,version=None):
+        xmlstore.util.referencedobject.__init__(self)
+
+        from . import simulator
+        if version is None: version = simulator.gotmscenarioversion
+
+        self.members = members
+        self.namelistscenario = scen.convert(version)
+        simulator.configureOutput(self.namelistscenario)
+        self.basedir = None
+        self.basefiles = None
+
+        # Determine for each node in the store what structure it corresponds to in the namelist
+        # representation, then find the namelist file affected by each overridden node.
+        # The roles are cached per schema (see core.scenario.NamelistStore.getNamelistRoles).
+        self.roles = self.namelistscenario.getNamelistRoles()
+        self.containernodes = [self.namelistscenario.root.getLocation(location) for location,nmltype in self.roles.roles.items() if nmltype<=1]
+        self.path2file = {}
+        self.filenodes = {}
+        for member in self.members:
+            for path in member:
+                if path not in self.path2file: self.path2file[path] = self.locateFile(path)
+
+    @staticmethod
+    def grid(axes):
+        """Returns the members that span the grid defined by the supplied axes, which must be
+        a list of (node path, list of values) tuples.
+        """
+        return ensemble.gridOverrides(axes)
+
+    def __len__(self):
+        return len(self.members)
+
+    def unlink(self):
+        self.namelistscenario.release()
+        self.namelistscenario = None
+        if self.basedir is not None:
+            common.TempDirManager.delete(self.basedir)
+            self.basedir = None
+
+    def locateFile(self,path):
+        """Returns the path (relative to the run directory) of the namelist file that contains
+        the specified node, or None if the node does not map to a namelist variable that can be
+        rewritten in isolation (data files).
+        """
+        node = self.namelistscenario[path]
+        if node is None:
+            raise Exception('Node "%s" does not exist in the %s scenario.' % (path,self.namelistscenario.version))
+        if node.getValueType()=='gotmdatafile': return None
+
+        # Move up to the node that represents the namelist file.
+        while node is not None and self.roles.roles.get(node.location)!=1: node = node.parent
+        assert node is not None, 'Node "%s" is not located within a namelist file.' % path
+        filenode = node
+
+        # Build the relative path from the ids of the parent directories.
+        ext = self.namelistscenario.namelistextension
+        if filenode.templatenode.hasAttribute('namelistextension'):
+            ext = filenode.templatenode.getAttribute('namelistextension')
+        components = [filenode.getId()+ext]
+        node = filenode.parent
+        while node is not None and node is not self.namelistscenario.root:
+            if self.roles.roles.get(node.location)==0: components.insert(0,node.getId())
+            node = node.parent
+        relpath = os.path.join(*components)
+        self.filenodes[relpath] = filenode
+        return relpath
+
+    def getMember(self,index):
+        """Returns the specified member as overlay of the converted base scenario
+        (core.scenario.ScenarioOverlay), which records only the overrides of the member.
+        """
+        return scenario.ScenarioOverlay(self.namelistscenario,self.members[index])
+
+    def getHiddenFiles(self):
+        return frozenset([node for node in self.containernodes if node is not None and node.isHidden()])
+
+    def writeBase(self):
+        """Writes the namelist files and data files of the base scenario, which are shared
+        by all members.
+        """
+        # Staged like the member directories, so that files can be linked rather than copied.
+        self.basedir = common.TempDirManager.create('gotm-sweep-',staging=True)
+        self.namelistscenario.writeAsNamelists(self.basedir,linkdatafiles=True)
+        self.basefiles = []
+        for dirpath,dirnames,filenames in os.walk(self.basedir):
+            for filename in filenames:
+                self.basefiles.append(os.path.relpath(os.path.join(dirpath,filename),self.basedir))
+
+    def materialize(self,index,targetdir):
+        """Fills the (existing, empty) target directory with the namelist and data files
+        for the specified member.
+        """
+        if self.basedir is None: self.writeBase()
+
+        overlay = self.getMember(index)
+        hidden = self.getHiddenFiles()
+        try:
+            with overlay.applied() as namelistscenario:
+                changedfiles = set([self.path2file[path] for path in overlay.changes])
+                if None in changedfiles or self.getHiddenFiles()!=hidden:
+                    # The member changes data files, or changes which namelist files are used.
+                    # Write the complete set of namelists.
+                    namelistscenario.writeAsNamelists(targetdir,linkdatafiles=True)
+                    return
+
+                # Write the namelist files that are affected by the overrides.
+                # This must happen before linking base files, because data files referenced from
+                # these namelists will be written as well, and linked files must not be overwritten.
+                for relpath in changedfiles:
+                    nmlpath = os.path.join(targetdir,relpath)
+                    if not os.path.isdir(os.path.dirname(nmlpath)): os.makedirs(os.path.dirname(nmlpath))
+                    namelistscenario.writeAsNamelists(nmlpath,root=self.filenodes[relpath],linkdatafiles=True)
+        finally:
+            overlay.release()
+
+        # Link all remaining files to those of the base scenario.
+        for relpath in self.basefiles:
+            target = os.path.join(targetdir,relpath)
+            if os.path.exists(target): continue
+            if not os.path.isdir(os.path.dirname(target)): os.makedirs(os.path.dirname(target))
+            common.linkFile(os.path.join(self.basedir,relpath),target)
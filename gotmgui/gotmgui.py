@@ -16,10 +16,10 @@ if not hasattr(sys,'frozen'):
 # Import Qt Modules
 from xmlstore.qt_compat import QtGui, QtCore, QtWidgets, qt4_backend, qt4_backend_version, mpl_qt4_backend
 
-# Configure matplotlib
-import matplotlib
+# Configure matplotlib. It is imported only once a figure is needed (importing it is slow),
+# so its backend is selected through the environment.
 #matplotlib.rcParams['backend.qt4'] = mpl_qt4_backend
-matplotlib.use('agg')
+os.environ['MPLBACKEND'] = 'agg'
 
 # In order to find our custom data files, make sure that we are in the directory
 # containing the executable.
@@ -30,7 +30,6 @@ matplotlib.use('agg')
 import xmlstore.util, xmlstore.gui_qt4
 from .core import common
 from . import commonqt
-import xmlplot.errortrap
 
 def getVersions():
     yield ('Python','%i.%i.%i %s %i' % tuple(sys.version_info))
@@ -511,7 +510,7 @@ def start(options,args):
     scen = None
     res = None
     if len(args) > 0:
-        from .core import scenario, result
+        from .core import scenario
     
         openpath = os.path.normpath(os.path.join(oldworkingdir, args[0]))
         del args[0]
@@ -532,7 +531,8 @@ def start(options,args):
             except Exception as e:
                 QtWidgets.QMessageBox.critical(wiz, 'Unable to load scenario', repr(e), QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.NoButton)
                 scen = None
-        elif result.Result.canBeOpened(container):
+        elif common.isResultContainer(container):
+            from .core import result
             res = result.Result()
             # Try to open the file as a result.
             try:
@@ -569,6 +569,7 @@ def start(options,args):
     # Redirect stderr to error dialog (last action before message loop is started,
     # because text sent to stderr will be lost if redirected to error dialog without
     # the message loop being started.
+    import xmlplot.errortrap
     xmlplot.errortrap.redirect_stderr('GOTM-GUI','You may be able to continue working. However, we would appreciate it if you report this error. To do so, send an e-mail to <a href="mailto:gotm-users@googlegroups.com">gotm-users@googlegroups.com</a> with the above error message, and the circumstances under which the error occurred.')
 
     # Enter the main message loop.
@@ -587,13 +588,15 @@ def main():
     parser.add_option('-v','--verbose',action='store_true',help='writes debug strings to standard output.')
     parser.add_option('-p','--profile',action='store_true',help='activates profiling.')
     parser.add_option('-d','--debug',action='store_true',help='activates debugging (e.g., reference counting).')
+    parser.add_option('--nocache',action='store_true',help='always simulates, rather than returning results of identical scenarios that were simulated before from the on-disk result cache.')
     if not hasattr(sys,'frozen'):
         parser.add_option('--nc', type='string', help='NetCDF module to use')
         parser.add_option('--schemadir', type='string', help='Path to scenario schema directory')
-    parser.set_defaults(profile=False,showoptions=False,verbose=False,debug=False,nc=None,schemadir=None)
+    parser.set_defaults(profile=False,showoptions=False,verbose=False,debug=False,nocache=False,nc=None,schemadir=None)
     (options, args) = parser.parse_args()
 
     if options.debug: xmlstore.util.referencedobject.checkreferences = True
+    if options.nocache: os.environ[common.resultcachevariable] = '0'
 
     if options.profile:
         # We will do profiling
@@ -7,7 +7,7 @@ from xmlstore.qt_compat import QtGui, QtCore, QtWidgets, qt4_backend, qt4_backen
 # Import modules from standard Python library
 import sys,xml, os.path
 
-from .core import scenario, result
+from .core import scenario
 from . import commonqt
 import xmlstore.util, xmlstore.gui_qt4
 
@@ -120,6 +120,7 @@ class ScenarioWidget(QtWidgets.QWidget):
                 path = self.pathOpen.path()
                 if path.endswith('.gotmresult'):
                     try:
+                        from .core import result
                         res = result.Result()
                         res.load(path)
                     except Exception as e:
@@ -11,6 +11,10 @@ from .core import common
 # need a very high stack size (in particular if Lagrangian variables are used)
 stacksize = 16*1024*1024
 
+# Interval (in milliseconds) at which the preview of the partial result is refreshed
+# while the simulation runs.
+previewinterval = 2000
+
 class GOTMThread(QtCore.QThread):
 
   progressed = QtCore.Signal(float,float)
@@ -25,6 +29,8 @@ class GOTMThread(QtCore.QThread):
     self.result = 0
     self.stderr = ''
     self.stdout = ''
+    self.capture = None
+    self.res = None
     
   def rungotm(self,scen):
     self.scenario = scen
@@ -35,18 +41,44 @@ class GOTMThread(QtCore.QThread):
     ret = not self.stopped
     self.rwlock.unlock()
     return ret
+
+  def setCapture(self,capture):
+    self.rwlock.lockForWrite()
+    self.capture = capture
+    self.rwlock.unlock()
+
+  def getCapture(self):
+    # Returns the core.capture.ProfileCapture object that receives the profiles simulated so
+    # far, or None if the simulation has not started (yet). It may be read from other threads.
+    self.rwlock.lockForRead()
+    ret = self.capture
+    self.rwlock.unlock()
+    return ret
     
   def run(self):
     assert self.scenario is not None, 'No scenario specified.'
     try:
-        from .core import simulator
+        from .core import simulator, cache
     except ImportError as e:
         from .core import result
         self.res = result.Result()
         self.res.errormessage = str(e)
         self.res.returncode = 1
         raise
-    self.res = simulator.simulate(self.scenario,continuecallback=self.canContinue,progresscallback=self.progressed.emit)
+    # Identical scenarios that were simulated before (e.g., when the user moves back from
+    # and then forward to the progress page) are taken from the result cache, unless it
+    # has been disabled (see common.useResultCache).
+    resultcache = None
+    if common.useResultCache(): resultcache = cache.ResultCache()
+    try:
+        self.res = simulator.simulate(self.scenario,continuecallback=self.canContinue,progresscallback=self.progressed.emit,resultcache=resultcache,livecallback=self.setCapture)
+    except Exception as e:
+        # Make sure done() does not pick up a stale result.
+        from .core import result
+        self.res = result.Result()
+        self.res.errormessage = str(e)
+        self.res.returncode = 1
+        raise
     
   def stop(self):
     self.rwlock.lockForWrite()
@@ -105,6 +137,13 @@ class PageProgress(commonqt.WizardPage):
         layout.addWidget(self.text)
         layout.setStretchFactor(self.text,1)
 
+        # Preview of the partial result; created once the first results are available.
+        self.preview = None
+        self.previewresult = None
+        self.previewtimer = QtCore.QTimer(self)
+        self.previewtimer.setInterval(previewinterval)
+        self.previewtimer.timeout.connect(self.onRefreshPreview)
+
         # Add (initially hidden) save-output button.
         self.savebutton = QtWidgets.QPushButton('Save output to file',self)
         self.savebutton.setSizePolicy(QtWidgets.QSizePolicy.Fixed,QtWidgets.QSizePolicy.Fixed)
@@ -129,6 +168,7 @@ class PageProgress(commonqt.WizardPage):
         self.gotmthread.progressed.connect(self.progressed)
         self.gotmthread.finished.connect(self.done)
         self.gotmthread.rungotm(self.scenario)
+        self.previewtimer.start()
         
     def progressed(self,progress,remaining):
         self.bar.setValue(int(round(self.bar.maximum()*progress)))
@@ -137,12 +177,45 @@ class PageProgress(commonqt.WizardPage):
             self.labelRemaining.setText('%i seconds remaining' % remaining)
         else:
             self.labelRemaining.setText('%i minutes %i seconds remaining' % divmod(remaining,60))
+
+    def onRefreshPreview(self):
+        if self.preview is not None:
+            self.preview.refresh()
+            return
+        capture = self.gotmthread.getCapture()
+        if capture is None or capture.getCount()==0: return
+
+        # First results are available: show them. The preview result is a read-only view on the
+        # profiles captured so far; the final result is read from GOTM's NetCDF output.
+        from .core import result
+        from .core import capture as corecapture
+        from . import visualizer
+        self.previewresult = result.Result()
+        self.previewresult.attachMemory(corecapture.MemoryStore(capture))
+        self.preview = visualizer.VisualizeWidget(self.previewresult,parent=self)
+        self.preview.label.setText('While the simulation runs, you can view the results obtained so far. Please choose a variable to be plotted from the menu.')
+        layout = self.layout()
+        layout.insertWidget(layout.indexOf(self.text),self.preview)
+        layout.setStretchFactor(self.preview,1)
+
+    def removePreview(self):
+        self.previewtimer.stop()
+        if self.preview is not None:
+            self.layout().removeWidget(self.preview)
+            self.preview.destroy()
+            self.preview.deleteLater()
+            self.preview = None
+        if self.previewresult is not None:
+            self.previewresult.release()
+            self.previewresult = None
             
     def done(self):
         res = self.gotmthread.res
         if common.verbose:
             print('GOTM thread shut-down; return code = %i' % res.returncode)
 
+        self.removePreview()
+
         layout = self.layout()
 
         # Hide progress bar and remaining time.
@@ -184,6 +257,7 @@ class PageProgress(commonqt.WizardPage):
             self.gotmthread.stop()
             if not self.gotmthread.isFinished(): self.gotmthread.wait()
             self.gotmthread = None
+        self.removePreview()
             
         if not mustbevalid:
             # Remove any currently stored result.
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+# Benchmark for adding input data files to simulation directories (core.scenario.LinkingDataContainer).
+# Data files of increasing size are added to a fresh directory, once by copying them (as done by
+# xmlstore.datatypes.DataContainerDirectory), and once by linking them. With linking, the time
+# taken should not depend on the size of the file.
+
+from __future__ import print_function
+
+import sys, os, os.path, time, shutil, tempfile, optparse
+
+gotmguiroot = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+sys.path.append(gotmguiroot)
+
+import xmlstore.datatypes
+import core.common, core.cache, core.scenario
+
+def measure(createcontainer,datafile,repeats):
+    """Returns the best time taken to add the data file to a fresh directory.
+    """
+    times = []
+    for i in range(repeats):
+        targetdir = tempfile.mkdtemp('','gotm-linking-',core.common.getStagingDir())
+        try:
+            container = createcontainer(targetdir)
+            time_start = time.time()
+            container.addItem(datafile,'data.dat').release()
+            times.append(time.time()-time_start)
+            container.release()
+        finally:
+            shutil.rmtree(targetdir)
+    return min(times)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]',description='Measures the time taken by GOTM-GUI to add input data files of increasing size to a simulation directory, by copying and by linking them.')
+    parser.add_option('-s','--sizes',help='comma-separated list of file sizes in MB (default: 1,10,100).')
+    parser.add_option('-n','--repeats',type='int',help='number of measurements per file size (default: 3).')
+    parser.add_option('--tmpfs',action='store_true',help='create the directories on a memory-backed file system (see core.common.getStagingDir).')
+    parser.set_defaults(sizes='1,10,100',repeats=3,tmpfs=False)
+    (options, args) = parser.parse_args()
+
+    if options.tmpfs: core.common.useTmpfsStaging()
+    sourcedir = tempfile.mkdtemp('','gotm-linking-')
+    inputcache = core.cache.InputCache(root=os.path.join(sourcedir,'cache'))
+    try:
+        for size in [int(s) for s in options.sizes.split(',')]:
+            path = os.path.join(sourcedir,'%iMB.dat' % size)
+            with open(path,'wb') as f:
+                for i in range(size): f.write(os.urandom(1024*1024))
+            datafile = xmlstore.datatypes.DataContainerDirectory.DataFileFile(path)
+            copytime = measure(xmlstore.datatypes.DataContainerDirectory,datafile,options.repeats)
+            linktime = measure(lambda targetdir: core.scenario.LinkingDataContainer(targetdir,inputcache=inputcache),datafile,options.repeats)
+            datafile.release()
+            print('%6i MB: copy %8.4f s, link %8.4f s' % (size,copytime,linktime))
+    finally:
+        shutil.rmtree(sourcedir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
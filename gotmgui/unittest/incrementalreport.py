@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+# Test for incremental report regeneration (core.report.Report.generate, argument incremental).
+# A report is generated for a result, after which the same result is loaded again, as a separate
+# batch.py invocation would do, and the report is regenerated in the same directory. No figure
+# may be rendered again: all must be reused from the first report.
+
+from __future__ import print_function
+
+import sys, os, os.path, shutil, tempfile, optparse
+
+gotmguiroot = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+sys.path.append(gotmguiroot)
+
+import core.report
+core.report.configureHeadless()
+import core.result
+
+def generate(path,outputpath):
+    """Loads the result at the specified path, and generates a report with figures of all its
+    variables in the output directory (reusing existing figures where possible).
+    """
+    res = core.result.Result()
+    res.load(path)
+    rep = core.report.Report()
+    try:
+        rep.store.root.copyFrom(res.store['ReportSettings'])
+        treestore = res.getVariableTree(plottableonly=True)
+        selroot = rep.store['Figures/Selection']
+        for node in treestore.root.getDescendants():
+            if node.canHaveValue() and not node.isHidden():
+                selroot.addChild('VariablePath').setValue('/'.join(node.location))
+        treestore.unlink()
+        rep.generate(res,outputpath,core.report.Report.getTemplates()['default'],headless=True,incremental=True)
+    finally:
+        rep.release()
+        res.release()
+
+def getFigures(outputpath):
+    return dict([(name,os.path.getmtime(os.path.join(outputpath,name))) for name in os.listdir(outputpath) if name.endswith('.png')])
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] RESULT',description='Checks that regenerating the report of a result (.gotmresult) that is loaded anew reuses all figures.')
+    (options, args) = parser.parse_args()
+    if len(args)!=1: parser.error('A path to a result must be specified.')
+
+    outputpath = tempfile.mkdtemp('','gotm-report-')
+    try:
+        generate(args[0],outputpath)
+        figures = getFigures(outputpath)
+        assert figures, 'The report does not contain any figures.'
+
+        # Count the figures of result variables that are rendered while regenerating.
+        rendered = []
+        renderResultFigure = core.report.renderResultFigure
+        def countingRenderResultFigure(fig,result,varpath,*args):
+            rendered.append(varpath)
+            renderResultFigure(fig,result,varpath,*args)
+        core.report.renderResultFigure = countingRenderResultFigure
+        try:
+            generate(args[0],outputpath)
+        finally:
+            core.report.renderResultFigure = renderResultFigure
+
+        assert not rendered, 'Figures were rendered again: %s.' % ', '.join(rendered)
+        changed = [name for name,mtime in getFigures(outputpath).items() if figures.get(name)!=mtime]
+        assert not changed, 'Figure files were rewritten: %s.' % ', '.join(changed)
+        print('All %i figures were reused.' % len(figures))
+    finally:
+        shutil.rmtree(outputpath)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
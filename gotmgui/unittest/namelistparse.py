@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+# Benchmark for the namelist parser (core.namelist). Namelist files are generated with array
+# assignments of increasing length (e.g., a long list of layer thicknesses h, or the values
+# of an initial profile), and the time taken to parse them is reported. With a parser that
+# scales linearly, the time per array element stays constant as the arrays grow.
+
+from __future__ import print_function
+
+import sys, os.path, io, time, random, optparse
+
+gotmguiroot = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+sys.path.append(gotmguiroot)
+
+import core.namelist
+
+def createNamelistFile(length,namelistcount):
+    """Returns the contents of a namelist file with the specified number of namelists, each
+    containing a few scalar settings and array assignments with the specified number of elements.
+    """
+    rnd = random.Random(length)
+    lines = []
+    for i in range(namelistcount):
+        lines.append('&profiles%i' % i)
+        lines.append('   title = \'Profile set %i, with comments\',   ! comment' % i)
+        lines.append('   nlev = %i,' % length)
+        lines.append('   h = %s,' % ', '.join(['%.6f' % rnd.uniform(0.5,2.) for j in range(length)]))
+        lines.append('   t(1:%i) = %s,' % (length,', '.join(['%.4f' % rnd.uniform(5.,25.) for j in range(length)])))
+        lines.append('   s = %i*35.0,' % length)
+        lines.append('/')
+    return '\n'.join(lines)+'\n'
+
+def parse(data):
+    """Parses all namelists in the data, and returns the number of values found.
+    """
+    nmlfile = core.namelist.NamelistFile(io.StringIO(data))
+    valuecount = 0
+    while True:
+        try:
+            nml = nmlfile.parseNextNamelist()
+        except core.namelist.NamelistParseException:
+            break
+        for varname,slic,vardata in nml:
+            if isinstance(vardata,list):
+                valuecount += len(vardata)
+            else:
+                valuecount += 1
+    return valuecount
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]',description='Measures the time taken by the GOTM-GUI namelist parser on namelists with array assignments of increasing length.')
+    parser.add_option('-l','--lengths',help='comma-separated list of array lengths (default: 1000,10000,100000).')
+    parser.add_option('-c','--count',type='int',help='number of namelists per file (default: 2).')
+    parser.add_option('-n','--repeats',type='int',help='number of measurements per array length (default: 3).')
+    parser.set_defaults(lengths='1000,10000,100000',count=2,repeats=3)
+    (options, args) = parser.parse_args()
+
+    for length in [int(l) for l in options.lengths.split(',')]:
+        data = u''.__class__(createNamelistFile(length,options.count))
+        times = []
+        for i in range(options.repeats):
+            time_start = time.time()
+            valuecount = parse(data)
+            times.append(time.time()-time_start)
+        best = min(times)
+        print('array length %8i: %8.3f s for %i values (%.2f us per value, %.1f MB)' % (length,best,valuecount,1e6*best/valuecount,len(data)/1e6))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
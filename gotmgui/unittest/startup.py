@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+# Benchmark for the cold start-up time of the GOTM-GUI entry points. Every measurement
+# starts a fresh Python interpreter, which runs an entry point and reports the heavy modules
+# (matplotlib, Qt, xmlplot, NetCDF backends) that were imported along the way.
+
+import sys, os, os.path, subprocess, time, optparse
+
+gotmguiroot = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+
+# Modules that are slow to import; the benchmark reports which of these each entry point loads.
+heavymodules = ('matplotlib','matplotlib.pyplot','PyQt4','PyQt5','PySide','PySide2','xmlplot.data','xmlplot.plot','xmlplot.gui_qt4','netCDF4','pupynere','Scientific','pygotm')
+
+# Code run in the fresh interpreter for a headless batch run: batch.py is executed as script,
+# with the supplied command line arguments.
+batchdriver = '''
+import sys, runpy
+sys.argv = [%r]+%r
+try:
+    runpy.run_path(sys.argv[0],run_name='__main__')
+except SystemExit:
+    pass
+'''
+
+# Code run in the fresh interpreter for a cold launch of the GUI: the wizard is created and shown
+# with its first page, as in gotmgui.gotmgui.start, after which the interpreter exits.
+guidriver = '''
+import sys
+sys.path.insert(0,%r)
+from gotmgui import gotmgui
+from xmlstore.qt_compat import QtWidgets
+import xmlstore.gui_qt4
+app = QtWidgets.QApplication([' '])
+wiz = gotmgui.GOTMWizard(closebutton=xmlstore.gui_qt4.needCloseButton())
+wiz.setSequence(gotmgui.commonqt.WizardSequence([gotmgui.PageIntroduction,gotmgui.PageChooseAction]))
+wiz.show()
+app.processEvents()
+wiz.destroy()
+'''
+
+# Appended to each driver: reports the heavy modules that were imported.
+reportmodules = '''
+print('HEAVYMODULES:'+','.join([name for name in %r if name in sys.modules]))
+'''
+
+def measure(code,repeats):
+    """Runs the code in a fresh interpreter the specified number of times, and returns the
+    wall times plus the heavy modules imported during the last run.
+    """
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM','offscreen')
+    times,modules = [],None
+    for i in range(repeats):
+        time_start = time.time()
+        p = subprocess.Popen([sys.executable,'-c',code+reportmodules % (heavymodules,)],stdout=subprocess.PIPE,stderr=subprocess.STDOUT,env=env)
+        output = p.communicate()[0].decode('utf-8','replace')
+        times.append(time.time()-time_start)
+        if p.returncode!=0:
+            print(output)
+            raise Exception('Entry point failed with return code %i.' % p.returncode)
+        for line in output.splitlines():
+            if line.startswith('HEAVYMODULES:'):
+                modules = [name for name in line[13:].split(',') if name]
+    return times,modules
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [SCENARIO]',description='Measures the cold start-up time of the GOTM-GUI entry points: the GUI wizard, batch.py without arguments (import cost only), and, if a SCENARIO is specified, a headless batch.py run of that scenario.')
+    parser.add_option('-n','--repeats',type='int',help='number of measurements per entry point (default: 5).')
+    parser.add_option('--nogui',action='store_false',dest='gui',help='skip the GUI wizard.')
+    parser.set_defaults(repeats=5,gui=True)
+    (options, args) = parser.parse_args()
+
+    batchpath = os.path.join(gotmguiroot,'batch.py')
+    entrypoints = [('batch.py (no arguments)',batchdriver % (batchpath,[]))]
+    if args:
+        entrypoints.append(('batch.py %s' % os.path.basename(args[0]),batchdriver % (batchpath,[os.path.abspath(args[0])])))
+    if options.gui:
+        entrypoints.append(('GUI wizard',guidriver % os.path.dirname(gotmguiroot)))
+
+    for name,code in entrypoints:
+        times,modules = measure(code,options.repeats)
+        times.sort()
+        print('%-30s min %6.3f s, median %6.3f s, max %6.3f s' % (name,times[0],times[len(times)//2],times[-1]))
+        if modules is not None: print('%-30s heavy modules imported: %s' % ('',', '.join(modules) or 'none'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+# Benchmark for the substitutions from .values files (core.namelist.NamelistSubstitutions).
+# A .values file with many substitution rules and a prototype namelist file that uses all keys
+# are generated, after which the time taken by the compiled (single pass) substitutions is
+# compared with that of making the substitutions one after the other, as done originally.
+
+from __future__ import print_function
+
+import sys, os.path, io, time, random, optparse
+
+gotmguiroot = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+sys.path.append(gotmguiroot)
+
+import core.namelist
+
+def createFiles(rulecount,variablecount):
+    """Returns the contents of a .values file with the specified number of substitutions,
+    and of a prototype namelist file with the specified number of variables, each of which
+    takes its value from one of the substitutions.
+    """
+    rnd = random.Random(rulecount)
+    keys = ['_%s%i_' % (''.join([rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for j in range(rnd.randint(2,8))]),i) for i in range(rulecount)]
+    values = '\n'.join(['s/%s/%.6g/' % (key,rnd.uniform(-100.,100.)) for key in keys])+'\n'
+    lines = ['&proto']
+    for i in range(variablecount):
+        lines.append('   var%i = %s,' % (i,rnd.choice(keys)))
+    lines.append('/')
+    return values,'\n'.join(lines)+'\n'
+
+def measure(substitute,lines,repeats):
+    """Returns the best time taken to substitute in all lines, and the result.
+    """
+    times = []
+    for i in range(repeats):
+        time_start = time.time()
+        result = [substitute(line) for line in lines]
+        times.append(time.time()-time_start)
+    return min(times),result
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]',description='Measures the time taken by GOTM-GUI to make the substitutions from .values files in prototype namelists, with and without compiling the substitutions.')
+    parser.add_option('-r','--rules',help='comma-separated list of numbers of substitution rules (default: 10,100,1000).')
+    parser.add_option('-v','--variables',type='int',help='number of variables in the prototype namelist (default: 10000).')
+    parser.add_option('-n','--repeats',type='int',help='number of measurements (default: 3).')
+    parser.set_defaults(rules='10,100,1000',variables=10000,repeats=3)
+    (options, args) = parser.parse_args()
+
+    for rulecount in [int(r) for r in options.rules.split(',')]:
+        values,proto = createFiles(rulecount,options.variables)
+
+        # Namelist files are read line by line, and substitutions are made per line (see core.namelist.NamelistFile).
+        lines = io.StringIO(u''.__class__(proto)).readlines()
+        subs = core.namelist.NamelistSubstitutions(io.StringIO(u''.__class__(values)))
+        time_start = time.time()
+        subs.compile()
+        compiletime = time.time()-time_start
+        sequentialtime,sequential = measure(subs.substituteSequentially,lines,options.repeats)
+        compiledtime,compiled = measure(subs.substitute,lines,options.repeats)
+        assert compiled==sequential, 'Compiled substitutions produce a different result.'
+        mode = 'single pass'
+        if not subs.compiled:
+            mode = 'sequential'
+        elif subs.overlapping is not None:
+            mode = 'single pass, overlap check'
+        print('%5i rules: sequential %7.3f s, compiled %7.3f s (%s; compiling took %.3f s)' % (rulecount,sequentialtime,compiledtime,mode,compiletime))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
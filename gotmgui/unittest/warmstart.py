@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+# Test for the transfer of GOTM state from a spin-up simulation to ensemble members (warm start,
+# see core.ensemble.runSpinUp and core.checkpoint). The GOTM library is represented by objects with
+# the same module attributes, so no simulation is needed. The state of a "spin-up" library is
+# restored into a "member" library with profilesonly set, as done when members branch off.
+
+from __future__ import print_function
+
+import sys, os.path
+
+import numpy
+
+gotmguiroot = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+sys.path.append(gotmguiroot)
+
+import core.checkpoint
+
+class Module(object):
+    pass
+
+def createLibrary(nlev,value):
+    """Returns an object that exposes GOTM modules with profiles and scalars set to the specified value.
+    """
+    gotm = Module()
+    gotm.meanflow = Module()
+    gotm.meanflow.h = numpy.full((nlev+1,),value)
+    gotm.meanflow.u = numpy.full((nlev+1,),value)
+    gotm.meanflow.gravity = numpy.array(value)
+    gotm.turbulence = Module()
+    gotm.turbulence.tke = numpy.full((nlev+1,),value)
+    gotm.turbulence.cm0 = numpy.array(value)
+    return gotm
+
+def main():
+    spinup,member = createLibrary(10,1.),createLibrary(10,0.)
+    state = core.checkpoint.getState(spinup)
+    profilecount = core.checkpoint.setState(member,state,profilesonly=True)
+    assert profilecount>=1, 'No profiles were transferred.'
+    for name in ('h','u'):
+        assert (getattr(member.meanflow,name)==1.).all(), 'Profile meanflow/%s was not transferred.' % name
+    assert (member.turbulence.tke==1.).all(), 'Profile turbulence/tke was not transferred.'
+    assert member.meanflow.gravity==0. and member.turbulence.cm0==0., 'Scalars were transferred, although only profiles should be.'
+
+    # A library that does not expose its state must not produce an (empty) state.
+    empty = Module()
+    try:
+        core.checkpoint.getState(empty)
+    except Exception:
+        pass
+    else:
+        raise AssertionError('getState accepted a GOTM library without state.')
+
+    # An empty state must not be restored.
+    try:
+        core.checkpoint.setState(member,{},profilesonly=True)
+    except Exception:
+        pass
+    else:
+        raise AssertionError('setState accepted an empty state.')
+
+    print('%i profiles transferred; scalars left unchanged.' % profilecount)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+
+import sys, os, os.path, time
+
+gotmguiroot = os.path.join(os.path.dirname(os.path.realpath(__file__)),'..')
+sys.path.append(gotmguiroot)
+
+import core.cache
+
+def main():
+    import optparse
+
+    parser = optparse.OptionParser(usage='%prog [options] list|evict|purge',description='Inspects or cleans the on-disk cache of converted GOTM-GUI scenarios, or (with --results) the cache of simulation results, or (with --inputs) the cache of input data files linked into simulation directories. "list" shows all entries (most recently used first), "evict" removes least recently used entries until the cache fits within the maximum size, and "purge" removes all entries.')
+    parser.add_option('-r','--results',action='store_true',help='operate on the cache of simulation results rather than that of converted scenarios.')
+    parser.add_option('-i','--inputs',action='store_true',help='operate on the cache of input data files rather than that of converted scenarios.')
+    parser.add_option('-d','--dir',type='string',help='root directory of the cache (default: a subdirectory of %s).' % core.cache.getDefaultCacheRoot())
+    parser.add_option('-m','--maxsize',type='float',help='maximum size of the cache in MB, used by "evict" (default: 1024 for scenarios and input data files, 4096 for results).')
+    parser.set_defaults(results=False,inputs=False,dir=None,maxsize=None)
+    (options, args) = parser.parse_args()
+
+    if len(args)!=1 or args[0] not in ('list','evict','purge') or (options.results and options.inputs):
+        parser.print_help()
+        return 2
+    command = args[0]
+
+    cacheclass = core.cache.ScenarioCache
+    if options.results: cacheclass = core.cache.ResultCache
+    if options.inputs: cacheclass = core.cache.InputCache
+    maxsize = None
+    if options.maxsize is not None: maxsize = int(options.maxsize*1024**2)
+    cache = cacheclass(options.dir,maxsize=maxsize)
+    if command=='list':
+        entries = cache.list()
+        for key,size,lastused in entries:
+            print('%s %10.1f MB   last used %s' % (key,size/1024.**2,time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(lastused))))
+        print('%i entries, %.1f MB in total, in "%s".' % (len(entries),sum([entry[1] for entry in entries])/1024.**2,cache.root))
+    elif command=='evict':
+        print('Removed %i entries.' % cache.evict())
+    else:
+        print('Removed %i entries.' % cache.purge())
+    return 0
+
+# If the script has been run (as opposed to imported), enter the main loop.
+if __name__ == '__main__':
+    ret = main()
+    sys.exit(ret)
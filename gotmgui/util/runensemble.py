@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+import sys, os, os.path, datetime
+
+gotmguiroot = os.path.join(os.path.dirname(os.path.realpath(__file__)),'..')
+sys.path.append(gotmguiroot)
+
+import core.common, core.ensemble
+
+def main():
+    import optparse
+
+    parser = optparse.OptionParser(usage='%prog [options] SCENARIO [SCENARIO ...]',description='Simulates an ensemble of GOTM-GUI scenarios in a pool of worker processes. Each SCENARIO is a .gotmscenario file or a directory with its extracted contents. If one or more --set options are specified, every scenario is combined with all combinations of the specified values.')
+    parser.add_option('-o','--output',type='string',help='directory to write results to (default: current directory).')
+    parser.add_option('-j','--jobs',type='int',help='number of worker processes (default: number of CPU cores).')
+    parser.add_option('-s','--set',action='append',dest='overrides',metavar='PATH=VALUE[,VALUE...]',help='scenario variable to vary, e.g., /station/depth=50,100,200. May be specified multiple times.')
+    parser.add_option('--sweep',action='store_true',help='treat --set paths as locations in the GOTM namelist version of the scenario (e.g., gotmturb/turbulence/turb_method), and write the namelists of the base scenario only once per worker process. Requires a single SCENARIO.')
+    parser.add_option('-b','--branch',type='string',metavar='TIME',help='warm start (TIME as "YYYY-MM-DD HH:MM:SS"): simulate the period before this time only once, and start all members from its final state. Members may then only differ in parameters that take effect after this time. Requires a single SCENARIO.')
+    parser.add_option('-r','--result',action='store_false',dest='cdf',help='write results in GOTM-GUI .gotmresult format, rather than NetCDF.')
+    parser.add_option('-q','--quiet',action='store_false',dest='verbose',help='suppress messages on individual ensemble members.')
+    parser.add_option('--tmpfs',action='store_true',help='stage the namelists, data files and output of each member on a memory-backed file system (/dev/shm), rather than in the default temporary directory. The directory to use can also be set with environment variable GOTMGUI_STAGINGDIR.')
+    parser.set_defaults(output='.',jobs=None,overrides=[],sweep=False,branch=None,cdf=True,verbose=True,tmpfs=False)
+    (options, args) = parser.parse_args()
+
+    # The staging directory is passed to the worker processes through the environment.
+    if options.tmpfs: core.common.useTmpfsStaging()
+
+    if not args:
+        parser.print_help()
+        return 2
+
+    # Build the list of overrides that span the grid of specified values.
+    axes = []
+    for override in options.overrides:
+        if '=' not in override:
+            print('Error! --set must be followed by PATH=VALUE[,VALUE...], but got "%s".' % override)
+            return 2
+        path,values = override.split('=',1)
+        axes.append((path,values.split(',')))
+    overrides = core.ensemble.gridOverrides(axes)
+
+    for path in args:
+        if not os.path.exists(path):
+            print('Error! The scenario path "%s" does not exist.' % path)
+            return 2
+    if options.sweep and len(args)>1:
+        print('Error! --sweep can only be used with a single scenario.')
+        return 2
+    branchtime = None
+    if options.branch is not None:
+        if len(args)>1:
+            print('Error! --branch can only be used with a single scenario.')
+            return 2
+        try:
+            branchtime = datetime.datetime.strptime(options.branch,'%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            try:
+                branchtime = datetime.datetime.strptime(options.branch,'%Y-%m-%d')
+            except ValueError:
+                print('Error! --branch must be followed by a time in format "YYYY-MM-DD HH:MM:SS", but got "%s".' % options.branch)
+                return 2
+
+    def getnames(path):
+        basename = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        if len(overrides)>1: return ['%s_%04i' % (basename,i) for i in range(len(overrides))]
+        elif len(args)>1: return [basename]
+        return None
+
+    def printmember(memberresult):
+        if not options.verbose: return
+        if memberresult.returncode==0:
+            print('%s: completed in %.1f s, result written to "%s".' % (memberresult.name,memberresult.elapsed,memberresult.path))
+        else:
+            print('%s: FAILED after %.1f s. Error: %s' % (memberresult.name,memberresult.elapsed,memberresult.errormessage))
+
+    outputdir = os.path.abspath(options.output)
+    if options.sweep:
+        path = os.path.abspath(args[0])
+        ensemble = core.ensemble.runSweep(path,overrides,outputdir,processes=options.jobs,cdf=options.cdf,callback=printmember,names=getnames(path),branchtime=branchtime)
+    else:
+        # Create ensemble members.
+        members = []
+        for path in args:
+            path = os.path.abspath(path)
+            members += core.ensemble.fromOverrides(path,overrides,getnames(path))
+        ensemble = core.ensemble.run(members,outputdir,processes=options.jobs,cdf=options.cdf,callback=printmember,branchtime=branchtime)
+    print(ensemble.getSummary())
+
+    if ensemble.getFailed(): return 1
+    return 0
+
+# If the script has been run (as opposed to imported), enter the main loop.
+if __name__ == '__main__':
+    ret = main()
+    sys.exit(ret)
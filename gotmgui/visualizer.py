@@ -5,7 +5,7 @@
 from xmlstore.qt_compat import QtGui, QtCore, QtWidgets, qt4_backend, qt4_backend_version
 
 import xmlstore.gui_qt4
-from .core import common, result, report
+from .core import common
 from . import commonqt
 
 import sys,datetime
@@ -13,6 +13,7 @@ import xml.sax
 import os.path
 
 def loadResult(path):
+    from .core import result
     res = result.Result()
 
     try:
@@ -165,6 +166,11 @@ class VisualizeWidget(QtWidgets.QWidget):
             # Restore original cursor
             QtWidgets.QApplication.restoreOverrideCursor()
 
+    def refresh(self):
+        # Redraw the current figure, e.g., because data were added to the result
+        # while a simulation is still running.
+        if self.varname is not None: self.figurepanel.figure.update()
+
     def destroy(self,destroyWindow = True,destroySubWindows = True):
         self.figurepanel.destroy()
         self.figurepanel = None
@@ -210,6 +216,7 @@ class ConfigureReportWidget(QtWidgets.QWidget):
 
         self.factory = xmlstore.gui_qt4.PropertyEditorFactory(self.report.store)
 
+        from .core import report
         reportname2path = report.Report.getTemplates()
 
         self.labTemplates = QtWidgets.QLabel('Report template:',self)
@@ -322,6 +329,7 @@ class PageReportGenerator(commonqt.WizardPage):
         
         import xmlplot.gui_qt4
         deffont = xmlplot.gui_qt4.getFontSubstitute(u''.__class__(self.fontInfo().family()))
+        from .core import report
         self.report = report.Report(defaultfont = deffont)
         
         # Copy report settings from result.